@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import json
 import yaml
 import subprocess
@@ -11,14 +12,31 @@ import bcrypt
 import secrets
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_file
-from flask_socketio import SocketIO, emit
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_file, Response, stream_with_context
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import logging
 import zipfile
 import tempfile
 import uuid
 import schedule
 import psutil
+import hashlib
+import base64
+import shutil
+import sqlite3
+import atexit
+import bisect
+import platform
+import re
+import queue
+import random
+import ssl
+import socket
+import http.client
+import urllib.parse
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
@@ -31,6 +49,90 @@ logger = logging.getLogger(__name__)
 # 全局变量存储同步任务状态
 sync_tasks = {}
 
+# Socket.IO房间：任务的日志和进度只发送给订阅了该任务的连接，
+# 管理员房间接收所有任务的进度摘要（不含日志）
+ADMIN_TASKS_ROOM = 'admin:tasks'
+
+def task_room(task_id):
+    return f'task:{task_id}'
+
+# 单个任务内的镜像并发数（可被私服配置的concurrency和请求参数覆盖）
+DEFAULT_SYNC_CONCURRENCY = int(os.getenv('SYNC_CONCURRENCY', 3))
+MAX_SYNC_CONCURRENCY = int(os.getenv('SYNC_MAX_CONCURRENCY', 10))
+
+# 清单缓存：标签引用会随推送变化，缓存时间较短；摘要引用内容不可变，几乎永久缓存
+MANIFEST_CACHE_SIZE = int(os.getenv('MANIFEST_CACHE_SIZE', 5000))
+MANIFEST_CACHE_TAG_TTL = int(os.getenv('MANIFEST_CACHE_TAG_TTL', 60))
+MANIFEST_CACHE_DIGEST_TTL = int(os.getenv('MANIFEST_CACHE_DIGEST_TTL', 30 * 24 * 3600))
+
+# 批量模式：同一仓库的标签数达到下限时合并为一次 skopeo sync，单批次标签数不超过上限
+SYNC_BATCH_MIN_TAGS = int(os.getenv('SYNC_BATCH_MIN_TAGS', 5))
+SYNC_BATCH_MAX_TAGS = int(os.getenv('SYNC_BATCH_MAX_TAGS', 50))
+
+# 重试策略默认值（可被私服配置的retry覆盖）
+SYNC_RETRY_MAX_ATTEMPTS = int(os.getenv('SYNC_RETRY_MAX_ATTEMPTS', 3))
+SYNC_RETRY_BASE_DELAY = float(os.getenv('SYNC_RETRY_BASE_DELAY', 5))
+SYNC_RETRY_MAX_DELAY = float(os.getenv('SYNC_RETRY_MAX_DELAY', 120))
+
+# 读取skopeo输出的队列长度和保留的stderr行数（用于错误分类）
+SKOPEO_OUTPUT_QUEUE_SIZE = 1000
+SKOPEO_STDERR_TAIL = 50
+
+# 按仓库展开标签时并行执行 list-tags 的仓库数
+TAG_LIST_CONCURRENCY = int(os.getenv('TAG_LIST_CONCURRENCY', 8))
+
+# 全局调度器并发限制：所有任务共享的工作线程数、单个目标私服和单个用户的并发上限
+SYNC_MAX_WORKERS = int(os.getenv('SYNC_MAX_WORKERS', 6))
+SYNC_MAX_PER_REGISTRY = int(os.getenv('SYNC_MAX_PER_REGISTRY', 4))
+SYNC_MAX_PER_USER = int(os.getenv('SYNC_MAX_PER_USER', 4))
+
+# 多目标分发时源镜像的暂存目录（默认使用系统临时目录），需要能容纳并发同步的镜像
+SYNC_STAGING_DIR = os.getenv('SYNC_STAGING_DIR', '')
+
+# 多架构同步时并发复制的平台数
+SYNC_PLATFORM_CONCURRENCY = int(os.getenv('SYNC_PLATFORM_CONCURRENCY', 4))
+
+# 取消任务时skopeo进程收到SIGTERM后的退出宽限期（秒），超时发送SIGKILL
+SKOPEO_TERMINATE_GRACE = int(os.getenv('SKOPEO_TERMINATE_GRACE', 5))
+
+# 任务日志库：SQLite文件路径、后台批量提交间隔（秒）和已结束任务的保留天数
+TASK_DB_PATH = os.getenv('TASK_DB_PATH', 'config/tasks.db')
+TASK_JOURNAL_FLUSH_INTERVAL = float(os.getenv('TASK_JOURNAL_FLUSH_INTERVAL', 0.5))
+TASK_JOURNAL_RETENTION_DAYS = int(os.getenv('TASK_JOURNAL_RETENTION_DAYS', 7))
+# 每个任务在内存中保留的最近日志条数，完整日志在任务日志库中分页查询或下载
+TASK_LOG_BUFFER_SIZE = int(os.getenv('TASK_LOG_BUFFER_SIZE', 500))
+# WebSocket推送合并：日志和进度按任务缓存，每隔多少秒合并为一个sync_batch事件发送，
+# 缓存的日志达到多少条时提前发送
+SOCKET_FLUSH_INTERVAL = float(os.getenv('SOCKET_FLUSH_INTERVAL', 0.2))
+SOCKET_FLUSH_MAX_LOGS = int(os.getenv('SOCKET_FLUSH_MAX_LOGS', 200))
+
+# 生成同步计划时并发检查的镜像数
+SYNC_PLAN_CONCURRENCY = int(os.getenv('SYNC_PLAN_CONCURRENCY', 32))
+
+# skopeo能力探测结果的刷新间隔（秒）和 --retry-times 传给skopeo的层级重试次数
+SKOPEO_PROBE_INTERVAL = int(os.getenv('SKOPEO_PROBE_INTERVAL', 3600))
+SKOPEO_RETRY_TIMES = int(os.getenv('SKOPEO_RETRY_TIMES', 2))
+
+# 复制超时按镜像大小和私服实测吞吐量计算：下限 + 预计耗时 × 倍数，不超过上限；
+# 尚无实测数据时按默认吞吐量（MB/秒）估算，平滑系数越大越偏向最近一次的测量值
+SYNC_TIMEOUT_MIN = int(os.getenv('SYNC_TIMEOUT_MIN', 300))
+SYNC_TIMEOUT_MAX = int(os.getenv('SYNC_TIMEOUT_MAX', 6 * 3600))
+SYNC_TIMEOUT_FACTOR = float(os.getenv('SYNC_TIMEOUT_FACTOR', 3))
+SYNC_DEFAULT_THROUGHPUT_MB = float(os.getenv('SYNC_DEFAULT_THROUGHPUT_MB', 2))
+SYNC_THROUGHPUT_ALPHA = float(os.getenv('SYNC_THROUGHPUT_ALPHA', 0.3))
+
+# 开始同步前读取所有镜像的大小，按从大到小的顺序执行，避免最后才开始的大镜像拖长任务耗时
+SYNC_LARGEST_FIRST = os.getenv('SYNC_LARGEST_FIRST', 'true').lower() in ('1', 'true', 'yes')
+
+# webhook：请求需携带的令牌（未配置时禁用webhook），事件合并窗口和最长等待秒数
+WEBHOOK_TOKEN = os.getenv('WEBHOOK_TOKEN', '')
+WEBHOOK_COALESCE_WINDOW = float(os.getenv('WEBHOOK_COALESCE_WINDOW', 10))
+WEBHOOK_COALESCE_MAX_DELAY = float(os.getenv('WEBHOOK_COALESCE_MAX_DELAY', 60))
+
+# 内置仓库客户端：是否用于元数据查询（关闭时全部使用skopeo）和每个地址保留的空闲连接数
+REGISTRY_CLIENT_ENABLED = os.getenv('REGISTRY_CLIENT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+REGISTRY_CLIENT_POOL_SIZE = int(os.getenv('REGISTRY_CLIENT_POOL_SIZE', 8))
+
 # 仓库配置管理类
 class RegistryConfig:
     """私服配置管理类"""
@@ -285,32 +387,1713 @@ user_manager = UserManager()
 # 创建仓库配置管理实例
 registry_config = RegistryConfig()
 
+# 清单媒体类型
+MANIFEST_LIST_TYPES = (
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.index.v1+json'
+)
+
+# 本机平台（skopeo copy 不带 --all 时按本机平台从清单列表中选择镜像）
+HOST_ARCH = {'x86_64': 'amd64', 'amd64': 'amd64', 'aarch64': 'arm64', 'arm64': 'arm64'}.get(
+    platform.machine().lower(), platform.machine().lower())
+
+def parse_manifest(raw):
+    """解析镜像清单原文，返回摘要、媒体类型、总大小、层列表和平台列表"""
+    manifest = json.loads(raw)
+    media_type = manifest.get('mediaType', '')
+    if not media_type and 'manifests' in manifest:
+        media_type = 'application/vnd.oci.image.index.v1+json'
+    info = {
+        'digest': 'sha256:' + hashlib.sha256(raw).hexdigest(),
+        'media_type': media_type,
+        'size': 0,
+        'config': '',
+        'layers': [],
+        'platforms': []
+    }
+    if media_type in MANIFEST_LIST_TYPES:
+        for item in manifest.get('manifests', []):
+            plat = item.get('platform', {})
+            info['platforms'].append({
+                'os': plat.get('os', ''),
+                'architecture': plat.get('architecture', ''),
+                'variant': plat.get('variant', ''),
+                'digest': item.get('digest', ''),
+                'size': item.get('size', 0)
+            })
+    else:
+        config_size = manifest.get('config', {}).get('size', 0)
+        info['config'] = manifest.get('config', {}).get('digest', '')
+        info['layers'] = [(layer.get('digest', ''), layer.get('size', 0)) for layer in manifest.get('layers', [])]
+        info['size'] = config_size + sum(size for _, size in info['layers'])
+    return info
+
+def same_image_content(source_info, target_info):
+    """两个单平台清单是否引用相同的配置和层
+
+    skopeo copy --format v2s2 会把OCI清单转换为Docker v2清单，目标摘要与源摘要不同，
+    但配置和层的摘要不变，以此判断目标是否已是源镜像的副本。
+    """
+    if not source_info or not target_info or target_info['platforms'] or not source_info['config']:
+        return False
+    return (source_info['config'] == target_info['config']
+            and [digest for digest, _ in source_info['layers']] == [digest for digest, _ in target_info['layers']])
+
+def select_host_platform(platforms):
+    """从清单列表中选出本机平台对应的条目"""
+    for item in platforms:
+        if item['os'] == 'linux' and item['architecture'] == HOST_ARCH:
+            return item
+    return None
+
+def platform_name(item):
+    """清单列表条目的平台名称，如 linux/arm64/v8"""
+    name = f"{item['os']}/{item['architecture']}"
+    return f"{name}/{item['variant']}" if item.get('variant') else name
+
+def normalize_platforms(value):
+    """把请求参数或私服配置中的platforms转换为 None、'all' 或平台名称列表"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        if value.strip() == 'all':
+            return 'all'
+        value = value.split(',')
+    platforms = [item.strip().strip('/') for item in value if item and item.strip()]
+    return platforms or None
+
+def select_platforms(platforms, requested):
+    """按平台名称筛选清单列表条目，'all'选择全部；只写 os/arch 时匹配该架构的所有变体"""
+    if requested == 'all':
+        return list(platforms)
+    return [item for item in platforms
+            if any(platform_name(item) == wanted or platform_name(item).startswith(wanted + '/') for wanted in requested)]
+
+def filter_manifest_list(raw, digests):
+    """生成只包含指定子清单的清单列表原文，全部保留时原样返回以保持摘要不变"""
+    manifest = json.loads(raw)
+    kept = [item for item in manifest.get('manifests', []) if item.get('digest') in digests]
+    if len(kept) == len(manifest.get('manifests', [])):
+        return raw
+    manifest['manifests'] = kept
+    return json.dumps(manifest, indent=3).encode('utf-8')
+
+def build_proxy_env(proxy_config, exclude_hosts=()):
+    """根据代理配置构建子进程环境变量，exclude_hosts会追加到代理排除列表"""
+    env = os.environ.copy()
+    if not proxy_config:
+        return env
+    if proxy_config.get('http_proxy'):
+        env['HTTP_PROXY'] = env['http_proxy'] = proxy_config['http_proxy']
+    if proxy_config.get('https_proxy'):
+        env['HTTPS_PROXY'] = env['https_proxy'] = proxy_config['https_proxy']
+    no_proxy_list = [addr.strip() for addr in proxy_config.get('no_proxy', '').split(',') if addr.strip()]
+    for host in exclude_hosts:
+        if host not in no_proxy_list:
+            no_proxy_list.append(host)
+    if no_proxy_list:
+        env['NO_PROXY'] = env['no_proxy'] = ','.join(no_proxy_list)
+    return env
+
+def parse_image_reference(image):
+    """拆分镜像引用为 (registry, repository, reference)，按Docker Hub规则补全默认值"""
+    name, reference = image, 'latest'
+    if '@' in name:
+        name, reference = name.split('@', 1)
+    else:
+        last = name.rsplit('/', 1)[-1]
+        if ':' in last:
+            name, reference = name.rsplit(':', 1)
+    parts = name.split('/', 1)
+    if len(parts) > 1 and ('.' in parts[0] or ':' in parts[0] or parts[0] == 'localhost'):
+        registry, repository = parts
+    else:
+        registry, repository = 'docker.io', name
+    if registry in ('docker.io', 'index.docker.io', 'registry-1.docker.io'):
+        registry = 'docker.io'
+        if '/' not in repository:
+            repository = f'library/{repository}'
+    return registry, repository, reference
+
+class ManifestCache:
+    """镜像清单信息缓存（TTL + LRU）
+
+    以 (registry, repository, reference) 为键缓存清单摘要、大小和平台列表，以及清单原文
+    （仓库端快速复制直接复用，不再重复拉取）。标签引用使用较短的TTL，摘要引用内容不可变，使用很长的TTL。
+    使用认证信息读取的清单按认证信息的指纹分开缓存，只有使用相同认证信息的查询才能命中，
+    不会把一个用户有权读取的清单提供给其他用户。
+    """
+    def __init__(self, max_entries=MANIFEST_CACHE_SIZE, tag_ttl=MANIFEST_CACHE_TAG_TTL, digest_ttl=MANIFEST_CACHE_DIGEST_TTL):
+        self.max_entries = max(1, max_entries)
+        self.tag_ttl = tag_ttl
+        self.digest_ttl = digest_ttl
+        self.entries = OrderedDict()  # (registry, repository, reference, 认证指纹) -> (过期时间, 清单信息, 清单原文)
+        self.scopes = {''}  # 出现过的认证指纹，按引用失效时逐个移除
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    @staticmethod
+    def scope(creds):
+        """认证信息的指纹，匿名读取时为空字符串"""
+        if not creds or not creds.get('username') or not creds.get('password'):
+            return ''
+        return hashlib.sha256(f"{creds['username']}:{creds['password']}".encode('utf-8')).hexdigest()[:16]
+    
+    def lookup(self, key, creds=None):
+        """返回未过期的 (过期时间, 清单信息, 清单原文)，过期条目视为未命中"""
+        key = key + (self.scope(creds),)
+        with self.lock:
+            item = self.entries.get(key)
+            if item and item[0] > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return item
+            if item:
+                del self.entries[key]
+            self.misses += 1
+            return None
+    
+    def get(self, key, creds=None):
+        """读取缓存的清单信息"""
+        item = self.lookup(key, creds)
+        return item[1] if item else None
+    
+    def get_raw(self, key, creds=None):
+        """读取缓存的清单原文（字节），未缓存原文时返回None"""
+        item = self.lookup(key, creds)
+        return item[2] if item else None
+    
+    def put(self, key, info, raw=None, creds=None):
+        """写入缓存，同时以摘要为引用写入一份长期缓存"""
+        now = time.time()
+        registry, repository, reference = key
+        scope = self.scope(creds)
+        with self.lock:
+            ttl = self.digest_ttl if reference.startswith('sha256:') else self.tag_ttl
+            self.scopes.add(scope)
+            key = key + (scope,)
+            self.entries[key] = (now + ttl, info, raw)
+            self.entries.move_to_end(key)
+            digest_key = (registry, repository, info['digest'], scope)
+            self.entries[digest_key] = (now + self.digest_ttl, info, raw)
+            self.entries.move_to_end(digest_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self, registry, repository, reference=None):
+        """使缓存失效：指定引用时只移除该引用，否则移除整个仓库的条目（所有认证信息的条目都移除）"""
+        with self.lock:
+            if reference is not None:
+                for scope in self.scopes:
+                    self.entries.pop((registry, repository, reference, scope), None)
+                return
+            for key in [k for k in self.entries if k[0] == registry and k[1] == repository]:
+                del self.entries[key]
+    
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
+
+# 单平台清单媒体类型（仓库端快速复制只处理skopeo不会转换格式的清单）
+DOCKER_MANIFEST_TYPE = 'application/vnd.docker.distribution.manifest.v2+json'
+OCI_MANIFEST_TYPE = 'application/vnd.oci.image.manifest.v1+json'
+
+# 记录层在目标私服中所在仓库的条目数上限，用于跨仓库挂载
+BLOB_LOCATION_CACHE_SIZE = 20000
+
+# 读取清单时接受的媒体类型（与skopeo inspect --raw一致，不让仓库做格式转换）
+MANIFEST_ACCEPT = ', '.join([
+    'application/vnd.oci.image.index.v1+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.docker.distribution.manifest.v1+prettyjws',
+    'application/vnd.docker.distribution.manifest.v1+json'
+])
+
+class RegistryClientError(Exception):
+    """内置仓库客户端无法完成请求（网络、TLS或认证方式不支持），调用方应回退到skopeo"""
+
+class RegistryClient:
+    """Registry V2 API 客户端，用于清单、标签和层的元数据查询
+
+    每个 (协议, 地址, 代理) 保留一组持久连接复用TLS握手，Bearer令牌按
+    (地址, 作用域, 用户名) 缓存到过期前。代理从skopeo使用的同一份环境变量中读取；
+    私服配置了insecure时跳过证书校验，HTTPS不可用时改用HTTP。
+    镜像传输仍由skopeo完成。
+    """
+    # 地址连接失败后暂停使用内置客户端的秒数，期间直接回退到skopeo
+    UNAVAILABLE_BACKOFF = 60
+    
+    def __init__(self, pool_size=REGISTRY_CLIENT_POOL_SIZE):
+        self.pool_size = max(1, pool_size)
+        self.pools = {}  # (scheme, host, proxy) -> [空闲连接]
+        self.tokens = {}  # (host, scope, username) -> (过期时间, 令牌)
+        self.challenges = {}  # host -> ('bearer', 参数) 或 ('basic', None)
+        self.schemes = {}  # host -> 'https'/'http'
+        self.unavailable = {}  # host -> 恢复尝试的时间
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+    
+    @staticmethod
+    def api_host(registry):
+        """Docker Hub的API地址与镜像引用中的地址不同"""
+        return 'registry-1.docker.io' if registry == 'docker.io' else registry
+    
+    def is_insecure(self, registry, creds=None):
+        """私服配置或认证信息中标记为insecure的地址不校验证书"""
+        if creds and creds.get('insecure'):
+            return True
+        return any(r.get('insecure') and r.get('url', '').split('/')[0] == registry
+                   for r in registry_config.registries)
+    
+    @staticmethod
+    def proxy_for(scheme, host, env):
+        """按环境变量中的代理设置选择代理地址，NO_PROXY命中时返回None"""
+        env = env if env is not None else os.environ
+        bare_host = host.split(':')[0]
+        for entry in (env.get('NO_PROXY') or env.get('no_proxy') or '').split(','):
+            entry = entry.strip().lstrip('.')
+            if entry == '*' or (entry and (bare_host == entry.split(':')[0] or bare_host.endswith('.' + entry.split(':')[0]))):
+                return None
+        if scheme == 'https':
+            proxy = env.get('HTTPS_PROXY') or env.get('https_proxy')
+        else:
+            proxy = env.get('HTTP_PROXY') or env.get('http_proxy')
+        return proxy or None
+    
+    def acquire(self, scheme, host, proxy, insecure, timeout):
+        """从连接池取出空闲连接，没有时新建"""
+        key = (scheme, host, proxy)
+        with self.lock:
+            idle = self.pools.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn
+        
+        connect_host = host
+        if proxy:
+            parsed = urllib.parse.urlsplit(proxy if '://' in proxy else f'http://{proxy}')
+            connect_host = parsed.netloc.rsplit('@', 1)[-1]
+        if scheme == 'https':
+            context = ssl.create_default_context()
+            if insecure:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            conn = http.client.HTTPSConnection(connect_host, timeout=timeout, context=context)
+            if proxy:
+                conn.set_tunnel(host)
+        else:
+            conn = http.client.HTTPConnection(connect_host, timeout=timeout)
+        with self.lock:
+            self.connections += 1
+        return conn
+    
+    def release(self, scheme, host, proxy, conn):
+        """归还连接，连接池已满时关闭"""
+        with self.lock:
+            idle = self.pools.setdefault((scheme, host, proxy), [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+    
+    def send(self, method, url, headers, env, insecure, timeout, body=None):
+        """发送一次请求并读完响应体，返回 (状态码, 响应头, 响应体)"""
+        parsed = urllib.parse.urlsplit(url)
+        scheme, host = parsed.scheme, parsed.netloc
+        path = parsed.path + (f'?{parsed.query}' if parsed.query else '')
+        proxy = self.proxy_for(scheme, host, env)
+        if scheme == 'http' and proxy:
+            # HTTP代理直接转发绝对地址的请求
+            path = url
+        headers = dict(headers, Host=host)
+        
+        # 空闲连接可能已被服务端关闭，复用的连接失败时用新连接重试一次
+        while True:
+            conn = self.acquire(scheme, host, proxy, insecure, timeout)
+            reused = conn.sock is not None
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                conn.close()
+                # 超时说明对方确实无响应，换新连接也无济于事
+                if reused and not isinstance(e, socket.timeout):
+                    continue
+                raise RegistryClientError(f'{method} {url}: {e}') from e
+            with self.lock:
+                self.requests += 1
+            if response.will_close:
+                conn.close()
+            else:
+                self.release(scheme, host, proxy, conn)
+            return response.status, response.headers, body
+    
+    def request(self, method, registry, path, creds=None, env=None, scope=None, timeout=30, accept=None, body=None, content_type=None):
+        """向仓库发送API请求，按需完成Bearer/Basic认证，返回 (状态码, 响应头, 响应体)
+
+        scope可以包含多个以空格分隔的作用域，如跨仓库挂载时同时申请两个仓库的权限。
+        """
+        host = self.api_host(registry)
+        insecure = self.is_insecure(registry, creds)
+        headers = {'User-Agent': 'docker-image-sync'}
+        if accept:
+            headers['Accept'] = accept
+        if content_type:
+            headers['Content-Type'] = content_type
+        if method in ('PUT', 'POST'):
+            headers['Content-Length'] = str(len(body or b''))
+        username = creds.get('username') if creds else None
+        
+        auth = self.cached_auth(host, scope, creds)
+        if auth:
+            headers['Authorization'] = auth
+        status, response_headers, response_body = self.send_with_scheme(method, host, path, headers, env, insecure, timeout, body)
+        if status != 401:
+            return status, response_headers, response_body
+        
+        # 按质询获取令牌后重试一次
+        challenge = parse_www_authenticate(response_headers.get('WWW-Authenticate', ''))
+        if not challenge:
+            raise RegistryClientError(f'{host} 返回401但没有可识别的认证质询')
+        with self.lock:
+            self.challenges[host] = challenge
+        if challenge[0] == 'bearer':
+            token = self.fetch_token(host, challenge[1], scope, creds, env, insecure, timeout)
+            headers['Authorization'] = f'Bearer {token}'
+        elif username:
+            headers['Authorization'] = basic_auth_header(creds)
+        else:
+            return status, response_headers, response_body
+        return self.send_with_scheme(method, host, path, headers, env, insecure, timeout, body)
+    
+    def send_with_scheme(self, method, host, path, headers, env, insecure, timeout, body=None):
+        """使用该地址已知可用的协议发送请求，insecure地址的HTTPS不可用时改用HTTP"""
+        with self.lock:
+            scheme = self.schemes.get(host, 'https')
+            retry_at = self.unavailable.get(host, 0)
+        if retry_at > time.time():
+            raise RegistryClientError(f'{host} 暂时不可用')
+        try:
+            try:
+                return self.send(method, f'{scheme}://{host}{path}', headers, env, insecure, timeout, body)
+            except RegistryClientError:
+                if scheme != 'https' or not insecure:
+                    raise
+            result = self.send(method, f'http://{host}{path}', headers, env, insecure, timeout, body)
+        except RegistryClientError:
+            with self.lock:
+                self.unavailable[host] = time.time() + self.UNAVAILABLE_BACKOFF
+            raise
+        with self.lock:
+            self.schemes[host] = 'http'
+        return result
+    
+    def cached_auth(self, host, scope, creds):
+        """根据已知的认证质询和令牌缓存预先生成Authorization头，省去一次401往返"""
+        username = creds.get('username') if creds else None
+        with self.lock:
+            challenge = self.challenges.get(host)
+            token = self.tokens.get((host, scope, username))
+        if not challenge:
+            return None
+        if challenge[0] == 'basic':
+            return basic_auth_header(creds) if username else None
+        if token and token[0] > time.time():
+            return f'Bearer {token[1]}'
+        return None
+    
+    def fetch_token(self, host, params, scope, creds, env, insecure, timeout):
+        """向认证服务申请Bearer令牌并缓存"""
+        realm = params.get('realm')
+        if not realm:
+            raise RegistryClientError(f'{host} 的认证质询缺少realm')
+        query = [('service', params['service'])] if params.get('service') else []
+        query.extend(('scope', item) for item in (scope or '').split())
+        url = realm + ('&' if '?' in realm else '?') + urllib.parse.urlencode(query)
+        headers = {'User-Agent': 'docker-image-sync'}
+        username = creds.get('username') if creds else None
+        if username:
+            headers['Authorization'] = basic_auth_header(creds)
+        status, _, body = self.send('GET', url, headers, env, insecure, timeout)
+        if status != 200:
+            raise RegistryClientError(f'{host} 令牌服务返回 {status}')
+        try:
+            data = json.loads(body)
+        except ValueError as e:
+            raise RegistryClientError(f'{host} 令牌服务响应无法解析') from e
+        token = data.get('token') or data.get('access_token')
+        if not token:
+            raise RegistryClientError(f'{host} 令牌服务未返回令牌')
+        # 提前30秒过期，避免使用即将失效的令牌
+        expires_in = max(30, int(data.get('expires_in') or 60))
+        with self.lock:
+            self.tokens[(host, scope, username)] = (time.time() + expires_in - 30, token)
+        return token
+    
+    def get_manifest(self, image, creds=None, env=None, timeout=30):
+        """读取清单原文（字节），镜像不存在时返回None"""
+        registry, repository, reference = parse_image_reference(image)
+        status, _, body = self.request('GET', registry, f'/v2/{repository}/manifests/{reference}', creds, env,
+                                       f'repository:{repository}:pull', timeout, MANIFEST_ACCEPT)
+        if status == 200:
+            return body
+        if status in (404, 401, 403):
+            return None
+        raise RegistryClientError(f'读取清单 {image} 返回 {status}')
+    
+    def head_manifest(self, image, creds=None, env=None, timeout=30):
+        """只读取清单摘要（HEAD请求），镜像不存在时返回None"""
+        registry, repository, reference = parse_image_reference(image)
+        status, headers, _ = self.request('HEAD', registry, f'/v2/{repository}/manifests/{reference}', creds, env,
+                                          f'repository:{repository}:pull', timeout, MANIFEST_ACCEPT)
+        if status in (404, 401, 403):
+            return None
+        digest = headers.get('Docker-Content-Digest')
+        if status != 200 or not digest:
+            raise RegistryClientError(f'读取清单摘要 {image} 返回 {status}')
+        return digest
+    
+    def list_tags(self, repository, creds=None, env=None, timeout=60):
+        """列出仓库的全部标签，按Link头分页读取"""
+        registry, repository, _ = parse_image_reference(repository)
+        scope = f'repository:{repository}:pull'
+        tags = []
+        path = f'/v2/{repository}/tags/list?n=1000'
+        while path:
+            status, headers, body = self.request('GET', registry, path, creds, env, scope, timeout)
+            if status in (401, 403, 404):
+                raise RuntimeError(f'列出标签失败: 仓库不存在或无权访问（{status}）')
+            if status != 200:
+                raise RegistryClientError(f'列出标签 {registry}/{repository} 返回 {status}')
+            tags.extend(json.loads(body).get('tags') or [])
+            match = re.search(r'<([^>]+)>\s*;\s*rel="?next"?', headers.get('Link', ''))
+            path = None
+            if match:
+                parsed = urllib.parse.urlsplit(match.group(1))
+                path = parsed.path + (f'?{parsed.query}' if parsed.query else '')
+        return tags
+    
+    def blob_exists(self, registry, repository, digest, creds=None, env=None, timeout=30):
+        """检查仓库中是否已有指定的层"""
+        status, _, _ = self.request('HEAD', registry, f'/v2/{repository}/blobs/{digest}', creds, env,
+                                    f'repository:{repository}:pull', timeout)
+        if status in (200, 307):
+            return True
+        if status in (404, 401, 403):
+            return False
+        raise RegistryClientError(f'检查层 {registry}/{repository}@{digest[:19]} 返回 {status}')
+    
+    def mount_blob(self, registry, repository, digest, from_repository, creds=None, env=None, timeout=30):
+        """把同一仓库地址中另一个仓库的层挂载到目标仓库（不传输数据），成功返回True"""
+        query = urllib.parse.urlencode({'mount': digest, 'from': from_repository})
+        scope = f'repository:{repository}:pull,push repository:{from_repository}:pull'
+        status, headers, _ = self.request('POST', registry, f'/v2/{repository}/blobs/uploads/?{query}', creds, env, scope, timeout)
+        if status == 201:
+            return True
+        if status == 202 and headers.get('Location'):
+            # 无法挂载时仓库会开始一次普通上传，取消这次上传
+            parsed = urllib.parse.urlsplit(headers['Location'])
+            try:
+                self.request('DELETE', registry, parsed.path + (f'?{parsed.query}' if parsed.query else ''), creds, env, scope, timeout)
+            except RegistryClientError:
+                pass
+        return False
+    
+    def put_manifest(self, image, raw, media_type, creds=None, env=None, timeout=30):
+        """上传清单原文到指定标签，清单引用的层必须已在目标仓库中"""
+        registry, repository, reference = parse_image_reference(image)
+        status, _, body = self.request('PUT', registry, f'/v2/{repository}/manifests/{reference}', creds, env,
+                                       f'repository:{repository}:pull,push', timeout, body=raw, content_type=media_type)
+        if status not in (200, 201):
+            raise RegistryClientError(f'上传清单 {image} 返回 {status}: {body[:200].decode("utf-8", "replace")}')
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'connections': self.connections,
+                'idle_connections': sum(len(idle) for idle in self.pools.values()),
+                'cached_tokens': len(self.tokens)
+            }
+
+def basic_auth_header(creds):
+    # 与skopeo认证文件中的auth字段编码相同
+    return f'Basic {TaskAuthFiles.encode(creds)}'
+
+def parse_www_authenticate(header):
+    """解析WWW-Authenticate头，返回 ('bearer', 参数) 或 ('basic', None)，无法识别时返回None"""
+    scheme, _, rest = header.strip().partition(' ')
+    scheme = scheme.lower()
+    if scheme == 'basic':
+        return 'basic', None
+    if scheme != 'bearer':
+        return None
+    return 'bearer', dict(re.findall(r'(\w+)="([^"]*)"', rest))
+
+# skopeo sync 开始复制某个镜像时输出的日志，如 Copying image ref 1/3 from="docker://..." to="docker://..."
+SKOPEO_SYNC_PROGRESS_PATTERN = re.compile(r'Copying image (?:ref|tag) \d+/\d+.*?from[= ]"?docker://([^"\s]+)')
+
+SEMVER_PATTERN = re.compile(r'^v?(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:-([0-9A-Za-z.-]+))?$')
+SEMVER_COMPARATOR_PATTERN = re.compile(r'^(>=|<=|>|<|=|\^|~)?v?([0-9xX*]+(?:\.[0-9xX*]+){0,2})$')
+
+def parse_semver(tag):
+    """解析语义化版本标签（允许v前缀和省略次版本/修订号），无法解析返回None
+
+    返回 (major, minor, patch, prerelease)，prerelease为空字符串表示正式版本
+    """
+    match = SEMVER_PATTERN.match(tag)
+    if not match:
+        return None
+    major, minor, patch, prerelease = match.groups()
+    return int(major), int(minor or 0), int(patch or 0), prerelease or ''
+
+def semver_key(version):
+    """版本排序键：同一版本号的正式版本排在预发布版本之后"""
+    major, minor, patch, prerelease = version
+    return major, minor, patch, prerelease == '', prerelease
+
+def semver_satisfies(version, range_expr):
+    """判断版本是否满足范围表达式
+
+    支持 >=、>、<=、<、= 比较符，^ 和 ~ 前缀，1.x / 1.2.x 通配，
+    空格表示“且”，|| 表示“或”，例如 ">=1.20 <2 || ^3.1"
+    """
+    base = semver_key(version)[:3]
+    for alternative in range_expr.split('||'):
+        comparators = alternative.split()
+        if comparators and all(semver_comparator_matches(base, c) for c in comparators):
+            return True
+    return False
+
+def validate_semver_range(range_expr):
+    """校验范围表达式，无法解析时抛出ValueError（无效的表达式不匹配任何版本，会让标签过滤结果为空）"""
+    if not isinstance(range_expr, str) or not range_expr.strip():
+        raise ValueError('semver 必须是非空的范围表达式')
+    for alternative in range_expr.split('||'):
+        comparators = alternative.split()
+        if not comparators:
+            raise ValueError(f'semver 范围表达式无效: {range_expr}')
+        for comparator in comparators:
+            if not SEMVER_COMPARATOR_PATTERN.match(comparator):
+                raise ValueError(f'semver 范围表达式中的条件无效: {comparator}')
+
+def semver_comparator_matches(base, comparator):
+    """判断 (major, minor, patch) 是否满足单个比较条件"""
+    match = SEMVER_COMPARATOR_PATTERN.match(comparator)
+    if not match:
+        return False
+    op, spec = match.group(1) or '=', match.group(2)
+    raw_parts = spec.split('.')
+    wildcard_at = next((i for i, p in enumerate(raw_parts) if p in ('x', 'X', '*')), None)
+    parts = [int(p) for p in raw_parts[:wildcard_at]] if wildcard_at is not None else [int(p) for p in raw_parts]
+    
+    if op == '^':
+        lower = tuple(parts + [0] * (3 - len(parts)))
+        if lower[0] > 0 or len(parts) == 1:
+            upper = (lower[0] + 1, 0, 0)
+        elif lower[1] > 0 or len(parts) == 2:
+            upper = (0, lower[1] + 1, 0)
+        else:
+            upper = (0, 0, lower[2] + 1)
+        return lower <= base < upper
+    if op == '~':
+        lower = tuple(parts + [0] * (3 - len(parts)))
+        upper = (lower[0] + 1, 0, 0) if len(parts) == 1 else (lower[0], lower[1] + 1, 0)
+        return lower <= base < upper
+    if op == '=' and len(parts) < 3:
+        # 1.2 或 1.2.x 表示前缀匹配
+        return base[:len(parts)] == tuple(parts)
+    
+    target = tuple(parts + [0] * (3 - len(parts)))
+    return {
+        '>=': base >= target,
+        '>': base > target,
+        '<=': base <= target,
+        '<': base < target,
+        '=': base == target
+    }[op]
+
+def filter_tags(tags, tag_filter):
+    """按过滤规则筛选标签
+
+    tag_filter支持:
+      regex: 只保留匹配该正则的标签
+      exclude: 排除匹配该正则的标签
+      semver: 语义化版本范围表达式（只保留可解析为版本号的标签）
+      include_prerelease: 是否保留预发布版本（默认否，仅在使用semver/latest时生效）
+      latest: 按语义化版本从新到旧只保留前N个
+    """
+    tag_filter = tag_filter or {}
+    result = list(tags)
+    if tag_filter.get('regex'):
+        pattern = re.compile(tag_filter['regex'])
+        result = [t for t in result if pattern.search(t)]
+    if tag_filter.get('exclude'):
+        pattern = re.compile(tag_filter['exclude'])
+        result = [t for t in result if not pattern.search(t)]
+    
+    if tag_filter.get('semver') or tag_filter.get('latest'):
+        versions = []
+        for tag in result:
+            version = parse_semver(tag)
+            if not version:
+                continue
+            if version[3] and not tag_filter.get('include_prerelease'):
+                continue
+            if tag_filter.get('semver') and not semver_satisfies(version, tag_filter['semver']):
+                continue
+            versions.append((semver_key(version), tag))
+        versions.sort(reverse=True)
+        if tag_filter.get('latest'):
+            versions = versions[:int(tag_filter['latest'])]
+        result = [tag for _, tag in versions]
+    return result
+
+# skopeo复制blob时的输出，如 "Copying blob sha256:4f4f... done" 或 "Copying blob 4f4fb700ef54 12.0MiB / 45.3MiB"
+BLOB_LINE_PATTERN = re.compile(r'Copying (blob|config) (?:sha256:)?([0-9a-f]{6,64})(.*)$')
+BLOB_SIZE_PATTERN = re.compile(r'([\d.]+)\s*([KMGT]?i?B)\s*/\s*([\d.]+)\s*([KMGT]?i?B)')
+SIZE_UNITS = {'B': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+              'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3, 'TiB': 1024 ** 4}
+
+class CopyProgress:
+    """解析skopeo复制输出，统计单个镜像的传输字节数和速率
+
+    层大小优先取自清单（按摘要前缀匹配），输出中带有 "已传输 / 总量" 时以输出为准。
+    """
+    def __init__(self, layers=None):
+        self.sizes = {digest.split(':')[-1][:12]: size for digest, size in (layers or [])}
+        self.total_known = sum(self.sizes.values())
+        self.blobs = {}  # 摘要前缀 -> [已传输字节, 总字节, 是否完成, 是否跳过]
+        self.start_time = time.time()
+    
+    def feed(self, line):
+        """处理一行输出，进度发生变化时返回True"""
+        match = BLOB_LINE_PATTERN.search(line)
+        if not match:
+            return False
+        key = match.group(2)[:12]
+        rest = match.group(3)
+        blob = self.blobs.setdefault(key, [0, self.sizes.get(key, 0), False, False])
+        size_match = BLOB_SIZE_PATTERN.search(rest)
+        if size_match:
+            blob[0] = float(size_match.group(1)) * SIZE_UNITS.get(size_match.group(2), 1)
+            blob[1] = float(size_match.group(3)) * SIZE_UNITS.get(size_match.group(4), 1)
+        if any(word in rest for word in ('done', 'skipped', 'already exists')):
+            blob[2] = True
+            blob[3] = 'done' not in rest
+            blob[0] = blob[1]
+        return True
+    
+    def transferred_bytes(self):
+        """实际传输的字节数，目标已存在而跳过的层不计入"""
+        return sum(blob[0] for blob in self.blobs.values() if not blob[3])
+    
+    def snapshot(self):
+        """当前进度：已传输字节、总字节、速率(字节/秒)和blob计数"""
+        bytes_done = sum(blob[0] for blob in self.blobs.values())
+        bytes_total = max(self.total_known, sum(blob[1] for blob in self.blobs.values()))
+        elapsed = max(time.time() - self.start_time, 0.001)
+        return {
+            'bytes_done': int(bytes_done),
+            'bytes_total': int(bytes_total),
+            'percent': round(bytes_done * 100 / bytes_total, 1) if bytes_total else 0,
+            'throughput': int(bytes_done / elapsed),
+            'blobs_done': sum(1 for blob in self.blobs.values() if blob[2]),
+            'blobs_total': max(len(self.sizes), len(self.blobs))
+        }
+
+# skopeo错误分类：按顺序匹配stderr中的关键字
+ERROR_CLASS_RULES = [
+    ('auth', ['unauthorized', 'authentication required', 'denied', 'invalid username/password']),
+    ('not_found', ['manifest unknown', 'name unknown', 'not found']),
+    ('eof', ['unexpected eof']),
+    ('timeout', ['timeout', 'deadline exceeded', 'timed out']),
+    ('network', ['dial tcp', 'connection reset', 'connection refused', 'no such host', 'broken pipe', 'network is unreachable']),
+    ('server', ['500 internal server error', '502 bad gateway', '503 service unavailable', '504 gateway timeout', 'too many requests'])
+]
+
+ERROR_CLASS_LABELS = {
+    'auth': '认证失败',
+    'not_found': '镜像不存在',
+    'eof': '连接意外中断',
+    'timeout': '网络超时',
+    'network': '网络连接失败',
+    'server': '仓库服务端错误',
+    'generic': '其他错误'
+}
+
+# 默认只对临时性错误重试
+TRANSIENT_ERROR_CLASSES = ('eof', 'timeout', 'network', 'server')
+
+def classify_skopeo_error(stderr_text):
+    """根据skopeo的stderr内容判断错误类型"""
+    text = (stderr_text or '').lower()
+    for error_class, keywords in ERROR_CLASS_RULES:
+        if any(keyword in text for keyword in keywords):
+            return error_class
+    return 'generic'
+
+class RetryPolicy:
+    """重试策略：最大尝试次数、带抖动的指数退避和可重试的错误类型"""
+    def __init__(self, max_attempts=SYNC_RETRY_MAX_ATTEMPTS, base_delay=SYNC_RETRY_BASE_DELAY,
+                 max_delay=SYNC_RETRY_MAX_DELAY, retry_on=TRANSIENT_ERROR_CLASSES):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = max(0.0, float(base_delay))
+        self.max_delay = max(self.base_delay, float(max_delay))
+        self.retry_on = tuple(retry_on)
+    
+    @classmethod
+    def for_registry(cls, registry):
+        """从私服配置的retry字段构建策略，未配置的字段使用默认值"""
+        config = registry.get('retry') or {}
+        return cls(
+            max_attempts=config.get('max_attempts', SYNC_RETRY_MAX_ATTEMPTS),
+            base_delay=config.get('base_delay', SYNC_RETRY_BASE_DELAY),
+            max_delay=config.get('max_delay', SYNC_RETRY_MAX_DELAY),
+            retry_on=config.get('retry_on', TRANSIENT_ERROR_CLASSES)
+        )
+    
+    def should_retry(self, error_class, attempt):
+        return attempt < self.max_attempts and error_class in self.retry_on
+    
+    def backoff(self, attempt):
+        """第attempt次失败后的等待时间：指数增长，取上限后在后一半区间内随机抖动"""
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return cap / 2 + random.uniform(0, cap / 2)
+
+class SyncMetrics:
+    """同步过程的计数器，用于导出Prometheus指标"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # (指标名, 标签值) -> 计数
+    
+    def inc(self, name, label='', value=1):
+        with self.lock:
+            key = (name, label)
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def snapshot(self, name):
+        """返回指定指标的 {标签值: 计数}"""
+        with self.lock:
+            return {label: count for (metric, label), count in self.counters.items() if metric == name}
+
+class ThroughputTracker:
+    """各私服的实测传输吞吐量（指数加权移动平均），用于按镜像大小计算复制超时"""
+    # 传输量太小时耗时主要是认证和清单请求，不能反映带宽
+    MIN_SAMPLE_BYTES = 1024 * 1024
+    
+    def __init__(self, alpha=SYNC_THROUGHPUT_ALPHA, default_throughput=SYNC_DEFAULT_THROUGHPUT_MB * 1024 * 1024):
+        self.alpha = min(1.0, max(0.01, alpha))
+        self.default_throughput = max(1.0, default_throughput)
+        self.lock = threading.Lock()
+        self.rates = {}  # 私服名称 -> [字节/秒, 样本数]
+    
+    def observe(self, key, bytes_transferred, seconds):
+        """记录一次成功复制的传输量和耗时"""
+        if bytes_transferred < self.MIN_SAMPLE_BYTES or seconds <= 0:
+            return
+        rate = bytes_transferred / seconds
+        with self.lock:
+            entry = self.rates.get(key)
+            if entry is None:
+                self.rates[key] = [rate, 1]
+            else:
+                entry[0] = self.alpha * rate + (1 - self.alpha) * entry[0]
+                entry[1] += 1
+    
+    def estimate(self, key):
+        """私服的吞吐量估计（字节/秒），没有样本时使用默认值"""
+        with self.lock:
+            entry = self.rates.get(key)
+            return entry[0] if entry else self.default_throughput
+    
+    def timeout_for(self, key, size, images=1):
+        """按大小计算复制超时秒数，大小未知时返回None"""
+        if not size:
+            return None
+        expected = size / self.estimate(key)
+        return int(min(SYNC_TIMEOUT_MAX, SYNC_TIMEOUT_MIN * images + expected * SYNC_TIMEOUT_FACTOR))
+    
+    def snapshot(self):
+        with self.lock:
+            return {key: {'throughput': int(rate), 'samples': samples} for key, (rate, samples) in self.rates.items()}
+
+SKOPEO_VERSION_PATTERN = re.compile(r'(\d+)\.(\d+)\.(\d+)')
+SKOPEO_FLAG_PATTERN = re.compile(r'(--[a-z0-9][a-z0-9-]*)')
+
+class SkopeoCapabilities:
+    """skopeo版本和支持参数的探测结果缓存
+
+    探测需要fork多个skopeo进程，结果在进程内共享，超过刷新间隔后才重新探测。
+    任务、健康检查和监控指标都读取这里的缓存，不再各自执行 skopeo --version。
+    """
+    def __init__(self, refresh_interval=SKOPEO_PROBE_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.info = None
+        self.probed_at = 0
+
+    def get(self, refresh=True):
+        """返回探测结果；refresh为False时只在从未探测过时探测一次"""
+        with self.lock:
+            stale = time.time() - self.probed_at > self.refresh_interval
+            if self.info is None or (refresh and stale):
+                self.info = self.probe()
+                self.probed_at = time.time()
+            return self.info
+
+    def invalidate(self):
+        with self.lock:
+            self.probed_at = 0
+
+    def probe(self):
+        info = {'available': False, 'version': None, 'copy_flags': set(), 'sync_flags': set()}
+        try:
+            result = subprocess.run(['skopeo', '--version'], capture_output=True, text=True, timeout=10)
+        except (FileNotFoundError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"skopeo不可用: {e}")
+            return info
+        if result.returncode != 0:
+            return info
+        info['available'] = True
+        match = SKOPEO_VERSION_PATTERN.search(result.stdout)
+        if match:
+            info['version'] = tuple(int(part) for part in match.groups())
+
+        for command, key in (('copy', 'copy_flags'), ('sync', 'sync_flags')):
+            try:
+                result = subprocess.run(['skopeo', command, '--help'], capture_output=True, text=True, timeout=10)
+                info[key] = set(SKOPEO_FLAG_PATTERN.findall(result.stdout + result.stderr))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"探测 skopeo {command} 参数超时")
+
+        version = '.'.join(str(part) for part in info['version']) if info['version'] else 'unknown'
+        logger.info(f"skopeo {version}，copy参数 {len(info['copy_flags'])} 个，sync参数 {len(info['sync_flags'])} 个")
+        return info
+
+    def supports(self, flag, command='copy'):
+        info = self.get()
+        return flag in info.get(f'{command}_flags', ())
+
+    def supports_zstd(self, refresh=True, command='copy'):
+        """zstd压缩需要 --dest-compress-format 参数，且skopeo 1.4 之前的版本不支持该算法"""
+        info = self.get(refresh)
+        return '--dest-compress-format' in info[f'{command}_flags'] and (info['version'] or (0,)) >= (1, 4, 0)
+
+    def summary(self):
+        info = self.get(refresh=False)
+        return {
+            'available': info['available'],
+            'version': '.'.join(str(part) for part in info['version']) if info['version'] else None,
+            'retry_times': '--retry-times' in info['copy_flags'],
+            'multi_arch': '--multi-arch' in info['copy_flags'],
+            'preserve_digests': '--preserve-digests' in info['copy_flags'],
+            'zstd': self.supports_zstd(refresh=False),
+            'probed_at': datetime.fromtimestamp(self.probed_at).isoformat() if self.probed_at else None
+        }
+
+class LogRecord:
+    """任务日志条目（内存中的紧凑表示）
+
+    只保存序号、时间戳（epoch秒）、级别和消息，级别字符串驻留共享。格式化的时间和字典
+    只在序列化（API响应、WebSocket推送、写入日志库）时生成，同一秒内的时间文本复用。
+    """
+    __slots__ = ('seq', 'created', 'level', 'message')
+    TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+    # (整数秒, 格式化文本)，整体替换保证多线程读到的一致
+    time_cache = (None, '')
+    
+    def __init__(self, seq, created, level, message):
+        self.seq = seq
+        self.created = created
+        self.level = sys.intern(level)
+        self.message = message
+    
+    @property
+    def timestamp(self):
+        second = int(self.created)
+        cached_second, text = LogRecord.time_cache
+        if cached_second != second:
+            text = time.strftime(self.TIME_FORMAT, time.localtime(second))
+            LogRecord.time_cache = (second, text)
+        return text
+    
+    def to_dict(self):
+        return {'seq': self.seq, 'timestamp': self.timestamp, 'level': self.level, 'message': self.message}
+    
+    @classmethod
+    def from_dict(cls, entry):
+        """从日志库读出的字典还原"""
+        try:
+            created = datetime.strptime(entry['timestamp'], cls.TIME_FORMAT).timestamp()
+        except (KeyError, ValueError):
+            created = time.time()
+        return cls(entry.get('seq', 0), created, entry.get('level', 'info'), entry.get('message', ''))
+
+class TaskJournal:
+    """同步任务日志库（SQLite WAL模式）
+
+    记录任务参数、状态摘要、每个镜像的状态和任务日志，服务重启后可以查询历史任务、
+    恢复中断的任务。写操作进入队列，由后台线程按 TASK_JOURNAL_FLUSH_INTERVAL 合并提交。
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            username TEXT,
+            status TEXT NOT NULL,
+            params TEXT NOT NULL,
+            summary TEXT NOT NULL,
+            owner_pid INTEGER,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS task_images (
+            task_id TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            image TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            PRIMARY KEY (task_id, image)
+        );
+        CREATE TABLE IF NOT EXISTS task_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            level TEXT NOT NULL,
+            message TEXT NOT NULL,
+            seq INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS idx_task_logs_task ON task_logs (task_id, id);
+        CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);
+        CREATE TABLE IF NOT EXISTS mirror_snapshots (
+            job_id TEXT NOT NULL,
+            image TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (job_id, image)
+        );
+    """
+    # 只存在于内存中的运行时字段，不写入摘要
+    RUNTIME_FIELDS = ('logs', 'image_states', 'image_progress', 'current_images', 'current_image')
+    FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+    # 写入队列中的flush请求标记
+    FLUSH = object()
+    
+    def __init__(self, path=TASK_DB_PATH, flush_interval=TASK_JOURNAL_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.conn = None
+        self.conn_pid = None
+        self.writer = None
+    
+    def connect(self):
+        """返回当前进程的连接（gunicorn预加载后fork的worker重新建立连接），调用方需持有lock"""
+        if self.conn is None or self.conn_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 日志库（含 -wal/-shm 文件）只允许当前用户读写：创建期间使用严格的umask，之后再收紧已有文件的权限
+            old_umask = os.umask(0o077)
+            try:
+                self.conn = sqlite3.connect(self.path, check_same_thread=False)
+                self.conn.execute('PRAGMA journal_mode=WAL')
+                self.conn.execute('PRAGMA synchronous=NORMAL')
+                self.conn.executescript(self.SCHEMA)
+            finally:
+                os.umask(old_umask)
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.path + suffix):
+                    os.chmod(self.path + suffix, 0o600)
+            self.migrate(self.conn)
+            self.conn_pid = os.getpid()
+        return self.conn
+    
+    def migrate(self, conn):
+        """升级旧版本创建的日志库：task_logs增加日志序号列，按写入顺序回填；去掉旧任务参数中的明文密码"""
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(task_logs)')]
+        with conn:
+            if 'seq' not in columns:
+                conn.execute('ALTER TABLE task_logs ADD COLUMN seq INTEGER')
+            conn.execute(
+                'UPDATE task_logs SET seq = (SELECT COUNT(*) FROM task_logs AS earlier '
+                'WHERE earlier.task_id = task_logs.task_id AND earlier.id < task_logs.id) WHERE seq IS NULL')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_task_logs_seq ON task_logs (task_id, seq)')
+            # 旧版本保存的任务参数中可能有明文密码：已结束的任务清空参数，未结束的去掉密码
+            placeholders = ','.join('?' * len(self.FINAL_STATUSES))
+            conn.execute(f"UPDATE tasks SET params = '{{}}' WHERE status IN ({placeholders}) AND params != '{{}}'", self.FINAL_STATUSES)
+            for task_id, params in conn.execute(
+                    f"SELECT task_id, params FROM tasks WHERE status NOT IN ({placeholders}) AND (params LIKE '%password%' OR params LIKE '%@%')",
+                    self.FINAL_STATUSES).fetchall():
+                redacted, changed = self.redact_params(json.loads(params))
+                if changed:
+                    conn.execute('UPDATE tasks SET params = ? WHERE task_id = ?', (json.dumps(redacted, ensure_ascii=False), task_id))
+    
+    @staticmethod
+    def redact_params(params):
+        """去掉任务参数中的密码（源仓库认证密码、代理地址中的密码），返回 (新参数, 是否去掉了密码)
+
+        去掉密码的任务带 credentials_redacted 标记，服务重启后不会自动恢复。
+        """
+        params = dict(params)
+        changed = False
+        source_auth = params.get('source_auth')
+        if isinstance(source_auth, dict) and source_auth.get('password'):
+            params['source_auth'] = {key: value for key, value in source_auth.items() if key != 'password'}
+            changed = True
+        proxy_config = params.get('proxy_config')
+        if isinstance(proxy_config, dict):
+            proxy_config = dict(proxy_config)
+            for key in ('http_proxy', 'https_proxy'):
+                url = proxy_config.get(key)
+                parts = urllib.parse.urlsplit(url) if isinstance(url, str) else None
+                if parts and parts.password:
+                    netloc = f"{parts.username}@{parts.hostname}" + (f":{parts.port}" if parts.port else '')
+                    proxy_config[key] = urllib.parse.urlunsplit(parts._replace(netloc=netloc))
+                    changed = True
+            params['proxy_config'] = proxy_config
+        if changed:
+            params['credentials_redacted'] = True
+        return params, changed
+    
+    def submit(self, sql, params):
+        if self.writer is None or not self.writer.is_alive():
+            with self.lock:
+                if self.writer is None or not self.writer.is_alive():
+                    self.writer = threading.Thread(target=self.writer_loop, name='task-journal-writer', daemon=True)
+                    self.writer.start()
+        self.queue.put((sql, params))
+    
+    def writer_loop(self):
+        while True:
+            ops = []
+            waiters = []
+            op = self.queue.get()
+            deadline = time.time() + self.flush_interval
+            while True:
+                if op[0] is self.FLUSH:
+                    # 立即提交已收集的写操作，再通知等待的flush调用方
+                    waiters.append(op[1])
+                    break
+                ops.append(op)
+                if len(ops) >= 1000:
+                    break
+                try:
+                    op = self.queue.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+            if ops:
+                self.execute(ops)
+            for done in waiters:
+                done.set()
+    
+    def execute(self, ops):
+        try:
+            with self.lock:
+                conn = self.connect()
+                with conn:
+                    for sql, params in ops:
+                        # params可以是函数，在写入线程中才生成参数（如日志时间的格式化）
+                        conn.execute(sql, params() if callable(params) else params)
+        except sqlite3.Error as e:
+            logger.error(f"写入任务日志库失败: {e}")
+    
+    def flush(self, timeout=10):
+        """等待此前提交的写操作全部写入日志库
+
+        写入线程运行时由它按提交顺序写入（包括它正在合并的一批），调用方等待完成；
+        写入线程未运行时（如进程退出阶段）在当前线程直接写入。
+        """
+        if self.writer is not None and self.writer.is_alive():
+            done = threading.Event()
+            self.queue.put((self.FLUSH, done))
+            if done.wait(timeout):
+                return
+        ops = []
+        while True:
+            try:
+                op = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if op[0] is self.FLUSH:
+                op[1].set()
+            else:
+                ops.append(op)
+        if ops:
+            self.execute(ops)
+    
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.connect().execute(sql, params).fetchall()
+    
+    def summarize(self, task):
+        summary = {key: value for key, value in task.items() if key not in self.RUNTIME_FIELDS}
+        return json.dumps(summary, default=str, ensure_ascii=False)
+    
+    def create_task(self, task_id, username, params, task):
+        now = datetime.now().isoformat()
+        self.submit(
+            'INSERT OR REPLACE INTO tasks (task_id, username, status, params, summary, owner_pid, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (task_id, username, task['status'], json.dumps(self.redact_params(params)[0], ensure_ascii=False),
+             self.summarize(task), os.getpid(), now, now)
+        )
+    
+    def save_task(self, task_id, task):
+        self.submit(
+            'UPDATE tasks SET status = ?, summary = ?, owner_pid = ?, updated_at = ? WHERE task_id = ?',
+            (task['status'], self.summarize(task), os.getpid(), datetime.now().isoformat(), task_id)
+        )
+        if task['status'] in self.FINAL_STATUSES:
+            # 参数只用于恢复中断的任务，任务结束后清空
+            self.submit("UPDATE tasks SET params = '{}' WHERE task_id = ?", (task_id,))
+    
+    def set_images(self, task_id, images):
+        for position, image in enumerate(images):
+            self.submit('INSERT OR IGNORE INTO task_images (task_id, position, image) VALUES (?, ?, ?)', (task_id, position, image))
+    
+    def set_image_state(self, task_id, image, state):
+        self.submit('UPDATE task_images SET state = ? WHERE task_id = ? AND image = ?', (state, task_id, image))
+    
+    def append_log(self, task_id, record):
+        self.submit('INSERT INTO task_logs (task_id, seq, timestamp, level, message) VALUES (?, ?, ?, ?, ?)',
+                    lambda: (task_id, record.seq, record.timestamp, record.level, record.message))
+    
+    def load_task(self, task_id):
+        """从日志库还原任务字典（含日志和镜像状态），不存在时返回None"""
+        rows = self.query('SELECT summary FROM tasks WHERE task_id = ?', (task_id,))
+        if not rows:
+            return None
+        task = json.loads(rows[0][0])
+        for key in ('start_time', 'end_time'):
+            if task.get(key):
+                task[key] = datetime.fromisoformat(task[key])
+        # 与内存中的任务一致，只还原最近的 TASK_LOG_BUFFER_SIZE 条日志
+        task['log_total'] = self.count_logs(task_id)
+        task['logs'] = deque((LogRecord.from_dict(entry) for entry in
+                              self.load_logs(task_id, max(0, task['log_total'] - TASK_LOG_BUFFER_SIZE), TASK_LOG_BUFFER_SIZE)),
+                             maxlen=TASK_LOG_BUFFER_SIZE)
+        # 摘要按时间间隔写入，结果列表和进度以逐条记录的镜像状态为准
+        images = self.load_images(task_id)
+        task['image_states'] = {image: state for image, state in images if state != 'pending'}
+        for bucket, state in (('synced', 'synced'), ('skipped', 'skipped'), ('errors', 'failed')):
+            task[bucket] = [image for image, image_state in images if image_state == state]
+        if images:
+            task['total'] = len(images)
+            task['progress'] = len(task['image_states'])
+        task['current_image'] = ''
+        task['current_images'] = []
+        return task
+    
+    def count_logs(self, task_id):
+        """任务的日志条数（最大日志序号+1）"""
+        return self.query('SELECT COALESCE(MAX(seq) + 1, 0) FROM task_logs WHERE task_id = ?', (task_id,))[0][0]
+    
+    def load_logs(self, task_id, since=0, limit=TASK_LOG_BUFFER_SIZE):
+        """按日志序号读取序号不小于since的日志，最多limit条"""
+        return [
+            {'seq': seq, 'timestamp': timestamp, 'level': level, 'message': message}
+            for seq, timestamp, level, message in self.query(
+                'SELECT seq, timestamp, level, message FROM task_logs WHERE task_id = ? AND seq >= ? ORDER BY seq LIMIT ?',
+                (task_id, since, limit))
+        ]
+    
+    def iter_logs(self, task_id, batch_size=1000):
+        """逐批读取任务的全部日志（用于下载），不一次性载入内存"""
+        since = 0
+        while True:
+            entries = self.load_logs(task_id, since, batch_size)
+            yield from entries
+            if len(entries) < batch_size:
+                return
+            since = entries[-1]['seq'] + 1
+    
+    def load_params(self, task_id):
+        rows = self.query('SELECT params FROM tasks WHERE task_id = ?', (task_id,))
+        return json.loads(rows[0][0]) if rows else None
+    
+    def load_images(self, task_id):
+        """按提交顺序返回 [(镜像, 状态)]"""
+        return self.query('SELECT image, state FROM task_images WHERE task_id = ? ORDER BY position', (task_id,))
+    
+    def unfinished_tasks(self):
+        """返回未结束任务的 [(task_id, owner_pid)]"""
+        placeholders = ','.join('?' * len(self.FINAL_STATUSES))
+        return self.query(f'SELECT task_id, owner_pid FROM tasks WHERE status NOT IN ({placeholders}) ORDER BY created_at',
+                          self.FINAL_STATUSES)
+    
+    def purge(self, retention_days=TASK_JOURNAL_RETENTION_DAYS):
+        """删除超过保留期的已结束任务，返回删除的任务数"""
+        cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+        placeholders = ','.join('?' * len(self.FINAL_STATUSES))
+        expired = [row[0] for row in self.query(
+            f'SELECT task_id FROM tasks WHERE status IN ({placeholders}) AND updated_at < ?', self.FINAL_STATUSES + (cutoff,))]
+        for task_id in expired:
+            for table in ('task_logs', 'task_images', 'tasks'):
+                self.submit(f'DELETE FROM {table} WHERE task_id = ?', (task_id,))
+        return len(expired)
+    
+    def load_snapshot(self, job_id):
+        """定时镜像任务上次同步成功的 {镜像: 摘要}"""
+        return dict(self.query('SELECT image, digest FROM mirror_snapshots WHERE job_id = ?', (job_id,)))
+    
+    def save_snapshot(self, job_id, digests):
+        now = datetime.now().isoformat()
+        for image, digest in digests.items():
+            self.submit('INSERT OR REPLACE INTO mirror_snapshots (job_id, image, digest, updated_at) VALUES (?, ?, ?, ?)',
+                        (job_id, image, digest, now))
+    
+    def delete_snapshot(self, job_id, images=None):
+        """删除定时镜像任务的快照，指定images时只删除这些镜像（如源仓库中已不存在的标签）"""
+        if images is None:
+            self.submit('DELETE FROM mirror_snapshots WHERE job_id = ?', (job_id,))
+            return
+        for image in images:
+            self.submit('DELETE FROM mirror_snapshots WHERE job_id = ? AND image = ?', (job_id, image))
+
+class TaskAuthFiles:
+    """任务级的skopeo认证文件
+
+    每个任务在私有临时目录中维护源和目标两个 containers-auth.json 格式的认证文件，
+    每个仓库地址只在首次使用时写入一次。skopeo通过 --src-authfile/--dest-authfile 读取，
+    密码不再出现在进程命令行中。任务结束时删除整个目录。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tasks = {}  # task_id -> {'dir': 目录, 'entries': {side: {host: auth}}}
+    
+    def path(self, task_id, side, host, creds):
+        """返回包含host认证信息的认证文件路径和是否新写入，creds为空时返回 (None, False)"""
+        auth = self.encode(creds)
+        if not auth:
+            return None, False
+        with self.lock:
+            state = self.tasks.get(task_id)
+            if state is None:
+                state = self.tasks[task_id] = {'dir': tempfile.mkdtemp(prefix='skopeo-auth-'), 'entries': {}}
+            entries = state['entries'].setdefault(side, {})
+            path = os.path.join(state['dir'], f'{side}-auth.json')
+            if entries.get(host) == auth:
+                return path, False
+            entries[host] = auth
+            # 先写临时文件再替换，正在运行的skopeo不会读到写了一半的文件
+            tmp_path = path + '.tmp'
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'auths': {h: {'auth': a} for h, a in entries.items()}}, f)
+            os.replace(tmp_path, path)
+            return path, True
+    
+    @staticmethod
+    def encode(creds):
+        """返回认证文件中的auth字段，creds缺少用户名或密码时返回None"""
+        if not creds or not creds.get('username') or not creds.get('password'):
+            return None
+        return base64.b64encode(f"{creds['username']}:{creds['password']}".encode('utf-8')).decode('ascii')
+    
+    @contextmanager
+    def temporary(self, host, creds):
+        """不属于任务的单次skopeo调用使用的临时认证文件（0600），退出时删除；creds为空时得到None"""
+        auth = self.encode(creds)
+        if not auth:
+            yield None
+            return
+        fd, path = tempfile.mkstemp(prefix='skopeo-auth-', suffix='.json')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'auths': {host: {'auth': auth}}}, f)
+            yield path
+        finally:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    
+    def release(self, task_id):
+        """删除任务的认证文件"""
+        with self.lock:
+            state = self.tasks.pop(task_id, None)
+        if state:
+            shutil.rmtree(state['dir'], ignore_errors=True)
+
+class SyncScheduler:
+    """全局同步调度器
+
+    所有任务的镜像同步工作项统一排队，由固定数量的工作线程执行。
+    调度时同时检查全局、单个目标私服、单个用户和单个任务的并发上限，
+    并在可运行的任务之间轮转，避免一个大批量任务占满所有工作线程。
+    """
+    def __init__(self, max_workers=SYNC_MAX_WORKERS, max_per_registry=SYNC_MAX_PER_REGISTRY, max_per_user=SYNC_MAX_PER_USER):
+        self.max_workers = max(1, max_workers)
+        self.max_per_registry = max(1, max_per_registry)
+        self.max_per_user = max(1, max_per_user)
+        self.cond = threading.Condition()
+        self.tasks = OrderedDict()  # task_id -> 调度条目，顺序即轮转顺序
+        self.running_total = 0
+        self.running_by_registry = {}
+        self.running_by_user = {}
+        self.submit_seq = 0
+        self.workers = []
+    
+    def ensure_workers(self):
+        """按需启动工作线程（避免gunicorn预加载时在主进程中创建线程）"""
+        if self.workers:
+            return
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self.worker_loop, name=f'sync-worker-{i}', daemon=True)
+            worker.start()
+            self.workers.append(worker)
+    
+    def submit_task(self, task_id, items, username=None, registries=None, task_limit=1):
+        """提交任务的工作项
+
+        items: 无参可调用对象列表，每个对象执行一个同步工作项
+        registries: {私服名称: 该私服的并发上限}，任务涉及的目标私服
+        """
+        with self.cond:
+            self.ensure_workers()
+            self.submit_seq += 1
+            entry = {
+                'task_id': task_id,
+                'username': username or 'anonymous',
+                'registries': registries or {},
+                'task_limit': max(1, task_limit),
+                'pending': deque(items),
+                'running': 0,
+                'started': False,
+                'seq': self.submit_seq,
+                'done': threading.Event()
+            }
+            if not entry['pending']:
+                entry['done'].set()
+                return entry
+            self.tasks[task_id] = entry
+            self.cond.notify_all()
+            return entry
+    
+    def wait(self, entry):
+        """等待任务的所有工作项执行完毕（或被取消）"""
+        entry['done'].wait()
+    
+    def cancel_task(self, task_id):
+        """丢弃任务中尚未开始的工作项，返回丢弃的数量"""
+        with self.cond:
+            entry = self.tasks.get(task_id)
+            if not entry:
+                return 0
+            dropped = len(entry['pending'])
+            entry['pending'].clear()
+            self.finish_if_idle(entry)
+            self.cond.notify_all()
+            return dropped
+    
+    def queue_position(self, task_id):
+        """返回任务在排队任务中的位置（从1开始），未排队返回0"""
+        with self.cond:
+            entry = self.tasks.get(task_id)
+            if not entry or entry['started']:
+                return 0
+            return 1 + sum(1 for other in self.tasks.values()
+                           if not other['started'] and other['seq'] < entry['seq'])
+    
+    def stats(self):
+        """调度器状态统计"""
+        with self.cond:
+            return {
+                'running': self.running_total,
+                'max_workers': self.max_workers,
+                'queued_items': sum(len(e['pending']) for e in self.tasks.values()),
+                'queued_tasks': sum(1 for e in self.tasks.values() if not e['started']),
+                'by_registry': dict(self.running_by_registry),
+                'by_user': dict(self.running_by_user)
+            }
+    
+    def can_run(self, entry):
+        """检查条目是否满足各级并发上限"""
+        if not entry['pending'] or entry['running'] >= entry['task_limit']:
+            return False
+        if self.running_by_user.get(entry['username'], 0) >= self.max_per_user:
+            return False
+        for name, limit in entry['registries'].items():
+            if self.running_by_registry.get(name, 0) >= max(1, limit or self.max_per_registry):
+                return False
+        return True
+    
+    def pick_next(self):
+        """按轮转顺序选出下一个可执行的工作项"""
+        if self.running_total >= self.max_workers:
+            return None, None
+        for task_id, entry in self.tasks.items():
+            if self.can_run(entry):
+                # 被调度的任务移到队尾，实现任务间公平轮转
+                self.tasks.move_to_end(task_id)
+                return entry, entry['pending'].popleft()
+        return None, None
+    
+    def acquire(self, entry):
+        entry['running'] += 1
+        entry['started'] = True
+        self.running_total += 1
+        self.running_by_user[entry['username']] = self.running_by_user.get(entry['username'], 0) + 1
+        for name in entry['registries']:
+            self.running_by_registry[name] = self.running_by_registry.get(name, 0) + 1
+    
+    def release(self, entry):
+        entry['running'] -= 1
+        self.running_total -= 1
+        self.running_by_user[entry['username']] -= 1
+        if not self.running_by_user[entry['username']]:
+            del self.running_by_user[entry['username']]
+        for name in entry['registries']:
+            self.running_by_registry[name] -= 1
+            if not self.running_by_registry[name]:
+                del self.running_by_registry[name]
+        self.finish_if_idle(entry)
+    
+    def finish_if_idle(self, entry):
+        if not entry['pending'] and entry['running'] == 0:
+            self.tasks.pop(entry['task_id'], None)
+            entry['done'].set()
+    
+    def worker_loop(self):
+        """工作线程主循环"""
+        while True:
+            with self.cond:
+                entry, item = self.pick_next()
+                while item is None:
+                    self.cond.wait()
+                    entry, item = self.pick_next()
+                self.acquire(entry)
+            try:
+                item()
+            except Exception as e:
+                logger.error(f"任务 {entry['task_id']} 的同步工作项执行异常: {e}")
+            finally:
+                with self.cond:
+                    self.release(entry)
+                    self.cond.notify_all()
+
+class TaskEventBatcher:
+    """合并任务的WebSocket推送
+
+    日志、任务进度和镜像传输进度先按任务缓存，由后台线程每隔 SOCKET_FLUSH_INTERVAL 秒
+    合并为一个 sync_batch 事件发送到任务房间。日志逐条保留，两次发送之间的进度只保留最新值；
+    缓存的日志达到 SOCKET_FLUSH_MAX_LOGS 条时提前发送。所有发送都在同一线程中进行，
+    保证批次顺序与日志序号一致。
+    """
+    def __init__(self, interval=SOCKET_FLUSH_INTERVAL, max_logs=SOCKET_FLUSH_MAX_LOGS):
+        self.interval = interval
+        self.max_logs = max_logs
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.pending = {}  # task_id -> {'logs': [], 'progress': dict或None, 'images': {(镜像, 平台): 进度}}
+        self.thread = None
+        self.events = 0
+        self.frames = 0
+    
+    def buffer(self, task_id):
+        """返回任务的缓存，调用方需持有lock"""
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self.flush_loop, name='socket-event-batcher', daemon=True)
+            self.thread.start()
+        return self.pending.setdefault(task_id, {'logs': [], 'progress': None, 'images': {}})
+    
+    def add_log(self, task_id, log_entry):
+        with self.lock:
+            entry = self.buffer(task_id)
+            entry['logs'].append(log_entry)
+            self.events += 1
+            full = len(entry['logs']) >= self.max_logs
+        if full:
+            self.wakeup.set()
+    
+    def set_progress(self, task_id, progress_data):
+        with self.lock:
+            self.buffer(task_id)['progress'] = progress_data
+            self.events += 1
+    
+    def set_image_progress(self, task_id, image, platform, snapshot):
+        with self.lock:
+            self.buffer(task_id)['images'][(image, platform)] = snapshot
+            self.events += 1
+    
+    def flush_loop(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"发送WebSocket推送失败: {e}")
+    
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for task_id, entry in pending.items():
+            batch = {'task_id': task_id}
+            if entry['logs']:
+                batch['logs'] = [record.to_dict() for record in entry['logs']]
+            if entry['progress']:
+                batch['progress'] = entry['progress']
+            if entry['images']:
+                batch['image_progress'] = list(entry['images'].values())
+            socketio.emit('sync_batch', batch, to=task_room(task_id))
+            frames = 1
+            if entry['progress']:
+                task = sync_tasks.get(task_id) or {}
+                socketio.emit('task_summary', dict(entry['progress'], username=task.get('username')), to=ADMIN_TASKS_ROOM)
+                frames += 1
+            with self.lock:
+                self.frames += frames
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'events': self.events,
+                'frames': self.frames,
+                'pending_tasks': len(self.pending),
+                'interval': self.interval
+            }
+
 class ImageSyncer:
     """镜像同步类"""
     def __init__(self, registry_config):
         self.registry_config = registry_config
         self.current_task_id = None
+        # 任务内多个镜像并发完成时保护进度和错误列表
+        self.task_lock = threading.Lock()
+        # 分配日志序号并按序写入内存和日志库
+        self.log_lock = threading.Lock()
+        # 各任务正在运行的skopeo子进程，取消任务时统一终止
+        self.processes = {}
+        self.process_lock = threading.Lock()
+        # 各任务最近一次写入日志库的时间
+        self.saved_at = {}
+        # 已复制到目标私服的层所在的仓库 (私服地址, 层摘要) -> 仓库，用于跨仓库挂载
+        self.blob_locations = OrderedDict()
+        self.blob_lock = threading.Lock()
+    
+    def terminate_task_processes(self, task_id):
+        """向任务的所有skopeo子进程发送SIGTERM，返回进程数
+
+        超过 SKOPEO_TERMINATE_GRACE 秒仍未退出的进程由 run_skopeo 的读取循环发送SIGKILL。
+        """
+        with self.process_lock:
+            processes = list(self.processes.get(task_id, ()))
+        for process in processes:
+            if process.poll() is None:
+                try:
+                    process.terminate()
+                except OSError:
+                    pass
+        return len(processes)
+    
+    def active_process_count(self):
+        with self.process_lock:
+            return sum(len(processes) for processes in self.processes.values())
     
     def check_skopeo(self):
-        """检查Skopeo是否安装"""
+        """检查Skopeo是否安装（使用缓存的探测结果）"""
+        return skopeo_capabilities.get()['available']
+    
+    def copy_options(self, task_id, registry, command='copy', multi_arch=False):
+        """按skopeo实际支持的参数生成复制选项
+
+        私服配置可设置 preserve_digests: true 保持源摘要不变（不做格式转换），
+        或 compress_format: zstd/gzip 指定目标层压缩算法；zstd层只能存放在OCI格式中。
+        command为copy或sync，按对应子命令实际支持的参数生成。
+        """
+        options = []
+        if skopeo_capabilities.supports('--retry-times', command):
+            options.extend(['--retry-times', str(SKOPEO_RETRY_TIMES)])
+        if multi_arch:
+            # 多架构镜像按摘要复制并上传原清单列表，不能转换格式或重新压缩
+            if skopeo_capabilities.supports('--preserve-digests', command):
+                options.append('--preserve-digests')
+            return options
+        
+        compress_format = registry.get('compress_format')
+        if 'aliyuncs.com' in registry['url'] and not compress_format:
+            self.emit_log(task_id, "检测到阿里云ACR，启用优化配置")
+            # 阿里云ACR建议使用的参数
+            compress_format = 'gzip'
+        if compress_format == 'zstd' and not skopeo_capabilities.supports_zstd(command=command):
+            self.emit_log(task_id, "当前skopeo版本不支持zstd压缩，使用默认压缩", "warning")
+            compress_format = None
+        
+        if registry.get('preserve_digests') and skopeo_capabilities.supports('--preserve-digests', command):
+            # 保留摘要时不能转换格式或重新压缩
+            options.append('--preserve-digests')
+        elif compress_format == 'zstd':
+            options.extend(['--format', 'oci', '--dest-compress-format', 'zstd'])
+        else:
+            options.extend(['--format', 'v2s2'])  # 使用较新的镜像格式
+            if compress_format and skopeo_capabilities.supports('--dest-compress-format', command):
+                options.extend(['--dest-compress-format', compress_format])
+        return options
+    
+    def resolve_concurrency(self, registry, requested=None):
+        """计算任务内的镜像并发数：请求参数 > 私服配置 > 环境变量默认值"""
+        value = requested if requested not in (None, '') else registry.get('concurrency', DEFAULT_SYNC_CONCURRENCY)
         try:
-            result = subprocess.run(['skopeo', '--version'], capture_output=True, text=True)
-            return result.returncode == 0
-        except FileNotFoundError:
-            return False
+            value = int(value)
+        except (TypeError, ValueError):
+            value = DEFAULT_SYNC_CONCURRENCY
+        return max(1, min(value, MAX_SYNC_CONCURRENCY))
+    
+    def record_result(self, task_id, bucket, index, image, result_indexes):
+        """按镜像在列表中的原始顺序记录结果（镜像可能乱序完成），调用方需持有task_lock"""
+        indexes = result_indexes.setdefault(bucket, [])
+        pos = bisect.bisect(indexes, index)
+        indexes.insert(pos, index)
+        sync_tasks[task_id][bucket].insert(pos, image)
     
-    def sync_images(self, task_id, images, target_registry, replace_level, source_auth=None, proxy_config=None, target_project=None):
-        """同步镜像列表"""
+    def sync_images(self, task_id, images, target_registry, replace_level, source_auth=None, proxy_config=None, target_project=None, concurrency=None, username=None, incremental=None, repositories=None, batch_mode=None, platforms=None, resume=False):
+        """同步镜像列表（工作项交由全局调度器执行）
+
+        resume为True时任务状态已从日志库还原，images为完整镜像列表，只同步尚未完成的镜像。
+        """
         self.current_task_id = task_id
-        sync_tasks[task_id] = {
-            'status': 'running',
-            'progress': 0,
-            'total': len(images),
-            'current_image': '',
-            'logs': [],
-            'start_time': datetime.now(),
-            'errors': []
-        }
+        if resume and task_id in sync_tasks:
+            sync_tasks[task_id]['status'] = 'queued'
+        else:
+            resume = False
+            sync_tasks[task_id] = {
+                'status': 'queued',
+                'username': username,
+                'progress': 0,
+                'total': len(images),
+                'current_image': '',
+                'current_images': [],
+                'logs': deque(maxlen=TASK_LOG_BUFFER_SIZE),
+                'log_total': 0,
+                'start_time': datetime.now(),
+                'errors': [],
+                'synced': [],
+                'skipped': [],
+                'image_states': {}
+            }
+            task_journal.create_task(task_id, username, {
+                'images': list(images),
+                'target_registry': target_registry,
+                'replace_level': replace_level,
+                'source_auth': source_auth,
+                'proxy_config': proxy_config,
+                'target_project': target_project,
+                'concurrency': concurrency,
+                'incremental': incremental,
+                'repositories': repositories,
+                'batch_mode': batch_mode,
+                'platforms': platforms
+            }, sync_tasks[task_id])
         
         try:
             # 检查Skopeo是否安装
@@ -319,13 +2102,52 @@ class ImageSyncer:
                 sync_tasks[task_id]['status'] = 'failed'
                 return
             
-            registry = next((r for r in self.registry_config.registries if r['name'] == target_registry), None)
-            if not registry:
-                self.emit_log(task_id, f"错误: 找不到私服配置 {target_registry}", "error")
-                sync_tasks[task_id]['status'] = 'failed'
-                return
+            # 目标私服可以是单个名称或名称列表（多目标分发）
+            target_names = [target_registry] if isinstance(target_registry, str) else list(dict.fromkeys(target_registry))
+            registries = []
+            for name in target_names:
+                registry = next((r for r in self.registry_config.registries if r['name'] == name), None)
+                if not registry:
+                    self.emit_log(task_id, f"错误: 找不到私服配置 {name}", "error")
+                    sync_tasks[task_id]['status'] = 'failed'
+                    return
+                registries.append(registry)
+            registry = registries[0]
+            fanout = len(registries) > 1
+            if fanout:
+                if any(r['type'] == 'local_file' for r in registries):
+                    self.emit_log(task_id, "错误: 本地文件导出不能与其他目标私服同时使用", "error")
+                    sync_tasks[task_id]['status'] = 'failed'
+                    return
+                sync_tasks[task_id]['targets'] = target_names
+                sync_tasks[task_id]['target_results'] = {}
+            
+            # 按仓库+标签过滤规则展开镜像列表（恢复的任务已保存展开后的列表）
+            if repositories and not resume:
+                self.emit_log(task_id, f"正在列出 {len(repositories)} 个仓库的标签...")
+                expanded, failed = self.expand_repositories(task_id, repositories, source_auth, proxy_config)
+                if failed:
+                    sync_tasks[task_id]['repository_errors'] = [name for name, _ in failed]
+                existing = set(images)
+                images = list(images) + [image for image in expanded if image not in existing]
+                sync_tasks[task_id]['total'] = len(images)
+                self.emit_log(task_id, f"标签展开完成，共 {len(images)} 个镜像待同步")
+            if not resume:
+                task_journal.set_images(task_id, images)
+            
+            workers = min(self.resolve_concurrency(r, concurrency) for r in registries)
+            sync_tasks[task_id]['concurrency'] = workers
             
-            self.emit_log(task_id, f"开始同步 {len(images)} 个镜像到 {target_registry}")
+            # 增量同步：请求参数优先，其次私服配置，默认开启
+            if incremental is None:
+                incremental = all(r.get('incremental', True) for r in registries)
+            incremental = bool(incremental) and registry['type'] != 'local_file'
+            sync_tasks[task_id]['incremental'] = incremental
+            if incremental:
+                self.emit_log(task_id, "已启用增量同步：目标已存在相同摘要的镜像将被跳过")
+            self.emit_log(task_id, f"开始同步 {len(images)} 个镜像到 {', '.join(target_names)} (任务并发数: {workers})")
+            if fanout:
+                self.emit_log(task_id, f"多目标分发：每个源镜像只拉取一次，再并行推送到 {len(registries)} 个私服")
             
             # 如果配置了源认证信息，记录日志
             if source_auth:
@@ -339,42 +2161,598 @@ class ImageSyncer:
                 if proxy_config.get('no_proxy'):
                     self.emit_log(task_id, f"不使用代理的地址: {proxy_config['no_proxy']}")
             
-            for i, image in enumerate(images):
-                if sync_tasks[task_id]['status'] == 'cancelled':
-                    self.emit_log(task_id, "同步任务已取消")
-                    return
-                
-                sync_tasks[task_id]['current_image'] = image
-                self.emit_log(task_id, f"正在同步镜像 ({i+1}/{len(images)}): {image}")
-                
-                target_image = self.sync_single_image(task_id, image, registry, replace_level, source_auth, proxy_config, target_project)
-                
-                if target_image:
+            # 恢复的任务跳过已有结果的镜像，结果列表按镜像的原始位置继续插入
+            positions = {image: index for index, image in enumerate(images)}
+            result_indexes = {
+                bucket: sorted(positions[image] for image in sync_tasks[task_id][bucket] if image in positions)
+                for bucket in ('synced', 'skipped', 'errors')
+            }
+            finished = {image for image, state in sync_tasks[task_id]['image_states'].items() if state in ('synced', 'skipped', 'failed')}
+            pending = [(index, image) for index, image in enumerate(images) if image not in finished]
+            if resume:
+                self.emit_log(task_id, f"继续同步剩余的 {len(pending)} 个镜像（已完成 {len(images) - len(pending)} 个）")
+            
+            # 批量模式：同一仓库的多个标签合并为一次 skopeo sync
+            if batch_mode is None:
+                batch_mode = registry.get('batch_mode', True)
+            # 多架构同步：请求参数优先，其次私服配置（'all' 或平台列表），默认只复制本机平台
+            platforms = normalize_platforms(platforms) or normalize_platforms(registry.get('platforms'))
+            if platforms and registry['type'] == 'local_file':
+                self.emit_log(task_id, "本地文件导出只支持单平台镜像，忽略平台选项", "warning")
+                platforms = None
+            if platforms:
+                sync_tasks[task_id]['platforms'] = platforms
+                self.emit_log(task_id, f"多架构同步平台: {'全部' if platforms == 'all' else ', '.join(platforms)}")
+            
+            # 多目标分发以单个镜像为单位暂存，多架构同步按平台复制，都不使用批量模式
+            batch_mode = bool(batch_mode) and registry['type'] != 'local_file' and not fanout and not platforms
+            singles, batches = self.plan_batches(pending) if batch_mode else (pending, [])
+            if batches:
+                self.emit_log(task_id, f"批量模式: {sum(len(b) for b in batches)} 个镜像合并为 {len(batches)} 个 skopeo sync 批次")
+            
+            def start_image(index, image):
+                with self.task_lock:
+                    started = sync_tasks[task_id]['status'] == 'queued'
+                    if started:
+                        sync_tasks[task_id]['status'] = 'running'
+                        # 调度器实际开始执行的时间，与提交时间之差为排队等待时间
+                        sync_tasks[task_id]['run_start_time'] = datetime.now()
+                    sync_tasks[task_id]['current_image'] = image
+                    sync_tasks[task_id]['current_images'].append(image)
+                if started:
+                    self.save_task(task_id)
+                self.emit_log(task_id, f"正在同步镜像 ({index+1}/{len(images)}): {image}")
+            
+            def finish_image(index, image, target_image):
+                skipped = sync_tasks[task_id]['image_states'].get(image) == 'skipped'
+                # 任务取消时被中断的镜像单独标记，不计入失败列表
+                interrupted = not skipped and not target_image and sync_tasks[task_id]['status'] == 'cancelled'
+                if skipped:
+                    self.emit_log(task_id, f"⏭️ 镜像已是最新，跳过: {image}", "success")
+                elif interrupted:
+                    self.emit_log(task_id, f"⏹️ 镜像 {image} 的同步已随任务取消而中止", "warning")
+                elif target_image:
                     self.emit_log(task_id, f"📋 同步任务完成: {image}", "success")
                     self.emit_log(task_id, f"   ➤ 目标地址: {target_image}", "success")
                 else:
                     self.emit_log(task_id, f"❌ 镜像 {image} 同步失败", "error")
-                    sync_tasks[task_id]['errors'].append(image)
                 
-                sync_tasks[task_id]['progress'] = i + 1
+                # 镜像可能乱序完成，进度和结果列表统一在锁内更新
+                with self.task_lock:
+                    task = sync_tasks[task_id]
+                    if skipped:
+                        self.record_result(task_id, 'skipped', index, image, result_indexes)
+                    elif interrupted:
+                        task['image_states'][image] = 'cancelled'
+                    elif target_image:
+                        task['image_states'][image] = 'synced'
+                        self.record_result(task_id, 'synced', index, image, result_indexes)
+                    else:
+                        task['image_states'][image] = 'failed'
+                        self.record_result(task_id, 'errors', index, image, result_indexes)
+                    task['current_images'].remove(image)
+                    task.get('image_progress', {}).pop(image, None)
+                    task['progress'] += 1
+                    task_journal.set_image_state(task_id, image, task['image_states'][image])
+                self.save_task(task_id, throttle=True)
+                self.emit_progress(task_id)
+            
+            def sync_one(index, image):
+                # 排队中的镜像在开始前检查任务是否已取消
+                if sync_tasks[task_id]['status'] == 'cancelled':
+                    return
+                
+                start_image(index, image)
+                try:
+                    if fanout:
+                        # 所有目标都成功（或跳过）才算该镜像同步成功，各目标的结果记录在target_results中
+                        results = self.sync_image_fanout(task_id, image, registries, replace_level, source_auth, proxy_config, target_project, incremental, platforms)
+                        target_image = ', '.join(results.values()) if all(results.values()) else False
+                    else:
+                        target_image = self.sync_single_image(task_id, image, registry, replace_level, source_auth, proxy_config, target_project, incremental, platforms)
+                except Exception as e:
+                    self.emit_log(task_id, f"同步镜像 {image} 时发生异常: {str(e)}", "error")
+                    target_image = False
+                finish_image(index, image, target_image)
+            
+            def sync_batch(group):
+                if sync_tasks[task_id]['status'] == 'cancelled':
+                    return
+                
+                for index, image in group:
+                    start_image(index, image)
+                batch_images = [image for _, image in group]
+                try:
+                    results = self.sync_image_batch(task_id, batch_images, registry, replace_level, source_auth, proxy_config, target_project, incremental)
+                except Exception as e:
+                    self.emit_log(task_id, f"批量同步时发生异常: {str(e)}", "error")
+                    results = {}
+                for index, image in group:
+                    finish_image(index, image, results.get(image, False))
+            
+            # 先读取镜像大小（清单写入缓存，复制时不再重复读取），大镜像先开始；
+            # 大小相同或未知时按组内第一个镜像的位置排序，保持原始提交顺序
+            sizes = {}
+            if SYNC_LARGEST_FIRST and len(pending) > 1:
+                sizes = self.estimate_sizes([image for _, image in pending], source_auth, proxy_config, platforms)
+                known = [size for size in sizes.values() if size]
+                if known:
+                    self.emit_log(task_id, f"已读取 {len(known)}/{len(pending)} 个镜像的大小（共 {sum(known) / 1024 ** 3:.2f} GB），按从大到小的顺序同步")
+            work = [(sizes.get(image) or 0, index, lambda index=index, image=image: sync_one(index, image)) for index, image in singles]
+            work += [(sum(sizes.get(image) or 0 for _, image in group), group[0][0], lambda group=group: sync_batch(group)) for group in batches]
+            work.sort(key=lambda item: (-item[0], item[1]))
+            items = [item for _, _, item in work]
+            entry = sync_scheduler.submit_task(
+                task_id, items,
+                username=username,
+                registries={r['name']: r.get('max_concurrency') for r in registries},
+                task_limit=workers
+            )
+            position = sync_scheduler.queue_position(task_id)
+            if position:
+                self.emit_log(task_id, f"任务已进入全局队列，当前排队位置: {position}")
                 self.emit_progress(task_id)
+            sync_scheduler.wait(entry)
+            
+            if sync_tasks[task_id]['status'] == 'cancelled':
+                sync_tasks[task_id]['end_time'] = datetime.now()
+                self.emit_log(task_id, "同步任务已取消")
+                return
             
             sync_tasks[task_id]['status'] = 'completed'
             sync_tasks[task_id]['end_time'] = datetime.now()
             
-            error_count = len(sync_tasks[task_id]['errors'])
+            error_count = len(sync_tasks[task_id]['errors']) + len(sync_tasks[task_id].get('repository_errors', []))
+            synced_count = len(sync_tasks[task_id]['synced'])
+            skipped_count = len(sync_tasks[task_id]['skipped'])
             if error_count == 0:
-                self.emit_log(task_id, f"所有镜像同步完成！", "success")
+                self.emit_log(task_id, f"所有镜像同步完成！(复制 {synced_count} 个，跳过 {skipped_count} 个)", "success")
             else:
-                self.emit_log(task_id, f"同步完成，但有 {error_count} 个镜像失败", "warning")
+                self.emit_log(task_id, f"同步完成，但有 {error_count} 个镜像/仓库失败 (复制 {synced_count} 个，跳过 {skipped_count} 个)", "warning")
         
         except Exception as e:
             self.emit_log(task_id, f"同步过程中发生错误: {str(e)}", "error")
             import traceback
             self.emit_log(task_id, f"异常详情: {traceback.format_exc()}", "error")
+            sync_tasks[task_id]['status'] = 'failed'
             return False
+        
+        finally:
+            if sync_tasks[task_id]['status'] in TaskJournal.FINAL_STATUSES:
+                sync_tasks[task_id].setdefault('end_time', datetime.now())
+            task_auth_files.release(task_id)
+            self.save_task(task_id)
+    
+    def save_task(self, task_id, throttle=False):
+        """把任务状态摘要写入日志库，throttle为True时同一任务每5秒最多写一次
+
+        镜像状态单独逐条记录，摘要中的结果列表只用于展示，恢复时以镜像状态为准。
+        """
+        now = time.time()
+        if throttle and now - self.saved_at.get(task_id, 0) < 5:
+            return
+        self.saved_at[task_id] = now
+        with self.task_lock:
+            task_journal.save_task(task_id, sync_tasks[task_id])
     
-    def sync_single_image(self, task_id, source_image, registry, replace_level, source_auth=None, proxy_config=None, target_project=None):
+    def resume_interrupted_tasks(self):
+        """恢复上次运行中断的任务（服务重启或worker被回收）"""
+        for task_id, owner_pid in task_journal.unfinished_tasks():
+            if task_id in sync_tasks:
+                continue
+            if owner_pid and owner_pid != os.getpid() and psutil.pid_exists(owner_pid):
+                # 旧worker可能还在优雅退出，等待它结束后再接管
+                threading.Thread(target=self.resume_when_released, args=(task_id, owner_pid), daemon=True).start()
+            else:
+                self.resume_task(task_id)
+    
+    def resume_when_released(self, task_id, owner_pid, max_wait=120):
+        deadline = time.time() + max_wait
+        while time.time() < deadline and psutil.pid_exists(owner_pid):
+            time.sleep(2)
+        if psutil.pid_exists(owner_pid):
+            # 旧worker仍在运行（可能还在复制），接管会对同一目标重复复制
+            logger.warning(f"任务 {task_id} 的原进程 {owner_pid} 仍在运行，不恢复该任务")
+            return
+        self.resume_task(task_id)
+    
+    def resume_task(self, task_id):
+        """从日志库还原任务并在后台继续同步剩余镜像"""
+        task = task_journal.load_task(task_id)
+        params = task_journal.load_params(task_id)
+        if not task or not params or task_id in sync_tasks:
+            return
+        if params.get('credentials_redacted'):
+            # 密码不保存到日志库，无法以原来的认证信息继续同步
+            message = '任务使用了源仓库认证或代理密码，密码不保存到日志库，服务重启后无法自动恢复，请重新提交任务'
+            logger.warning(f"中断的同步任务 {task_id} 无法恢复: 缺少认证密码")
+            task_journal.append_log(task_id, LogRecord(task.get('log_total', 0), time.time(), 'error', f"❌ {message}"))
+            task.update(status='failed', error=message, end_time=datetime.now())
+            task_journal.save_task(task_id, task)
+            return
+        images = [image for image, _ in task_journal.load_images(task_id)]
+        sync_tasks[task_id] = task
+        logger.info(f"恢复中断的同步任务 {task_id}")
+        self.emit_log(task_id, "🔄 服务重启，任务从中断处恢复", "warning")
+        
+        kwargs = {key: params.get(key) for key in (
+            'source_auth', 'proxy_config', 'target_project', 'concurrency',
+            'incremental', 'batch_mode', 'platforms')}
+        if images:
+            kwargs['resume'] = True
+        else:
+            # 中断时尚未展开镜像列表，按原始参数重新开始
+            images = params.get('images', [])
+            kwargs['repositories'] = params.get('repositories')
+        threading.Thread(
+            target=self.sync_images,
+            args=(task_id, images, params['target_registry'], params['replace_level']),
+            kwargs=dict(kwargs, username=task.get('username')),
+            daemon=True
+        ).start()
+    
+    def plan_sync(self, images, target_registry, replace_level, source_auth=None, proxy_config=None, target_project=None, repositories=None, platforms=None):
+        """生成同步计划（不复制）：并发解析每个镜像的目标地址、源摘要和大小，以及目标是否已有相同摘要"""
+        start = time.time()
+        target_names = [target_registry] if isinstance(target_registry, str) else list(dict.fromkeys(target_registry))
+        registries = []
+        for name in target_names:
+            registry = next((r for r in self.registry_config.registries if r['name'] == name), None)
+            if not registry:
+                raise ValueError(f"找不到私服配置 {name}")
+            registries.append(registry)
+        platforms = normalize_platforms(platforms) or normalize_platforms(registries[0].get('platforms'))
+        env = build_proxy_env(proxy_config, [r['url'] for r in registries])
+        
+        repository_errors = []
+        if repositories:
+            expanded, failed = self.expand_repositories(None, repositories, source_auth, proxy_config)
+            repository_errors = [{'repository': name, 'error': error} for name, error in failed]
+            existing = set(images)
+            images = list(images) + [image for image in expanded if image not in existing]
+        
+        def plan_one(image):
+            try:
+                return self.plan_image(image, registries, replace_level, source_auth, env, target_project, platforms)
+            except Exception as e:
+                return {'image': image, 'targets': [], 'error': str(e)}
+        
+        workers = max(1, min(SYNC_PLAN_CONCURRENCY, len(images)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            entries = list(executor.map(plan_one, images))
+        
+        return {
+            'target_registries': target_names,
+            'platforms': platforms,
+            'total_images': len(entries),
+            'to_copy': sum(1 for e in entries if not e.get('error') and any(t['status'] != 'up_to_date' for t in e['targets'])),
+            'up_to_date': sum(1 for e in entries if not e.get('error') and e['targets'] and all(t['status'] == 'up_to_date' for t in e['targets'])),
+            'errors': sum(1 for e in entries if e.get('error')),
+            'total_bytes': sum(e.get('bytes_to_transfer', 0) for e in entries),
+            'repository_errors': repository_errors,
+            'images': entries,
+            'elapsed': round(time.time() - start, 2)
+        }
+    
+    def plan_image(self, image, registries, replace_level, source_auth, env, target_project=None, platforms=None):
+        """同步计划中的单个镜像：源清单摘要和大小、各目标的地址和状态（missing/changed/up_to_date）"""
+        entry = {'image': image, 'targets': []}
+        source_info = self.inspect_manifest(image, source_auth, env)
+        if not source_info:
+            entry['error'] = '无法读取源镜像清单'
+            return entry
+        entry['source_digest'] = source_info['digest']
+        entry['media_type'] = source_info['media_type']
+        
+        # 与实际同步一致：清单列表按所选平台（未指定时为本机平台）计算大小和比较摘要
+        size = source_info['size']
+        layers = list(source_info['layers'])
+        expected_digests = {source_info['digest']}
+        selected_digests = None
+        # 单平台复制时用于比较配置和层的源清单（清单格式转换后摘要会变化）
+        source_single = source_info
+        if source_info['platforms']:
+            source_single = None
+            if platforms:
+                selected = select_platforms(source_info['platforms'], platforms)
+                selected_digests = {item['digest'] for item in selected}
+            else:
+                host_item = select_host_platform(source_info['platforms'])
+                selected = [host_item] if host_item else []
+                expected_digests.update(item['digest'] for item in selected)
+            entry['platforms'] = [platform_name(item) for item in selected]
+            src_registry, src_repository, _ = parse_image_reference(image)
+            size = 0
+            for item in selected:
+                child = self.inspect_manifest(f"{src_registry}/{src_repository}@{item['digest']}", source_auth, env)
+                size += child['size'] if child else 0
+                layers.extend(child['layers'] if child else [])
+                if selected_digests is None:
+                    source_single = child
+        entry['size'] = size
+        
+        for registry in registries:
+            if registry['type'] == 'local_file':
+                entry['targets'].append({'registry': registry['name'], 'target': None, 'status': 'export', 'bytes_to_transfer': size})
+                continue
+            target_image = self.build_target_image(None, image, registry, replace_level, target_project)
+            target_info = self.inspect_manifest(target_image, registry, env)
+            if not target_info:
+                status = 'missing'
+            elif selected_digests is not None:
+                status = 'up_to_date' if {item['digest'] for item in target_info['platforms']} == selected_digests else 'changed'
+            else:
+                up_to_date = target_info['digest'] in expected_digests or same_image_content(source_single, target_info)
+                status = 'up_to_date' if up_to_date else 'changed'
+            entry['targets'].append({
+                'registry': registry['name'],
+                'target': target_image,
+                'status': status,
+                'target_digest': target_info['digest'] if target_info else None,
+                'bytes_to_transfer': 0 if status == 'up_to_date' else self.missing_bytes(target_image, registry, size, layers, env)
+            })
+        entry['bytes_to_transfer'] = sum(target.get('bytes_to_transfer', 0) for target in entry['targets'])
+        return entry
+    
+    def missing_bytes(self, target_image, registry, size, layers, env):
+        """估算复制到目标需要传输的字节数：目标仓库已有的层不会重复上传"""
+        if not REGISTRY_CLIENT_ENABLED or not layers:
+            return size
+        target_registry, target_repository, _ = parse_image_reference(target_image)
+        existing = 0
+        try:
+            for digest, layer_size in dict(layers).items():
+                if registry_client.blob_exists(target_registry, target_repository, digest, registry, env):
+                    existing += layer_size
+        except RegistryClientError as e:
+            logger.debug(f"检查目标层失败，按完整大小估算 {target_image}: {e}")
+            return size
+        return max(0, size - existing)
+    
+    def plan_batches(self, indexed_images):
+        """按源仓库对带标签的镜像分组，返回 (单独同步的镜像, 批次列表)，元素均为 (序号, 镜像)"""
+        groups = OrderedDict()
+        singles = []
+        for index, image in indexed_images:
+            repository, sep, tag = image.rpartition(':')
+            if '@' in image or not sep or '/' in tag:
+                singles.append((index, image))
+                continue
+            groups.setdefault(repository, []).append((index, image))
+        
+        batches = []
+        for members in groups.values():
+            if len(members) < SYNC_BATCH_MIN_TAGS:
+                singles.extend(members)
+                continue
+            for i in range(0, len(members), SYNC_BATCH_MAX_TAGS):
+                chunk = members[i:i + SYNC_BATCH_MAX_TAGS]
+                if len(chunk) >= 2:
+                    batches.append(chunk)
+                else:
+                    singles.extend(chunk)
+        singles.sort()
+        return singles, batches
+    
+    def sync_image_batch(self, task_id, images, registry, replace_level, source_auth=None, proxy_config=None, target_project=None, incremental=False):
+        """使用一次 skopeo sync 同步同一仓库的多个标签，返回 {镜像: 目标地址或False}
+
+        skopeo sync 未能开始复制的标签会回退为逐个 skopeo copy。
+        """
+        results = {}
+        source_repo = images[0].rsplit(':', 1)[0]
+        self.emit_log(task_id, f"批量同步仓库 {source_repo} 的 {len(images)} 个标签")
+        
+        # 同一源仓库的标签只有标签部分不同，目标仓库路径只需计算一次
+        target_repo = self.build_target_image(task_id, images[0], registry, replace_level, target_project).rsplit(':', 1)[0]
+        targets = {image: f"{target_repo}:{image.rsplit(':', 1)[1]}" for image in images}
+        
+        pending = []
+        for image in images:
+            if incremental and self.is_up_to_date(task_id, image, targets[image], registry, source_auth, proxy_config):
+                with self.task_lock:
+                    sync_tasks[task_id]['image_states'][image] = 'skipped'
+                results[image] = targets[image]
+            else:
+                pending.append(image)
+        
+        # skopeo sync（非scoped模式）把镜像写入 目标前缀/源仓库最后一级名称
+        dest_prefix, _, target_name = target_repo.rpartition('/')
+        if len(pending) < 2 or target_name != source_repo.rsplit('/', 1)[-1]:
+            for image in pending:
+                results[image] = self.sync_single_image(task_id, image, registry, replace_level, source_auth, proxy_config, target_project)
+            return results
+        
+        src_registry, src_repository, _ = parse_image_reference(pending[0])
+        source_config = {
+            'images': {src_repository: [image.rsplit(':', 1)[1] for image in pending]},
+            'tls-verify': False
+        }
+        
+        # 认证信息通过任务认证文件传递，源配置文件只包含镜像列表
+        fd, source_file = tempfile.mkstemp(prefix='skopeo-sync-', suffix='.yaml')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                yaml.safe_dump({src_registry: source_config}, f, allow_unicode=True, default_flow_style=False)
+            
+            cmd = ['skopeo', 'sync', '--src', 'yaml', '--dest', 'docker', '--dest-tls-verify=false']
+            cmd.extend(self.copy_options(task_id, registry, command='sync'))
+            cmd.extend(self.auth_args(task_id, pending[0], source_auth, registry))
+            cmd.extend([source_file, dest_prefix])
+            self.emit_log(task_id, f"执行命令: {' '.join(cmd)}")
+            
+            # skopeo sync 按顺序复制，每开始一个新标签意味着上一个已成功
+            started = []
+            # 批次内所有镜像的层合并统计，成功后计入目标私服的吞吐量
+            progress = CopyProgress([layer for image in pending for layer in self.get_layer_sizes(image, source_auth)])
+            
+            def on_line(line):
+                self.emit_log(task_id, f"  {line}")
+                progress.feed(line)
+                match = SKOPEO_SYNC_PROGRESS_PATTERN.search(line)
+                if match:
+                    tag = match.group(1).rsplit(':', 1)[-1]
+                    image = next((img for img in pending if img.rsplit(':', 1)[1] == tag), None)
+                    if image and image not in started:
+                        started.append(image)
+            
+            sizes = [self.cached_image_size(image, source_auth=source_auth) for image in pending]
+            timeout_seconds = (throughput_tracker.timeout_for(registry['name'], sum(sizes), len(pending)) if all(sizes) else None) \
+                or 1200 + 300 * (len(pending) - 1)
+            returncode, stderr_tail, timed_out = self.run_skopeo(
+                task_id, cmd, build_proxy_env(proxy_config, [registry['url']]), timeout_seconds,
+                on_stdout=on_line, on_stderr=on_line
+            )
+            if timed_out:
+                self.emit_log(task_id, f"批量同步超时({timeout_seconds}秒)", "error")
+            elif returncode == 0:
+                throughput_tracker.observe(registry['name'], progress.transferred_bytes(), time.time() - progress.start_time)
+            self.emit_log(task_id, f"skopeo sync 执行完成，返回码: {returncode}")
+        finally:
+            try:
+                os.remove(source_file)
+            except OSError:
+                pass
+        
+        if returncode == 0:
+            succeeded, failed = pending, []
+        else:
+            succeeded, failed = started[:-1], started[-1:]
+            # 临时性错误导致的失败交给逐个复制，按重试策略再次尝试
+            error_class = 'timeout' if timed_out else classify_skopeo_error('\n'.join(stderr_tail))
+            if error_class in RetryPolicy.for_registry(registry).retry_on:
+                failed = []
+        for image in succeeded:
+            manifest_cache.invalidate(*parse_image_reference(targets[image]))
+            results[image] = targets[image]
+        for image in failed:
+            self.emit_log(task_id, f"skopeo sync 复制 {image} 失败", "error")
+            results[image] = False
+        
+        remaining = [image for image in pending if image not in results]
+        if remaining:
+            self.emit_log(task_id, f"批量同步中断，剩余 {len(remaining)} 个标签改为逐个复制", "warning")
+            for image in remaining:
+                if sync_tasks[task_id]['status'] == 'cancelled':
+                    break
+                results[image] = self.sync_single_image(task_id, image, registry, replace_level, source_auth, proxy_config, target_project)
+        return results
+    
+    def sync_image_fanout(self, task_id, source_image, registries, replace_level, source_auth=None, proxy_config=None, target_project=None, incremental=False, platforms=None):
+        """多目标分发：源镜像只拉取一次到本地暂存目录，再并行推送到各目标私服
+
+        暂存使用skopeo的dir格式，原样保存清单和层文件，推送后的摘要与直接复制一致。
+        返回 {私服名称: 目标地址或False}，各目标的结果同时记录到任务的target_results。
+        """
+        results = {}
+        pending = {}
+        env = build_proxy_env(proxy_config, [r['url'] for r in registries])
+        
+        if platforms:
+            source_info = self.inspect_manifest(source_image, source_auth, env)
+            if source_info and source_info['platforms']:
+                # 多架构镜像按平台摘要直接复制到各目标私服，不经过暂存目录
+                def copy_to(registry):
+                    target_image = self.build_target_image(task_id, source_image, registry, replace_level, target_project)
+                    status = self.sync_multi_arch(task_id, source_image, source_info, registry, target_image, platforms, source_auth, env, incremental)
+                    self.record_target_result(task_id, source_image, registry['name'], status, target_image)
+                    return registry['name'], target_image if status != 'failed' else False, status
+                
+                with ThreadPoolExecutor(max_workers=len(registries)) as executor:
+                    outcomes = list(executor.map(copy_to, registries))
+                if all(status == 'skipped' for _, _, status in outcomes):
+                    with self.task_lock:
+                        sync_tasks[task_id]['image_states'][source_image] = 'skipped'
+                return {name: target for name, target, _ in outcomes}
+        for registry in registries:
+            target_image = self.build_target_image(task_id, source_image, registry, replace_level, target_project)
+            if incremental and self.is_up_to_date(task_id, source_image, target_image, registry, source_auth, proxy_config):
+                self.record_target_result(task_id, source_image, registry['name'], 'skipped', target_image)
+                results[registry['name']] = target_image
+            else:
+                pending[registry['name']] = (registry, target_image)
+        
+        if not pending:
+            with self.task_lock:
+                sync_tasks[task_id]['image_states'][source_image] = 'skipped'
+            return results
+        
+        staging_dir = tempfile.mkdtemp(prefix='skopeo-stage-', dir=SYNC_STAGING_DIR or None)
+        stage = os.path.join(staging_dir, 'image')
+        try:
+            cmd = ['skopeo', 'copy', '--src-tls-verify=false']
+            if skopeo_capabilities.supports('--retry-times'):
+                cmd.extend(['--retry-times', str(SKOPEO_RETRY_TIMES)])
+            cmd.extend(self.auth_args(task_id, source_image, source_auth))
+            cmd.extend([f'docker://{source_image}', f'dir:{stage}'])
+            self.emit_log(task_id, f"拉取源镜像到暂存目录（{len(pending)} 个目标待推送）")
+            self.emit_log(task_id, f"执行命令: {' '.join(cmd)}")
+            
+            # 拉取使用默认重试策略，推送使用各目标私服自己的策略
+            self.prefetch_source_manifest(source_image, source_auth, env)
+            size = self.cached_image_size(source_image, source_auth=source_auth)
+            # 拉取的吞吐量按源仓库地址统计，与推送到各目标私服的吞吐量分开
+            source_key = parse_image_reference(source_image)[0]
+            pull_timeout = throughput_tracker.timeout_for(source_key, size) or 1200
+            returncode, stderr_tail, timed_out = self.run_with_retry(task_id, {}, lambda: self.run_skopeo(
+                task_id, cmd, env, pull_timeout, image=source_image, throughput_key=source_key,
+                layers=self.get_layer_sizes(source_image, source_auth)
+            ))
+            if returncode != 0 or timed_out:
+                reason = '超时' if timed_out else ERROR_CLASS_LABELS[classify_skopeo_error('\n'.join(stderr_tail))]
+                self.emit_log(task_id, f"❌ 拉取源镜像失败（{reason}），所有目标均未推送", "error")
+                for name, (registry, target_image) in pending.items():
+                    self.record_target_result(task_id, source_image, name, 'failed', target_image)
+                    results[name] = False
+                return results
+            self.emit_log(task_id, "源镜像已暂存，开始并行推送到各目标私服")
+            
+            def push(name):
+                registry, target_image = pending[name]
+                if sync_tasks[task_id]['status'] == 'cancelled':
+                    return False
+                push_cmd = ['skopeo', 'copy', '--dest-tls-verify=false']
+                push_cmd.extend(self.copy_options(task_id, registry))
+                push_cmd.extend(self.auth_args(task_id, registry=registry))
+                push_cmd.extend([f'dir:{stage}', f'docker://{target_image}'])
+                push_timeout = throughput_tracker.timeout_for(name, size) or 1200
+                returncode, _, timed_out = self.run_with_retry(task_id, registry, lambda: self.run_skopeo(
+                    task_id, push_cmd, env, push_timeout,
+                    on_stdout=lambda line: self.emit_log(task_id, f"  [{name}] {line}"),
+                    on_stderr=lambda line: self.emit_log(task_id, f"  [{name}] {line}", "warning"),
+                    layers=self.get_layer_sizes(source_image, source_auth), throughput_key=name
+                ))
+                return returncode == 0 and not timed_out
+            
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                futures = {name: executor.submit(push, name) for name in pending}
+                for name, future in futures.items():
+                    registry, target_image = pending[name]
+                    try:
+                        ok = future.result()
+                    except Exception as e:
+                        self.emit_log(task_id, f"推送到 {name} 时发生异常: {e}", "error")
+                        ok = False
+                    if ok:
+                        manifest_cache.invalidate(*parse_image_reference(target_image))
+                        self.emit_log(task_id, f"✅ [{name}] 推送成功: {target_image}", "success")
+                    else:
+                        self.emit_log(task_id, f"❌ [{name}] 推送失败: {target_image}", "error")
+                    self.record_target_result(task_id, source_image, name, 'synced' if ok else 'failed', target_image)
+                    results[name] = target_image if ok else False
+            return results
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    def record_target_result(self, task_id, image, registry_name, status, target_image):
+        """记录多目标分发中单个目标的结果"""
+        with self.task_lock:
+            sync_tasks[task_id].setdefault('target_results', {}).setdefault(image, {})[registry_name] = {
+                'status': status,
+                'target': target_image
+            }
+    
+    def sync_single_image(self, task_id, source_image, registry, replace_level, source_auth=None, proxy_config=None, target_project=None, incremental=False, platforms=None):
         """同步单个镜像"""
         try:
             self.emit_log(task_id, f"开始处理镜像: {source_image}")
@@ -383,44 +2761,33 @@ class ImageSyncer:
             if registry['type'] == 'local_file':
                 return self.export_image_to_file(task_id, source_image, registry, replace_level, source_auth, proxy_config, target_project)
             
-            # 获取基础URL和命名空间/项目
-            base_url = registry['url']
+            target_image = self.build_target_image(task_id, source_image, registry, replace_level, target_project)
             
-            # 优先使用用户输入的目标项目/命名空间，否则使用配置文件中的默认值
-            if target_project:
-                namespace = target_project
-                self.emit_log(task_id, f"使用用户指定的项目/命名空间: {namespace}")
-            else:
-                # 使用配置文件中的默认值
-                if registry['type'] == 'harbor':
-                    namespace = registry.get('project', 'library')
-                elif registry['type'] == 'acr':
-                    namespace = registry.get('namespace', 'default')
-                elif registry['type'] == 'nexus':
-                    namespace = registry.get('repository', 'docker-hosted')
-                elif registry['type'] == 'swr':
-                    namespace = registry.get('namespace', 'default')
-                elif registry['type'] == 'tcr':
-                    namespace = registry.get('namespace', 'default')
-                else:
-                    namespace = 'library'  # 默认命名空间
-                self.emit_log(task_id, f"使用配置文件默认项目/命名空间: {namespace}")
+            # 多架构同步：源镜像是清单列表时按所选平台复制
+            if platforms:
+                env = build_proxy_env(proxy_config, [registry['url']])
+                source_info = self.inspect_manifest(source_image, source_auth, env)
+                if source_info and source_info['platforms']:
+                    status = self.sync_multi_arch(task_id, source_image, source_info, registry, target_image, platforms, source_auth, env, incremental)
+                    if status == 'skipped':
+                        with self.task_lock:
+                            sync_tasks[task_id]['image_states'][source_image] = 'skipped'
+                    return target_image if status != 'failed' else False
+                self.emit_log(task_id, "源镜像不是多架构清单列表，按单平台镜像复制")
             
-            self.emit_log(task_id, f"私服类型: {registry['type']}, 最终命名空间: {namespace}")
+            # 增量同步：比较源镜像与目标镜像的清单摘要，一致则跳过复制
+            if incremental and self.is_up_to_date(task_id, source_image, target_image, registry, source_auth, proxy_config):
+                with self.task_lock:
+                    sync_tasks[task_id]['image_states'][source_image] = 'skipped'
+                return target_image
             
-            # 应用替换级别构建目标镜像地址
-            target_image_path = self.apply_replace_level(source_image, namespace, replace_level)
-            self.emit_log(task_id, f"替换级别处理结果: {target_image_path}")
-            
-            # target_image_path已经包含了namespace，所以直接用base_url拼接
-            if target_image_path.startswith(namespace + '/'):
-                # 如果已经包含namespace，直接拼接
-                target_image = f"{base_url}/{target_image_path}"
-            else:
-                # 如果不包含namespace，需要添加
-                target_image = f"{base_url}/{namespace}/{target_image_path}"
-            
-            self.emit_log(task_id, f"最终目标镜像: {target_image}")
+            # 目标私服已有该清单或全部层时，在仓库端挂载层并写入清单，不经过本机传输
+            if self.fast_copy(task_id, source_image, target_image, registry, source_auth, build_proxy_env(proxy_config, [registry['url']])):
+                manifest_cache.invalidate(*parse_image_reference(target_image))
+                self.emit_log(task_id, f"✅ 镜像同步成功", "success")
+                self.emit_log(task_id, f"   源镜像: {source_image}", "info")
+                self.emit_log(task_id, f"   目标镜像: {target_image}", "info")
+                return target_image
             
             # 构建skopeo命令
             cmd = ['skopeo', 'copy']
@@ -428,41 +2795,19 @@ class ImageSyncer:
             # 添加基本参数，兼容当前skopeo版本
             cmd.extend(['--dest-tls-verify=false', '--src-tls-verify=false'])
             
-            # 添加网络优化参数（移除不支持的--retry-times）
-            cmd.extend([
-                '--format', 'v2s2'     # 使用较新的镜像格式
-            ])
-            
-            # 对于阿里云ACR，添加特殊处理
-            if 'aliyuncs.com' in registry['url']:
-                self.emit_log(task_id, "检测到阿里云ACR，启用优化配置")
-                # 阿里云ACR建议使用的参数
-                cmd.extend(['--dest-compress-format', 'gzip'])
-            
-            # 添加源认证信息（如果提供）
-            if source_auth and source_auth.get('username') and source_auth.get('password'):
-                cmd.extend(['--src-creds', f"{source_auth['username']}:{source_auth['password']}"])
-                self.emit_log(task_id, f"添加源仓库认证信息，用户名: {source_auth['username']}")
-            else:
-                self.emit_log(task_id, "源仓库: 公开访问")
+            # 根据skopeo支持的参数添加重试、格式和压缩选项
+            cmd.extend(self.copy_options(task_id, registry))
             
-            # 添加目标认证信息
-            if registry.get('username') and registry.get('password'):
-                cmd.extend(['--dest-creds', f"{registry['username']}:{registry['password']}"])
-                self.emit_log(task_id, f"添加目标仓库认证信息，用户名: {registry['username']}")
-            else:
+            # 添加认证文件参数（源和目标的认证信息在任务内只写入一次）
+            cmd.extend(self.auth_args(task_id, source_image, source_auth, registry))
+            if not (source_auth and source_auth.get('username') and source_auth.get('password')):
+                self.emit_log(task_id, "源仓库: 公开访问")
+            if not (registry.get('username') and registry.get('password')):
                 self.emit_log(task_id, "目标仓库: 未配置认证信息")
             
             # 添加源和目标地址
             cmd.extend([f'docker://{source_image}', f'docker://{target_image}'])
-            
-            # 显示完整命令（隐藏密码）
-            safe_cmd = cmd.copy()
-            for i, part in enumerate(safe_cmd):
-                if ('--dest-creds' in safe_cmd or '--src-creds' in safe_cmd) and i > 0:
-                    if safe_cmd[i-1] in ['--dest-creds', '--src-creds']:
-                        safe_cmd[i] = safe_cmd[i].split(':')[0] + ':***'
-            self.emit_log(task_id, f"执行命令: {' '.join(safe_cmd)}")
+            self.emit_log(task_id, f"执行命令: {' '.join(cmd)}")
             
             # 执行同步命令
             self.emit_log(task_id, "开始执行skopeo命令...")
@@ -498,41 +2843,37 @@ class ImageSyncer:
                         no_proxy_str = ','.join(no_proxy_list)
                         env['NO_PROXY'] = no_proxy_str
                         env['no_proxy'] = no_proxy_str
-                        self.emit_log(task_id, f"代理排除列表: {no_proxy_str}")
-                
-                process = subprocess.Popen(
-                    cmd, 
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.PIPE,  # 分别处理stderr
-                    text=True,
-                    universal_newlines=True,
-                    env=env  # 传递环境变量
-                )
-                
-                timeout_seconds = 1200  # 默认20分钟
+                        self.emit_log(task_id, f"代理排除列表: {no_proxy_str}")
                 
-                # 设置超时
-                stdout, stderr = process.communicate(timeout=timeout_seconds)
+                # 超时按镜像大小和私服实测吞吐量计算，大小未知时默认20分钟
+                self.prefetch_source_manifest(source_image, source_auth, env)
+                timeout_seconds = self.copy_timeout(task_id, registry, self.cached_image_size(source_image, source_auth=source_auth))
                 
-                # 输出标准输出
-                if stdout:
-                    for line in stdout.strip().split('\n'):
-                        if line.strip():
-                            self.emit_log(task_id, f"  {line}")
+                def on_stderr(line):
+                    # 判断是否是网络相关错误
+                    if any(keyword in line.lower() for keyword in ['timeout', 'dial tcp', 'connection', 'network']):
+                        self.emit_log(task_id, f"  网络错误: {line}", "error")
+                    else:
+                        self.emit_log(task_id, f"  错误: {line}", "warning")
                 
-                # 输出错误信息
-                if stderr:
-                    for line in stderr.strip().split('\n'):
-                        if line.strip():
-                            # 判断是否是网络相关错误
-                            if any(keyword in line.lower() for keyword in ['timeout', 'dial tcp', 'connection', 'network']):
-                                self.emit_log(task_id, f"  网络错误: {line}", "error")
-                            else:
-                                self.emit_log(task_id, f"  错误: {line}", "warning")
+                # 逐行读取skopeo输出，实时转发日志并解析传输进度
+                returncode, stderr_tail, timed_out = self.run_with_retry(task_id, registry, lambda: self.run_skopeo(
+                    task_id, cmd, env, timeout_seconds,
+                    image=source_image, on_stderr=on_stderr, throughput_key=registry['name'],
+                    layers=self.get_layer_sizes(source_image, source_auth)
+                ))
+                if timed_out:
+                    self.emit_log(task_id, f"镜像同步超时({timeout_seconds}秒)，请检查网络连接", "error")
+                    self.emit_log(task_id, f"建议：使用国内镜像源或检查网络配置", "error")
+                    return False
+                stderr = '\n'.join(stderr_tail)
                 
-                self.emit_log(task_id, f"命令执行完成，返回码: {process.returncode}")
+                self.emit_log(task_id, f"命令执行完成，返回码: {returncode}")
                 
-                if process.returncode == 0:
+                if returncode == 0:
+                    # 目标标签内容已变化，清除该引用的缓存
+                    manifest_cache.invalidate(*parse_image_reference(target_image))
+                    self.remember_blobs(source_image, target_image, source_auth)
                     self.emit_log(task_id, f"✅ 镜像同步成功", "success")
                     self.emit_log(task_id, f"   源镜像: {source_image}", "info")
                     self.emit_log(task_id, f"   目标镜像: {target_image}", "info")
@@ -558,13 +2899,11 @@ class ImageSyncer:
                         self.emit_log(task_id, f"  3. 网络连接是否稳定", "error")
                         self.emit_log(task_id, f"  4. 认证信息是否正确", "error")
                     else:
-                        self.emit_log(task_id, f"skopeo命令执行失败，返回码: {process.returncode}", "error")
+                        self.emit_log(task_id, f"skopeo命令执行失败，返回码: {returncode}", "error")
                     return False
                     
-            except subprocess.TimeoutExpired:
-                process.kill()
-                self.emit_log(task_id, f"镜像同步超时(20分钟)，请检查网络连接", "error")
-                self.emit_log(task_id, f"建议：使用国内镜像源或检查网络配置", "error")
+            except OSError as e:
+                self.emit_log(task_id, f"启动skopeo命令失败: {e}", "error")
                 return False
         
         except Exception as e:
@@ -573,6 +2912,208 @@ class ImageSyncer:
             self.emit_log(task_id, f"异常详情: {traceback.format_exc()}", "error")
             return False
     
+    def sync_multi_arch(self, task_id, source_image, source_info, registry, target_image, platforms, source_auth=None, env=None, incremental=False):
+        """多架构同步：并发复制所选平台的子清单，全部成功后上传（筛选后的）清单列表
+
+        子清单按摘要复制到目标仓库，再用 --multi-arch index-only 上传清单列表；
+        选择全部平台时上传原始清单列表，摘要与源镜像一致。返回 'synced'、'skipped' 或 'failed'。
+        """
+        selected = select_platforms(source_info['platforms'], platforms)
+        if not selected:
+            available = ', '.join(platform_name(item) for item in source_info['platforms'])
+            self.emit_log(task_id, f"❌ 源镜像不包含所选平台 {platforms}，可用平台: {available}", "error")
+            return 'failed'
+        names = [platform_name(item) for item in selected]
+        selected_digests = {item['digest'] for item in selected}
+        self.emit_log(task_id, f"多架构同步: {len(selected)}/{len(source_info['platforms'])} 个平台 ({', '.join(names)})")
+        
+        if incremental:
+            target_info = self.inspect_manifest(target_image, registry, env)
+            if target_info and target_info['platforms'] and {item['digest'] for item in target_info['platforms']} == selected_digests:
+                self.emit_log(task_id, "目标清单列表包含的平台镜像与源镜像一致，跳过复制", "success")
+                return 'skipped'
+        
+        base_cmd = ['skopeo', 'copy', '--src-tls-verify=false', '--dest-tls-verify=false']
+        base_cmd.extend(self.copy_options(task_id, registry, multi_arch=True))
+        base_cmd.extend(self.auth_args(task_id, source_image, source_auth, registry))
+        
+        if not skopeo_capabilities.supports('--multi-arch'):
+            # 旧版skopeo无法单独上传清单列表，退化为 --all 一次复制全部平台
+            if len(selected) < len(source_info['platforms']):
+                self.emit_log(task_id, "当前skopeo不支持 --multi-arch，将复制全部平台", "warning")
+            cmd = base_cmd + ['--all', f'docker://{source_image}', f'docker://{target_image}']
+            self.emit_log(task_id, f"执行命令: {' '.join(cmd)}")
+            timeout_seconds = throughput_tracker.timeout_for(registry['name'], self.cached_image_size(source_image, 'all', source_auth)) or 1200
+            returncode, _, timed_out = self.run_with_retry(task_id, registry, lambda: self.run_skopeo(task_id, cmd, env, timeout_seconds))
+            return 'synced' if returncode == 0 and not timed_out else 'failed'
+        
+        src_registry, src_repository, _ = parse_image_reference(source_image)
+        target_repo, sep, tag = target_image.rpartition(':')
+        if not sep or '/' in tag:
+            target_repo = target_image
+        
+        def copy_platform(item):
+            name = platform_name(item)
+            if sync_tasks[task_id]['status'] == 'cancelled':
+                return False
+            source_ref = f"{src_registry}/{src_repository}@{item['digest']}"
+            child = self.inspect_manifest(source_ref, source_auth, env)
+            layers = child['layers'] if child else []
+            size = child['size'] if child else 0
+            self.emit_log(task_id, f"  [{name}] {len(layers)} 层，共 {size / 1024 / 1024:.1f} MB")
+            cmd = base_cmd + [f'docker://{source_ref}', f"docker://{target_repo}@{item['digest']}"]
+            timeout_seconds = throughput_tracker.timeout_for(registry['name'], size) or 1200
+            returncode, _, timed_out = self.run_with_retry(task_id, registry, lambda: self.run_skopeo(
+                task_id, cmd, env, timeout_seconds, throughput_key=registry['name'],
+                image=source_image, platform=name, layers=layers,
+                on_stdout=lambda line: self.emit_log(task_id, f"  [{name}] {line}"),
+                on_stderr=lambda line: self.emit_log(task_id, f"  [{name}] {line}", "warning")
+            ))
+            ok = returncode == 0 and not timed_out
+            with self.task_lock:
+                results = sync_tasks[task_id].setdefault('platform_results', {}).setdefault(source_image, {})
+                results.setdefault(registry['name'], {})[name] = {
+                    'status': 'synced' if ok else 'failed',
+                    'digest': item['digest'],
+                    'size': size
+                }
+            self.emit_log(task_id, f"  [{name}] {'✅ 复制完成' if ok else '❌ 复制失败'}", "success" if ok else "error")
+            return ok
+        
+        workers = max(1, min(SYNC_PLATFORM_CONCURRENCY, len(selected)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(copy_platform, selected))
+        if not all(outcomes):
+            failed = [name for name, ok in zip(names, outcomes) if not ok]
+            self.emit_log(task_id, f"❌ 平台 {', '.join(failed)} 复制失败，未上传清单列表", "error")
+            return 'failed'
+        
+        # 上传清单列表前确认源标签未在复制期间被重新推送
+        raw = self.fetch_raw_manifest(source_image, source_auth, env)
+        if not raw or 'sha256:' + hashlib.sha256(raw).hexdigest() != source_info['digest']:
+            self.emit_log(task_id, "❌ 源清单列表在复制期间发生变化，请重新同步", "error")
+            manifest_cache.invalidate(*parse_image_reference(source_image))
+            return 'failed'
+        
+        index_dir = tempfile.mkdtemp(prefix='skopeo-index-')
+        try:
+            with open(os.path.join(index_dir, 'version'), 'w') as f:
+                f.write('Directory Transport Version: 1.1\n')
+            with open(os.path.join(index_dir, 'manifest.json'), 'wb') as f:
+                f.write(filter_manifest_list(raw, selected_digests))
+            cmd = ['skopeo', 'copy', '--multi-arch', 'index-only', '--dest-tls-verify=false']
+            cmd.extend(self.copy_options(task_id, registry, multi_arch=True))
+            cmd.extend(self.auth_args(task_id, registry=registry))
+            cmd.extend([f'dir:{index_dir}', f'docker://{target_image}'])
+            returncode, _, timed_out = self.run_with_retry(task_id, registry, lambda: self.run_skopeo(task_id, cmd, env, 300))
+        finally:
+            shutil.rmtree(index_dir, ignore_errors=True)
+        
+        if returncode != 0 or timed_out:
+            self.emit_log(task_id, "❌ 上传清单列表失败", "error")
+            return 'failed'
+        manifest_cache.invalidate(*parse_image_reference(target_image))
+        self.emit_log(task_id, f"✅ 清单列表已上传: {target_image} ({len(selected)} 个平台)", "success")
+        return 'synced'
+    
+    def auth_args(self, task_id, source_image=None, source_auth=None, registry=None):
+        """生成skopeo命令的认证文件参数，每个仓库在任务内只写入一次认证信息"""
+        args = []
+        if source_image:
+            host = parse_image_reference(source_image)[0]
+            path, created = task_auth_files.path(task_id, 'src', host, source_auth)
+            if path:
+                args.extend(['--src-authfile', path])
+                if created:
+                    self.emit_log(task_id, f"已写入源仓库 {host} 的任务认证文件，用户名: {source_auth['username']}")
+        if registry:
+            host = registry['url'].split('/')[0]
+            path, created = task_auth_files.path(task_id, 'dest', host, registry)
+            if path:
+                args.extend(['--dest-authfile', path])
+                if created:
+                    self.emit_log(task_id, f"已写入目标仓库 {host} 的任务认证文件，用户名: {registry['username']}")
+        return args
+    
+    def build_target_image(self, task_id, source_image, registry, replace_level, target_project=None):
+        """根据私服配置、目标项目和替换级别计算目标镜像地址"""
+        # 获取基础URL和命名空间/项目
+        base_url = registry['url']
+        
+        # 优先使用用户输入的目标项目/命名空间，否则使用配置文件中的默认值
+        if target_project:
+            namespace = target_project
+            self.emit_log(task_id, f"使用用户指定的项目/命名空间: {namespace}")
+        else:
+            # 使用配置文件中的默认值
+            if registry['type'] == 'harbor':
+                namespace = registry.get('project', 'library')
+            elif registry['type'] == 'acr':
+                namespace = registry.get('namespace', 'default')
+            elif registry['type'] == 'nexus':
+                namespace = registry.get('repository', 'docker-hosted')
+            elif registry['type'] == 'swr':
+                namespace = registry.get('namespace', 'default')
+            elif registry['type'] == 'tcr':
+                namespace = registry.get('namespace', 'default')
+            else:
+                namespace = 'library'  # 默认命名空间
+            self.emit_log(task_id, f"使用配置文件默认项目/命名空间: {namespace}")
+        
+        self.emit_log(task_id, f"私服类型: {registry['type']}, 最终命名空间: {namespace}")
+        
+        # 应用替换级别构建目标镜像地址
+        target_image_path = self.apply_replace_level(source_image, namespace, replace_level)
+        self.emit_log(task_id, f"替换级别处理结果: {target_image_path}")
+        
+        # target_image_path已经包含了namespace，所以直接用base_url拼接
+        if target_image_path.startswith(namespace + '/'):
+            # 如果已经包含namespace，直接拼接
+            target_image = f"{base_url}/{target_image_path}"
+        else:
+            # 如果不包含namespace，需要添加
+            target_image = f"{base_url}/{namespace}/{target_image_path}"
+        
+        self.emit_log(task_id, f"最终目标镜像: {target_image}")
+        return target_image
+    
+    def is_up_to_date(self, task_id, source_image, target_image, registry, source_auth=None, proxy_config=None):
+        """比较源镜像和目标镜像的清单摘要，判断是否可以跳过复制"""
+        env = build_proxy_env(proxy_config, [registry['url']])
+        # 目标只需要摘要，HEAD请求不下载清单
+        target_digest = self.manifest_digest(target_image, registry, env)
+        if not target_digest:
+            self.emit_log(task_id, "目标镜像不存在，需要复制")
+            return False
+        
+        source_info = self.inspect_manifest(source_image, source_auth, env)
+        if not source_info:
+            self.emit_log(task_id, "无法获取源镜像摘要，继续执行复制", "warning")
+            return False
+        
+        # skopeo copy 不带 --all 时只复制本机平台的镜像，目标摘要对应清单列表中的该平台条目
+        source_digests = {source_info['digest']}
+        source_single = source_info
+        host_item = select_host_platform(source_info['platforms'])
+        if host_item:
+            source_digests.add(host_item['digest'])
+            src_registry, src_repository, _ = parse_image_reference(source_image)
+            source_single = self.inspect_manifest(f"{src_registry}/{src_repository}@{host_item['digest']}", source_auth, env)
+        elif source_info['platforms']:
+            source_single = None
+        
+        if target_digest in source_digests:
+            self.emit_log(task_id, f"目标镜像摘要与源镜像一致 ({target_digest[:19]})，跳过复制", "success")
+            return True
+        
+        # 复制时转换了清单格式（如OCI转Docker v2），摘要不同但配置和层一致
+        if source_single and same_image_content(source_single, self.inspect_manifest(target_image, registry, env)):
+            self.emit_log(task_id, "目标镜像的配置和层与源镜像一致（清单格式已转换），跳过复制", "success")
+            return True
+        
+        self.emit_log(task_id, f"目标镜像摘要已变化 (源: {source_info['digest'][:19]}, 目标: {target_digest[:19]})，需要复制")
+        return False
+    
     def apply_replace_level(self, source_image, namespace, replace_level):
         """根据替换级别应用镜像路径变换"""
         # 移除可能的registry前缀 (如 docker.io/, gcr.io/ 等)
@@ -613,27 +3154,435 @@ class ImageSyncer:
             else:
                 return f"{namespace}/{source_image}"
     
-    def image_exists(self, image, registry):
-        """检查镜像是否存在"""
+    def run_skopeo(self, task_id, cmd, env, timeout_seconds, image=None, on_stdout=None, on_stderr=None, platform=None, layers=None, throughput_key=None):
+        """执行skopeo命令并逐行读取输出
+
+        stdout/stderr由两个读取线程逐行放入有界队列，当前线程依次处理，
+        内存占用与输出量无关。指定image时解析blob复制行并推送该镜像的传输进度，
+        多架构复制时通过platform和layers指定进度所属的平台及其层列表。
+        指定throughput_key时，成功复制的实际传输量和耗时计入该私服的吞吐量统计（不指定image时只统计，不推送进度）。
+        返回 (返回码, 最近的stderr行, 是否超时)。
+        """
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            env=env
+        )
+        with self.process_lock:
+            self.processes.setdefault(task_id, set()).add(process)
+        try:
+            return self.read_skopeo_output(task_id, process, timeout_seconds, image, on_stdout, on_stderr, platform, layers, throughput_key)
+        finally:
+            with self.process_lock:
+                processes = self.processes.get(task_id)
+                if processes is not None:
+                    processes.discard(process)
+                    if not processes:
+                        del self.processes[task_id]
+    
+    def read_skopeo_output(self, task_id, process, timeout_seconds, image=None, on_stdout=None, on_stderr=None, platform=None, layers=None, throughput_key=None):
+        """逐行处理skopeo输出直到进程退出，超时或任务取消时终止进程"""
+        lines = queue.Queue(maxsize=SKOPEO_OUTPUT_QUEUE_SIZE)
+        
+        def reader(stream, name):
+            try:
+                for line in stream:
+                    lines.put((name, line.rstrip('\n')))
+            finally:
+                lines.put((name, None))
+        
+        for stream, name in ((process.stdout, 'stdout'), (process.stderr, 'stderr')):
+            threading.Thread(target=reader, args=(stream, name), daemon=True).start()
+        
+        progress = None
+        if image or throughput_key:
+            progress = CopyProgress(layers if layers is not None else self.get_layer_sizes(image) if image else [])
+        stderr_tail = deque(maxlen=SKOPEO_STDERR_TAIL)
+        deadline = time.time() + timeout_seconds
+        open_streams = 2
+        timed_out = False
+        cancelled_at = None
+        
+        while open_streams:
+            if not timed_out and time.time() >= deadline:
+                timed_out = True
+                process.kill()
+            # 任务取消后先SIGTERM，宽限期内未退出再SIGKILL
+            if cancelled_at is None and sync_tasks[task_id]['status'] == 'cancelled':
+                cancelled_at = time.time()
+                if process.poll() is None:
+                    process.terminate()
+            elif cancelled_at is not None and process.poll() is None and time.time() - cancelled_at >= SKOPEO_TERMINATE_GRACE:
+                process.kill()
+            try:
+                name, line = lines.get(timeout=1)
+            except queue.Empty:
+                # 进程已退出但输出管道仍被残留的子进程占用时，不再等待
+                if process.poll() is not None:
+                    break
+                continue
+            if line is None:
+                open_streams -= 1
+                continue
+            if not line.strip():
+                continue
+            if name == 'stderr':
+                stderr_tail.append(line)
+                (on_stderr or (lambda l: self.emit_log(task_id, f"  {l}", "warning")))(line)
+            else:
+                (on_stdout or (lambda l: self.emit_log(task_id, f"  {l}")))(line)
+            if progress and progress.feed(line) and image:
+                self.emit_image_progress(task_id, image, progress.snapshot(), platform)
+        
+        process.wait()
+        if throughput_key and progress and process.returncode == 0 and not timed_out:
+            throughput_tracker.observe(throughput_key, progress.transferred_bytes(), time.time() - progress.start_time)
+        return process.returncode, list(stderr_tail), timed_out
+    
+    def remember_blobs(self, source_image, target_image, source_auth=None):
+        """记录复制到目标仓库的层（从清单缓存读取），之后复制到同一私服的其他仓库时可直接挂载"""
+        registry, repository, reference = parse_image_reference(source_image)
+        info = manifest_cache.get((registry, repository, reference), source_auth)
+        if info and info['platforms']:
+            host_item = select_host_platform(info['platforms'])
+            info = manifest_cache.get((registry, repository, host_item['digest']), source_auth) if host_item else None
+        if not info:
+            return
+        target_registry, target_repository, _ = parse_image_reference(target_image)
+        self.record_blob_locations(target_registry, target_repository, [info['config']] + [digest for digest, _ in info['layers']])
+    
+    def record_blob_locations(self, registry, repository, digests):
+        with self.blob_lock:
+            for digest in digests:
+                if digest:
+                    self.blob_locations[(registry, digest)] = repository
+                    self.blob_locations.move_to_end((registry, digest))
+            while len(self.blob_locations) > BLOB_LOCATION_CACHE_SIZE:
+                self.blob_locations.popitem(last=False)
+    
+    def fast_copy(self, task_id, source_image, target_image, registry, source_auth, env):
+        """仓库端快速复制，完成返回True
+
+        目标仓库已有相同摘要的清单（如重新打标签）时只上传清单；源镜像与目标在同一私服
+        （如在Harbor项目之间晋级）或层已复制到该私服的其他仓库时，通过跨仓库挂载复用层。
+        仍有层需要传输时返回False，由skopeo copy完成，已挂载的层不会重复上传。
+        """
+        if not REGISTRY_CLIENT_ENABLED or registry.get('compress_format') == 'zstd':
+            return False
         try:
-            cmd = ['skopeo', 'inspect', f'docker://{image}']
-            if registry.get('username') and registry.get('password'):
-                cmd.extend(['--creds', f"{registry['username']}:{registry['password']}"])
+            # 计划、增量检查和平台选择已读取过的清单直接从缓存取原文，不重复拉取（Docker Hub按拉取清单计数限流）
+            raw = self.cached_raw_manifest(source_image, source_auth, env)
+            manifest = json.loads(raw) if raw else {}
+            src_registry, src_repository, _ = parse_image_reference(source_image)
+            if 'manifests' in manifest:
+                # 与skopeo copy一致，清单列表只复制本机平台
+                host_item = select_host_platform(parse_manifest(raw)['platforms'])
+                if not host_item:
+                    return False
+                raw = self.cached_raw_manifest(f"{src_registry}/{src_repository}@{host_item['digest']}", source_auth, env)
+                manifest = json.loads(raw) if raw else {}
+            # skopeo默认转换为v2s2格式，只有不需要转换的清单才能原样写入
+            media_type = manifest.get('mediaType', '')
+            if media_type != DOCKER_MANIFEST_TYPE and not (media_type == OCI_MANIFEST_TYPE and registry.get('preserve_digests')):
+                return False
+            digest = 'sha256:' + hashlib.sha256(raw).hexdigest()
+            target_registry, target_repository, _ = parse_image_reference(target_image)
+            
+            if registry_client.head_manifest(f"{target_registry}/{target_repository}@{digest}", registry, env):
+                registry_client.put_manifest(target_image, raw, media_type, registry, env)
+                self.emit_log(task_id, f"⚡ 目标仓库已有相同镜像 ({digest[:19]})，仅写入标签", "success")
+                return True
+            
+            blobs = list(dict.fromkeys([manifest['config']['digest']] + [layer['digest'] for layer in manifest.get('layers', [])]))
+            mounted = 0
+            missing = 0
+            for blob in blobs:
+                if registry_client.blob_exists(target_registry, target_repository, blob, registry, env):
+                    continue
+                with self.blob_lock:
+                    from_repository = self.blob_locations.get((target_registry, blob))
+                if not from_repository and src_registry == target_registry:
+                    from_repository = src_repository
+                if from_repository and from_repository != target_repository and \
+                        registry_client.mount_blob(target_registry, target_repository, blob, from_repository, registry, env):
+                    mounted += 1
+                else:
+                    missing += 1
+            if missing:
+                if mounted:
+                    self.emit_log(task_id, f"⚡ 已从目标私服的其他仓库挂载 {mounted} 个层，其余 {missing} 个层由skopeo传输")
+                return False
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            return result.returncode == 0
-        except:
+            registry_client.put_manifest(target_image, raw, media_type, registry, env)
+            self.emit_log(task_id, f"⚡ 全部 {len(blobs)} 个层已在目标私服中（挂载 {mounted} 个），仅上传清单", "success")
+            self.record_blob_locations(target_registry, target_repository, blobs)
+            return True
+        except (RegistryClientError, ValueError, KeyError, TypeError) as e:
+            logger.debug(f"仓库端快速复制不可用，改用skopeo {source_image}: {e}")
             return False
     
+    def cached_image_size(self, image, platforms=None, source_auth=None):
+        """从清单缓存读取镜像大小（清单列表取本机平台或所选平台之和），未缓存时返回None"""
+        registry, repository, reference = parse_image_reference(image)
+        info = manifest_cache.get((registry, repository, reference), source_auth)
+        if not info or not info['platforms']:
+            return info['size'] if info else None
+        selected = select_platforms(info['platforms'], platforms) if platforms else [select_host_platform(info['platforms'])]
+        children = [manifest_cache.get((registry, repository, item['digest']), source_auth) for item in selected if item]
+        if not children or not all(children):
+            return None
+        return sum(child['size'] for child in children)
+    
+    def estimate_sizes(self, images, source_auth=None, proxy_config=None, platforms=None):
+        """并发读取镜像清单，返回 {镜像: 大小或None}，清单同时写入缓存供后续复制使用"""
+        env = build_proxy_env(proxy_config)
+        
+        def size_of(image):
+            try:
+                info = self.inspect_manifest(image, source_auth, env)
+                if info and info['platforms']:
+                    registry, repository, _ = parse_image_reference(image)
+                    selected = select_platforms(info['platforms'], platforms) if platforms else [select_host_platform(info['platforms'])]
+                    for item in selected:
+                        if item:
+                            self.inspect_manifest(f"{registry}/{repository}@{item['digest']}", source_auth, env)
+                return self.cached_image_size(image, platforms, source_auth)
+            except Exception as e:
+                logger.debug(f"读取镜像大小失败 {image}: {e}")
+                return None
+        
+        workers = max(1, min(SYNC_PLAN_CONCURRENCY, len(images)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(images, executor.map(size_of, images)))
+    
+    def copy_timeout(self, task_id, registry, size, default=1200, images=1):
+        """按镜像大小和私服实测吞吐量计算超时秒数，大小未知时使用默认值"""
+        timeout_seconds = throughput_tracker.timeout_for(registry['name'], size, images)
+        if timeout_seconds is None:
+            self.emit_log(task_id, f"镜像大小未知，使用默认超时 {default} 秒")
+            return default
+        throughput = throughput_tracker.estimate(registry['name'])
+        self.emit_log(task_id, f"镜像大小 {size / 1024 / 1024:.1f} MB，{registry['name']} 吞吐量约 {throughput / 1024 / 1024:.1f} MB/秒，超时时间 {timeout_seconds} 秒")
+        return timeout_seconds
+    
+    def prefetch_source_manifest(self, source_image, source_auth=None, env=None):
+        """预先读取源镜像清单（清单列表同时读取本机平台的子清单），用于统计传输进度"""
+        info = self.inspect_manifest(source_image, source_auth, env)
+        if info and info['platforms']:
+            host_item = select_host_platform(info['platforms'])
+            if host_item:
+                registry, repository, _ = parse_image_reference(source_image)
+                self.inspect_manifest(f"{registry}/{repository}@{host_item['digest']}", source_auth, env)
+        return info
+    
+    def run_with_retry(self, task_id, registry, attempt_fn):
+        """按私服的重试策略执行skopeo命令，临时性错误会退避后重试
+
+        attempt_fn 每次调用执行一次命令，返回 (返回码, 最近的stderr行, 是否超时)，返回最后一次的结果。
+        """
+        policy = RetryPolicy.for_registry(registry)
+        attempt = 1
+        while True:
+            if attempt > 1:
+                self.emit_log(task_id, f"🔁 开始第 {attempt}/{policy.max_attempts} 次尝试")
+            result = attempt_fn()
+            returncode, stderr_tail, timed_out = result
+            if returncode == 0 and not timed_out:
+                if attempt > 1:
+                    sync_metrics.inc('retry_successes')
+                return result
+            
+            if sync_tasks[task_id]['status'] == 'cancelled':
+                return result
+            
+            error_class = 'timeout' if timed_out else classify_skopeo_error('\n'.join(stderr_tail))
+            label = ERROR_CLASS_LABELS[error_class]
+            if not policy.should_retry(error_class, attempt):
+                sync_metrics.inc('copy_failures', error_class)
+                if attempt > 1:
+                    self.emit_log(task_id, f"已尝试 {attempt} 次仍失败（{label}），放弃重试", "error")
+                elif error_class not in policy.retry_on:
+                    self.emit_log(task_id, f"错误类型: {label}，不属于可重试的临时性错误")
+                return result
+            
+            delay = policy.backoff(attempt)
+            sync_metrics.inc('retries', error_class)
+            self.emit_log(task_id, f"⚠️ 第 {attempt}/{policy.max_attempts} 次尝试失败（{label}），{delay:.1f} 秒后重试", "warning")
+            if not self.wait_unless_cancelled(task_id, delay):
+                return result
+            attempt += 1
+    
+    def wait_unless_cancelled(self, task_id, seconds):
+        """等待指定秒数，任务被取消时提前返回False"""
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            if sync_tasks[task_id]['status'] == 'cancelled':
+                return False
+            time.sleep(min(0.5, max(0, deadline - time.time())))
+        return sync_tasks[task_id]['status'] != 'cancelled'
+    
+    def get_layer_sizes(self, image, source_auth=None):
+        """从清单缓存中读取镜像的层大小（清单列表取本机平台），未缓存时返回空列表"""
+        registry, repository, reference = parse_image_reference(image)
+        info = manifest_cache.get((registry, repository, reference), source_auth)
+        if info and info['platforms']:
+            host_item = select_host_platform(info['platforms'])
+            info = manifest_cache.get((registry, repository, host_item['digest']), source_auth) if host_item else None
+        return info['layers'] if info else []
+    
+    def emit_image_progress(self, task_id, image, snapshot, platform=None):
+        """推送单个镜像的传输进度，多架构复制时按平台分别记录"""
+        task = sync_tasks[task_id]
+        if platform:
+            with self.task_lock:
+                entry = task.setdefault('image_progress', {}).setdefault(image, {'platforms': {}})
+                entry['platforms'][platform] = snapshot
+            task_events.set_image_progress(task_id, image, platform, dict(snapshot, task_id=task_id, image=image, platform=platform))
+            return
+        task.setdefault('image_progress', {})[image] = snapshot
+        task_events.set_image_progress(task_id, image, None, dict(snapshot, task_id=task_id, image=image))
+    
+    def inspect_manifest(self, image, creds=None, env=None, timeout=60, use_cache=True):
+        """读取镜像清单原文并解析，镜像不存在或无法访问时返回None"""
+        cache_key = parse_image_reference(image)
+        if use_cache:
+            cached = manifest_cache.get(cache_key, creds)
+            if cached:
+                return cached
+        
+        raw = self.fetch_raw_manifest(image, creds, env, timeout)
+        if not raw:
+            return None
+        try:
+            info = parse_manifest(raw)
+        except Exception as e:
+            logger.debug(f"解析镜像清单失败 {image}: {e}")
+            return None
+        
+        manifest_cache.put(cache_key, info, raw, creds)
+        return info
+    
+    def cached_raw_manifest(self, image, creds=None, env=None, timeout=60):
+        """读取清单原文，优先使用缓存，拉取后同时写入缓存"""
+        cache_key = parse_image_reference(image)
+        raw = manifest_cache.get_raw(cache_key, creds)
+        if raw:
+            return raw
+        raw = self.fetch_raw_manifest(image, creds, env, timeout)
+        if raw:
+            try:
+                manifest_cache.put(cache_key, parse_manifest(raw), raw, creds)
+            except Exception as e:
+                logger.debug(f"解析镜像清单失败 {image}: {e}")
+        return raw
+    
+    def manifest_digest(self, image, creds=None, env=None, timeout=60, use_cache=True):
+        """读取镜像清单摘要，优先使用缓存和HEAD请求，镜像不存在时返回None"""
+        cached = manifest_cache.get(parse_image_reference(image), creds) if use_cache else None
+        if cached:
+            return cached['digest']
+        if REGISTRY_CLIENT_ENABLED:
+            try:
+                return registry_client.head_manifest(image, creds, env, timeout)
+            except RegistryClientError as e:
+                logger.debug(f"HEAD读取清单摘要失败，改用skopeo {image}: {e}")
+        info = self.inspect_manifest(image, creds, env, timeout, use_cache)
+        return info['digest'] if info else None
+    
+    def fetch_raw_manifest(self, image, creds=None, env=None, timeout=60):
+        """读取清单原文（字节），失败时返回None
+
+        优先使用内置仓库客户端，网络或认证方式不支持时回退到 skopeo inspect --raw。
+        """
+        if REGISTRY_CLIENT_ENABLED:
+            try:
+                return registry_client.get_manifest(image, creds, env, timeout)
+            except RegistryClientError as e:
+                logger.debug(f"读取镜像清单失败，改用skopeo {image}: {e}")
+        cmd = ['skopeo', 'inspect', '--raw', '--tls-verify=false']
+        # 认证信息通过临时认证文件传给skopeo，不出现在命令行中
+        with task_auth_files.temporary(parse_image_reference(image)[0], creds) as authfile:
+            if authfile:
+                cmd.extend(['--authfile', authfile])
+            cmd.append(f'docker://{image}')
+            try:
+                result = subprocess.run(cmd, capture_output=True, timeout=timeout, env=env)
+            except Exception as e:
+                logger.debug(f"读取镜像清单失败 {image}: {e}")
+                return None
+        if result.returncode != 0 or not result.stdout:
+            return None
+        return result.stdout
+    
+    def list_tags(self, repository, creds=None, env=None, timeout=120):
+        """列出仓库的全部标签，内置仓库客户端不可用时使用 skopeo list-tags"""
+        if REGISTRY_CLIENT_ENABLED:
+            try:
+                return registry_client.list_tags(repository, creds, env, timeout)
+            except RegistryClientError as e:
+                logger.debug(f"列出标签失败，改用skopeo {repository}: {e}")
+        cmd = ['skopeo', 'list-tags', '--tls-verify=false']
+        with task_auth_files.temporary(parse_image_reference(repository)[0], creds) as authfile:
+            if authfile:
+                cmd.extend(['--authfile', authfile])
+            cmd.append(f'docker://{repository}')
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, env=env)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f'skopeo list-tags 返回码 {result.returncode}')
+        return json.loads(result.stdout).get('Tags') or []
+    
+    def expand_repositories(self, task_id, repositories, source_auth=None, proxy_config=None):
+        """并行列出各仓库的标签并按过滤规则展开为镜像列表，返回 (镜像列表, [(失败的仓库, 错误信息)])"""
+        env = build_proxy_env(proxy_config)
+        
+        def expand(spec):
+            if isinstance(spec, str):
+                spec = {'repository': spec}
+            repository = spec['repository'].strip()
+            tags = self.list_tags(repository, source_auth, env)
+            selected = filter_tags(tags, spec.get('tag_filter'))
+            return repository, len(tags), selected
+        
+        images = []
+        failed = []
+        workers = max(1, min(TAG_LIST_CONCURRENCY, len(repositories)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(expand, spec) for spec in repositories]
+            # 按提交顺序收集结果，保证展开后的镜像顺序稳定
+            for spec, future in zip(repositories, futures):
+                name = spec if isinstance(spec, str) else spec.get('repository')
+                try:
+                    repository, tag_count, selected = future.result()
+                except Exception as e:
+                    self.emit_log(task_id, f"❌ 列出仓库 {name} 的标签失败: {e}", "error")
+                    failed.append((name, str(e)))
+                    continue
+                self.emit_log(task_id, f"仓库 {repository}: 共 {tag_count} 个标签，匹配过滤规则 {len(selected)} 个")
+                images.extend(f"{repository}:{tag}" for tag in selected)
+        return images, failed
+    
+    def image_exists(self, image, registry):
+        """检查镜像是否存在"""
+        return self.manifest_digest(image, registry) is not None
+    
     def emit_log(self, task_id, message, level="info"):
-        """发送日志到前端"""
-        log_entry = {
-            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'level': level,
-            'message': message
-        }
-        sync_tasks[task_id]['logs'].append(log_entry)
-        socketio.emit('sync_log', {'task_id': task_id, 'log': log_entry})
+        """发送日志到前端（task_id为None时不记录，如生成同步计划）"""
+        if task_id is None:
+            return
+        task = sync_tasks[task_id]
+        # 加锁保证并发工作项写入的日志序号、内存顺序和日志库中的顺序一致
+        with self.log_lock:
+            # seq为日志在任务中的序号（从0开始），增量查询以此作为游标
+            seq = task.get('log_total', 0)
+            log_entry = LogRecord(seq, time.time(), level, message)
+            # 内存中只保留最近的日志（定长deque自动丢弃最旧的），完整日志写入任务日志库
+            task['logs'].append(log_entry)
+            task['log_total'] = seq + 1
+            task_journal.append_log(task_id, log_entry)
+            task_events.add_log(task_id, log_entry)
     
     def emit_progress(self, task_id):
         """发送进度到前端"""
@@ -645,7 +3594,9 @@ class ImageSyncer:
             'current_image': task['current_image'],
             'status': task['status']
         }
-        socketio.emit('sync_progress', progress_data)
+        if task['status'] == 'queued':
+            progress_data['queue_position'] = sync_scheduler.queue_position(task_id)
+        task_events.set_progress(task_id, progress_data)
 
     def export_image_to_file(self, task_id, source_image, registry, replace_level, source_auth=None, proxy_config=None, target_project=None):
         """导出镜像到本地文件"""
@@ -668,12 +3619,12 @@ class ImageSyncer:
             
             # 添加基本参数
             cmd.extend(['--src-tls-verify=false'])
+            if skopeo_capabilities.supports('--retry-times'):
+                cmd.extend(['--retry-times', str(SKOPEO_RETRY_TIMES)])
             
-            # 添加源认证信息（如果提供）
-            if source_auth and source_auth.get('username') and source_auth.get('password'):
-                cmd.extend(['--src-creds', f"{source_auth['username']}:{source_auth['password']}"])
-                self.emit_log(task_id, f"添加源仓库认证信息，用户名: {source_auth['username']}")
-            else:
+            # 添加源认证文件参数（如果提供认证信息）
+            cmd.extend(self.auth_args(task_id, source_image, source_auth))
+            if not (source_auth and source_auth.get('username') and source_auth.get('password')):
                 self.emit_log(task_id, "源仓库: 公开访问")
             
             # 使用docker-archive格式，但指定目标镜像名称来保留标签
@@ -695,13 +3646,8 @@ class ImageSyncer:
             
             self.emit_log(task_id, f"目标规格: {target_spec}")
             
-            # 显示完整命令（隐藏密码）
-            safe_cmd = cmd.copy()
-            for i, part in enumerate(safe_cmd):
-                if '--src-creds' in safe_cmd and i > 0:
-                    if safe_cmd[i-1] == '--src-creds':
-                        safe_cmd[i] = safe_cmd[i].split(':')[0] + ':***'
-            self.emit_log(task_id, f"执行命令: {' '.join(safe_cmd)}")
+            # 显示完整命令（认证信息在认证文件中，命令行不包含密码）
+            self.emit_log(task_id, f"执行命令: {' '.join(cmd)}")
             
             # 执行导出命令
             self.emit_log(task_id, "开始执行skopeo导出命令...")
@@ -726,36 +3672,37 @@ class ImageSyncer:
                         env['no_proxy'] = proxy_config['no_proxy']
                         self.emit_log(task_id, f"代理排除列表: {proxy_config['no_proxy']}")
                 
-                process = subprocess.Popen(
-                    cmd, 
-                    stdout=subprocess.PIPE, 
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    universal_newlines=True,
-                    env=env
-                )
-                
-                # 设置超时时间（导出可能需要更长时间）
-                timeout_seconds = 600  # 10分钟
+                # 超时按镜像大小和实测吞吐量计算，大小未知时默认10分钟
+                self.prefetch_source_manifest(source_image, source_auth, env)
+                timeout_seconds = self.copy_timeout(task_id, registry, self.cached_image_size(source_image, source_auth=source_auth), default=600)
                 self.emit_log(task_id, f"设置导出超时时间: {timeout_seconds}秒")
                 
-                stdout, stderr = process.communicate(timeout=timeout_seconds)
-                
-                # 输出标准输出
-                if stdout:
-                    for line in stdout.strip().split('\n'):
-                        if line.strip():
-                            self.emit_log(task_id, f"  {line}")
+                def export_attempt():
+                    # docker-archive 不能写入已存在的文件，重试前删除上次残留的部分文件
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                    return self.run_skopeo(
+                        task_id, cmd, env, timeout_seconds,
+                        image=source_image, layers=self.get_layer_sizes(source_image, source_auth),
+                        on_stderr=lambda line: self.emit_log(task_id, f"  {line}", "warning"),
+                        throughput_key=registry['name']
+                    )
                 
-                # 输出错误信息
-                if stderr:
-                    for line in stderr.strip().split('\n'):
-                        if line.strip():
-                            self.emit_log(task_id, f"  {line}", "warning")
+                returncode, _, timed_out = self.run_with_retry(task_id, registry, export_attempt)
+                if (returncode != 0 or timed_out) and os.path.exists(file_path):
+                    # 失败、超时或任务取消时删除残留的部分导出文件
+                    os.remove(file_path)
+                    self.emit_log(task_id, f"已删除未完成的导出文件: {filename}")
+                if sync_tasks[task_id]['status'] == 'cancelled':
+                    self.emit_log(task_id, "任务已取消，导出中止", "warning")
+                    return False
+                if timed_out:
+                    self.emit_log(task_id, f"镜像导出超时({timeout_seconds}秒)，请检查网络连接", "error")
+                    return False
                 
-                self.emit_log(task_id, f"命令执行完成，返回码: {process.returncode}")
+                self.emit_log(task_id, f"命令执行完成，返回码: {returncode}")
                 
-                if process.returncode == 0:
+                if returncode == 0:
                     # 检查文件是否存在并获取大小
                     if os.path.exists(file_path):
                         file_size = os.path.getsize(file_path)
@@ -926,12 +3873,11 @@ echo "- 状态: 已完成"
                         self.emit_log(task_id, f"❌ 导出的文件不存在: {file_path}", "error")
                         return False
                 else:
-                    self.emit_log(task_id, f"skopeo导出命令失败，返回码: {process.returncode}", "error")
+                    self.emit_log(task_id, f"skopeo导出命令失败，返回码: {returncode}", "error")
                     return False
                     
-            except subprocess.TimeoutExpired:
-                process.kill()
-                self.emit_log(task_id, f"镜像导出超时({timeout_seconds}秒)，请检查网络连接", "error")
+            except OSError as e:
+                self.emit_log(task_id, f"启动skopeo导出命令失败: {e}", "error")
                 return False
         
         except Exception as e:
@@ -940,9 +3886,526 @@ echo "- 状态: 已完成"
             self.emit_log(task_id, f"异常详情: {traceback.format_exc()}", "error")
             return False
 
+# cron表达式别名和各字段（分 时 日 月 周）的取值范围，周字段的7与0都表示周日
+CRON_MACROS = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *'
+}
+CRON_FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+def parse_cron(expr):
+    """解析5段cron表达式（分 时 日 月 周），支持 * , - / 和 @hourly 等别名
+
+    返回 (分钟集合, 小时集合, 日集合, 月集合, 周集合, 是否限制日, 是否限制周)，表达式无效时抛出ValueError。
+    """
+    expr = (expr or '').strip()
+    parts = CRON_MACROS.get(expr, expr).split()
+    if len(parts) != 5:
+        raise ValueError('cron表达式需要5个字段：分 时 日 月 周')
+    fields = []
+    for part, (low, high) in zip(parts, CRON_FIELD_RANGES):
+        values = set()
+        for item in part.split(','):
+            base, slash, step = item.partition('/')
+            try:
+                step = int(step) if slash else 1
+                if base == '*':
+                    start, end = low, high
+                elif '-' in base:
+                    start, end = (int(value) for value in base.split('-', 1))
+                else:
+                    start = int(base)
+                    end = high if slash else start
+            except ValueError:
+                raise ValueError(f'cron字段无效: {item}')
+            if step < 1 or start < low or end > high or start > end:
+                raise ValueError(f'cron字段超出范围: {item}')
+            values.update(range(start, end + 1, step))
+        fields.append(values)
+    if 7 in fields[4]:
+        fields[4] = (fields[4] - {7}) | {0}
+    return tuple(fields) + (parts[2] != '*', parts[4] != '*')
+
+def cron_next(cron, after):
+    """返回after之后（不含）第一个满足cron的整分钟时间"""
+    minutes, hours, days, months, weekdays, day_restricted, weekday_restricted = cron
+    current = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = current + timedelta(days=366 * 5)
+    while current < limit:
+        if current.month not in months:
+            current = (current.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            continue
+        day_match = current.day in days
+        weekday_match = (current.weekday() + 1) % 7 in weekdays
+        # 与cron一致：日和周都有限制时满足其一即可
+        if day_restricted and weekday_restricted:
+            matched = day_match or weekday_match
+        else:
+            matched = day_match and weekday_match
+        if not matched:
+            current = current.replace(hour=0, minute=0) + timedelta(days=1)
+            continue
+        if current.hour not in hours:
+            current = current.replace(minute=0) + timedelta(hours=1)
+            continue
+        if current.minute not in minutes:
+            current += timedelta(minutes=1)
+            continue
+        return current
+    raise ValueError('cron表达式在5年内没有可执行的时间')
+
+def validate_sync_request(data):
+    """校验同步请求参数（/api/sync 和 /api/sync/plan 共用），返回错误信息或None"""
+    repositories = data.get('repositories', [])
+    target_registry = data.get('target_registry')
+    platforms = data.get('platforms')
+    if not data.get('images', []) and not repositories:
+        return '镜像列表不能为空'
+    for spec in repositories:
+        tag_filter = spec.get('tag_filter') if isinstance(spec, dict) else None
+        if isinstance(spec, dict) and not spec.get('repository'):
+            return '仓库名称不能为空'
+        try:
+            if tag_filter and tag_filter.get('regex'):
+                re.compile(tag_filter['regex'])
+            if tag_filter and tag_filter.get('exclude'):
+                re.compile(tag_filter['exclude'])
+        except re.error as e:
+            return f'标签过滤正则无效: {e}'
+        # 无效的semver或latest会让仓库展开为0个标签，任务“成功”却什么都没有同步
+        if tag_filter and tag_filter.get('semver'):
+            try:
+                validate_semver_range(tag_filter['semver'])
+            except ValueError as e:
+                return f'标签过滤规则无效: {e}'
+        if tag_filter and tag_filter.get('latest'):
+            latest = tag_filter['latest']
+            try:
+                valid = not isinstance(latest, bool) and int(latest) > 0 and float(latest) == int(latest)
+            except (TypeError, ValueError):
+                valid = False
+            if not valid:
+                return f'标签过滤规则无效: latest 必须是正整数，当前为 {latest!r}'
+    if not target_registry:
+        return '目标私服不能为空'
+    if isinstance(target_registry, list) and not all(isinstance(name, str) and name for name in target_registry):
+        return '目标私服列表格式无效'
+    if platforms and not isinstance(platforms, (str, list)):
+        return 'platforms 必须是 "all" 或平台列表'
+    return None
+
+class MirrorJobManager:
+    """定时镜像任务
+
+    管理员定义的周期性同步任务（源镜像或仓库+标签过滤、目标私服和项目、cron表达式）保存在
+    config/mirror_jobs.yaml，由后台调度循环每分钟检查是否到期。每次运行先用一次清单HEAD请求
+    读取每个标签的摘要，与日志库中上次同步成功时记录的摘要快照比较，只同步发生变化的标签。
+    """
+    FIELDS = ('name', 'images', 'repositories', 'target_registry', 'target_project', 'replace_level',
+              'source_auth', 'proxy_config', 'platforms', 'concurrency', 'schedule', 'enabled')
+    # 决定同步哪些镜像、同步到哪里的字段：修改后快照不再对应目标中的内容
+    TARGET_FIELDS = ('images', 'repositories', 'target_registry', 'target_project', 'replace_level', 'platforms')
+    
+    def __init__(self, config_file='config/mirror_jobs.yaml'):
+        self.config_file = config_file
+        self.lock = threading.Lock()
+        # 配置文件中无效的条目：不加载也不调度，保存配置时原样写回，便于管理员修正
+        self.invalid_entries = []
+        self.jobs = self.load_config()
+        self.state = {}  # job_id -> 下次运行时间、上次运行结果等运行时状态
+        self.scheduled = False
+    
+    def load_config(self):
+        """加载任务配置：为缺少ID的任务分配ID，无效的条目记录日志后跳过"""
+        try:
+            with open(self.config_file, 'r', encoding='utf-8') as f:
+                entries = (yaml.safe_load(f) or {}).get('jobs') or []
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.error(f"加载定时镜像任务配置失败: {e}")
+            return []
+        if not isinstance(entries, list):
+            logger.error("定时镜像任务配置无效：jobs必须是列表")
+            return []
+        
+        jobs = []
+        ids = set()
+        assigned = False
+        for index, entry in enumerate(entries, 1):
+            if not isinstance(entry, dict):
+                logger.error(f"定时镜像任务配置第 {index} 项不是字典，已跳过")
+                self.invalid_entries.append(entry)
+                continue
+            if not entry.get('id') or str(entry['id']) in ids:
+                entry['id'] = uuid.uuid4().hex[:12]
+                assigned = True
+            entry['id'] = str(entry['id'])
+            try:
+                error = self.validate(entry)
+            except Exception as e:
+                error = str(e)
+            if error:
+                logger.error(f"定时镜像任务配置第 {index} 项（{entry.get('name') or entry['id']}）无效，已跳过: {error}")
+                self.invalid_entries.append(entry)
+                continue
+            ids.add(entry['id'])
+            jobs.append(entry)
+        if assigned:
+            # 保存分配的ID，API和摘要快照使用稳定的任务ID
+            self.jobs = jobs
+            try:
+                self.save_config()
+            except OSError as e:
+                logger.error(f"保存定时镜像任务配置失败: {e}")
+        return jobs
+    
+    def save_config(self):
+        """保存任务配置，文件中可能包含源仓库认证信息，只允许当前用户读写"""
+        directory = os.path.dirname(self.config_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd = os.open(self.config_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            yaml.dump({'jobs': self.jobs + self.invalid_entries}, f, allow_unicode=True, default_flow_style=False)
+    
+    def validate(self, data):
+        """校验任务参数，返回错误信息或None"""
+        if not data.get('name'):
+            return '任务名称不能为空'
+        error = validate_sync_request(data)
+        if error:
+            return error
+        names = [data['target_registry']] if isinstance(data['target_registry'], str) else data['target_registry']
+        for name in names:
+            if not any(r['name'] == name for r in registry_config.registries):
+                return f'找不到私服配置 {name}'
+        try:
+            parse_cron(data.get('schedule'))
+        except ValueError as e:
+            return str(e)
+        return None
+    
+    def get(self, job_id):
+        return next((job for job in self.jobs if job['id'] == job_id), None)
+    
+    def create(self, data, username):
+        job = {field: data.get(field) for field in self.FIELDS if data.get(field) not in (None, '', [])}
+        job.update(id=uuid.uuid4().hex[:12], enabled=data.get('enabled', True), created_by=username,
+                   created_at=datetime.now().isoformat())
+        job.setdefault('replace_level', '1')
+        with self.lock:
+            self.jobs.append(job)
+            self.save_config()
+            self.schedule_next(job)
+        return job
+    
+    def update(self, job_id, data):
+        with self.lock:
+            job = self.get(job_id)
+            if not job:
+                return None
+            previous = {field: job.get(field) for field in self.TARGET_FIELDS}
+            stored_auth = job.get('source_auth')
+            for field in self.FIELDS:
+                if data.get(field) in (None, '', []):
+                    job.pop(field, None)
+                else:
+                    job[field] = data[field]
+            source_auth = job.get('source_auth')
+            if isinstance(source_auth, dict):
+                source_auth = {key: value for key, value in source_auth.items() if key != 'password_set'}
+                # API不返回密码：编辑时未填写密码且用户名不变，沿用已保存的密码
+                if not source_auth.get('password') and isinstance(stored_auth, dict) and stored_auth.get('password') \
+                        and source_auth.get('username') == stored_auth.get('username'):
+                    source_auth['password'] = stored_auth['password']
+                job['source_auth'] = source_auth
+            job['enabled'] = data.get('enabled', True)
+            job.setdefault('replace_level', '1')
+            self.save_config()
+            self.schedule_next(job)
+            retarget = any(job.get(field) != previous[field] for field in self.TARGET_FIELDS)
+        if retarget:
+            # 目标或镜像范围变化后，未变化的标签也需要同步到新的目标
+            task_journal.delete_snapshot(job_id)
+        return job
+    
+    def delete(self, job_id):
+        with self.lock:
+            job = self.get(job_id)
+            if not job:
+                return None
+            self.jobs.remove(job)
+            self.save_config()
+            self.state.pop(job_id, None)
+        task_journal.delete_snapshot(job_id)
+        return job
+    
+    def schedule_next(self, job, after=None):
+        """计算任务的下次运行时间，调用方需持有lock"""
+        state = self.state.setdefault(job['id'], {})
+        try:
+            state['next_run'] = cron_next(parse_cron(job['schedule']), after or datetime.now()) if job.get('enabled', True) else None
+        except (ValueError, TypeError) as e:
+            logger.error(f"定时镜像任务 {job.get('name')} 的cron表达式无效: {e}")
+            state['next_run'] = None
+    
+    def describe(self, job):
+        """任务配置加上运行时状态，用于API返回；源仓库密码只返回是否已设置"""
+        state = self.state.get(job['id'], {})
+        source_auth = job.get('source_auth')
+        if isinstance(source_auth, dict) and 'password' in source_auth:
+            source_auth = {key: value for key, value in source_auth.items() if key != 'password'}
+            job = dict(job, source_auth=dict(source_auth, password_set=bool(job['source_auth']['password'])))
+        return dict(job, **{key: value.isoformat() if isinstance(value, datetime) else value for key, value in state.items()})
+    
+    def start(self):
+        """计算所有任务的下次运行时间，并在全局调度循环中每分钟检查到期的任务"""
+        with self.lock:
+            for job in self.jobs:
+                self.schedule_next(job)
+            if self.scheduled:
+                return
+            self.scheduled = True
+        schedule.every(1).minutes.do(self.run_due)
+        logger.info(f"定时镜像任务调度已启动，共 {len(self.jobs)} 个任务")
+    
+    def run_due(self):
+        now = datetime.now()
+        with self.lock:
+            due = [job for job in self.jobs if self.state.get(job['id'], {}).get('next_run') and self.state[job['id']]['next_run'] <= now]
+            for job in due:
+                self.schedule_next(job, now)
+        for job in due:
+            self.trigger(job['id'], 'schedule')
+    
+    def trigger(self, job_id, reason='manual', images=None):
+        """在后台线程中运行任务，上一次运行尚未结束时返回False
+
+        指定images时只检查和同步这些镜像（webhook触发），否则检查任务的全部镜像。
+        """
+        with self.lock:
+            job = self.get(job_id)
+            if not job:
+                return False
+            state = self.state.setdefault(job_id, {})
+            if state.get('running'):
+                return False
+            state['running'] = True
+            job = dict(job)
+        threading.Thread(target=self.run_job, args=(job, reason, images), daemon=True).start()
+        return True
+    
+    def match(self, image):
+        """返回包含该源镜像的已启用任务，[(任务ID, 任务配置中的镜像写法)]
+
+        直接列出的镜像按规范化后的引用比较；仓库规则要求仓库相同且标签满足过滤规则。
+        返回任务中的写法是为了和快照中的键保持一致。
+        """
+        registry, repository, tag = parse_image_reference(image)
+        matched = []
+        for job in self.jobs:
+            if not job.get('enabled', True):
+                continue
+            listed = [item for item in job.get('images') or [] if parse_image_reference(item) == (registry, repository, tag)]
+            if listed:
+                matched.append((job['id'], listed[0]))
+                continue
+            for spec in job.get('repositories') or []:
+                if isinstance(spec, str):
+                    spec = {'repository': spec}
+                if parse_image_reference(spec['repository'])[:2] != (registry, repository):
+                    continue
+                # 新推送的标签不参与“保留最新N个”的比较，只按其余规则筛选
+                tag_filter = dict(spec.get('tag_filter') or {}, latest=None)
+                if filter_tags([tag], tag_filter):
+                    matched.append((job['id'], f"{spec['repository'].strip()}:{tag}"))
+                    break
+        return matched
+    
+    def run_job(self, job, reason, only_images=None):
+        """读取所有标签的摘要，只同步与上次快照不同的标签，同步成功后更新快照"""
+        job_id = job['id']
+        state = self.state[job_id]
+        started = datetime.now()
+        result = {'last_run': started, 'last_reason': reason, 'last_task_id': None, 'last_error': None,
+                  'synced': 0, 'skipped': 0, 'failed': 0, 'repository_errors': []}
+        try:
+            source_auth = job.get('source_auth')
+            proxy_config = job.get('proxy_config')
+            images = list(only_images or job.get('images') or [])
+            if job.get('repositories') and not only_images:
+                expanded, failed = image_syncer.expand_repositories(None, job['repositories'], source_auth, proxy_config)
+                existing = set(images)
+                images += [image for image in expanded if image not in existing]
+                result['repository_errors'] = [name for name, _ in failed]
+            
+            # 每个标签只需一次清单HEAD请求（Docker Hub的HEAD请求不计入拉取次数），
+            # 不使用清单缓存，避免缓存期内的标签变化被漏掉
+            env = build_proxy_env(proxy_config)
+            workers = max(1, min(SYNC_PLAN_CONCURRENCY, len(images)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                digests = dict(zip(images, executor.map(
+                    lambda image: image_syncer.manifest_digest(image, source_auth, env, use_cache=False), images)))
+            snapshot = task_journal.load_snapshot(job_id)
+            stale = set(snapshot) - set(images)
+            if stale and not only_images:
+                task_journal.delete_snapshot(job_id, stale)
+            # 读取不到摘要的镜像也交给同步流程，由它记录失败原因
+            changed = [image for image in images if not digests[image] or digests[image] != snapshot.get(image)]
+            result.update(checked=len(images), changed=len(changed))
+            if not changed:
+                result['last_status'] = 'unchanged'
+                logger.info(f"定时镜像任务 {job['name']}: {len(images)} 个标签均未变化")
+                return
+            
+            # 增量检查和快速复制从清单缓存读取源清单：缓存中可能还是标签变化前的摘要，
+            # 目标与旧摘要一致时镜像会被误判为已是最新而跳过，所以先让这些标签的缓存失效
+            for image in changed:
+                manifest_cache.invalidate(*parse_image_reference(image))
+            
+            task_id = f"mirror_{job_id}_{int(time.time())}"
+            result['last_task_id'] = task_id
+            state['last_task_id'] = task_id
+            logger.info(f"定时镜像任务 {job['name']}: {len(changed)}/{len(images)} 个标签有变化，启动同步任务 {task_id}")
+            image_syncer.sync_images(
+                task_id, changed, job['target_registry'], job.get('replace_level', '1'), source_auth, proxy_config,
+                job.get('target_project', ''), job.get('concurrency'), username=job.get('created_by'),
+                platforms=job.get('platforms')
+            )
+            task = sync_tasks.get(task_id, {})
+            finished = set(task.get('synced', [])) | set(task.get('skipped', []))
+            done = [image for image in changed if image in finished and digests[image]]
+            # 同步期间标签可能再次变化：只记录同步后源摘要仍与本次读取的摘要一致的标签，其余下次运行重新同步
+            with ThreadPoolExecutor(max_workers=max(1, min(SYNC_PLAN_CONCURRENCY, len(done)))) as executor:
+                verified = dict(zip(done, executor.map(
+                    lambda image: image_syncer.manifest_digest(image, source_auth, env, use_cache=False), done)))
+            task_journal.save_snapshot(job_id, {image: digests[image] for image in done if verified[image] == digests[image]})
+            result.update(last_status=task.get('status', 'failed'), synced=len(task.get('synced', [])),
+                          skipped=len(task.get('skipped', [])), failed=len(task.get('errors', [])))
+        except Exception as e:
+            logger.error(f"定时镜像任务 {job.get('name')} 运行失败: {e}")
+            result.update(last_status='failed', last_error=str(e))
+        finally:
+            with self.lock:
+                state.update(result, running=False, last_duration=round((datetime.now() - started).total_seconds(), 1))
+
+class WebhookCoalescer:
+    """合并短时间内到达的webhook事件
+
+    事件按定时镜像任务进入待处理集合，同一镜像重复推送只保留一次。距最后一个事件
+    WEBHOOK_COALESCE_WINDOW 秒内没有新事件，或距第一个事件超过 WEBHOOK_COALESCE_MAX_DELAY 秒时，
+    集合中的全部镜像作为该任务的一次运行提交（同一仓库的多个标签可合并为一次 skopeo sync）。
+    可变标签在短时间内被推送两次时，第二次运行可能落在清单缓存有效期内，run_job 会先让这些
+    标签的缓存失效，按最新摘要同步。
+    """
+    def __init__(self, window=WEBHOOK_COALESCE_WINDOW, max_delay=WEBHOOK_COALESCE_MAX_DELAY):
+        self.window = window
+        self.max_delay = max(window, max_delay)
+        self.lock = threading.Lock()
+        self.pending = {}  # job_id -> {'images': {镜像: None}, 'first': 时间, 'last': 时间}
+        self.thread = None
+        self.received = 0
+        self.coalesced = 0
+        self.dispatched = 0
+    
+    def add(self, job_id, image):
+        """加入一个事件，返回该镜像是否已在待处理集合中（被合并）"""
+        now = time.time()
+        with self.lock:
+            self.received += 1
+            entry = self.pending.setdefault(job_id, {'images': {}, 'first': now, 'last': now})
+            duplicate = image in entry['images']
+            entry['images'][image] = None
+            entry['last'] = now
+            if duplicate:
+                self.coalesced += 1
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.flush_loop, name='webhook-coalescer', daemon=True)
+                self.thread.start()
+        return duplicate
+    
+    def flush_loop(self):
+        """提交到期的事件，待处理集合为空时退出，add() 收到新事件时重新启动"""
+        while True:
+            time.sleep(min(1.0, self.window / 2 or 0.1))
+            now = time.time()
+            with self.lock:
+                if not self.pending:
+                    # 在锁内清除线程引用，add() 不会把事件留给正在退出的线程
+                    self.thread = None
+                    return
+                due = [job_id for job_id, entry in self.pending.items()
+                       if now - entry['last'] >= self.window or now - entry['first'] >= self.max_delay]
+                batches = {job_id: self.pending.pop(job_id) for job_id in due}
+            for job_id, entry in batches.items():
+                images = list(entry['images'])
+                if mirror_jobs.trigger(job_id, 'webhook', images):
+                    with self.lock:
+                        self.dispatched += 1
+                    logger.info(f"webhook触发定时镜像任务 {job_id}: {len(images)} 个镜像")
+                elif mirror_jobs.get(job_id):
+                    # 上一次运行尚未结束，放回集合稍后再提交
+                    with self.lock:
+                        current = self.pending.setdefault(job_id, {'images': {}, 'first': entry['first'], 'last': now})
+                        current['images'] = dict(entry['images'], **current['images'])
+                        current['last'] = now
+    
+    def stats(self):
+        with self.lock:
+            return {
+                'received': self.received,
+                'coalesced': self.coalesced,
+                'dispatched': self.dispatched,
+                'pending_jobs': len(self.pending),
+                'pending_images': sum(len(entry['images']) for entry in self.pending.values())
+            }
+
+def parse_webhook_events(payload):
+    """从webhook请求体中提取被推送的镜像引用列表
+
+    支持Harbor（type=PUSH_ARTIFACT）、Docker Registry通知（events[].action=push）
+    以及通用格式 {"image": "..."} / {"images": [...]}。只有带标签的推送会被提取。
+    """
+    images = []
+    if not isinstance(payload, dict):
+        return images
+    # Harbor webhook
+    if payload.get('type') in ('PUSH_ARTIFACT', 'pushImage'):
+        for resource in (payload.get('event_data') or {}).get('resources') or []:
+            url = resource.get('resource_url') or ''
+            if resource.get('tag') and url and '@' not in url:
+                images.append(url)
+    # Docker Registry通知
+    for event in payload.get('events') or []:
+        target = event.get('target') or {}
+        host = (event.get('request') or {}).get('host')
+        if event.get('action') == 'push' and target.get('tag') and target.get('repository') and host:
+            images.append(f"{host}/{target['repository']}:{target['tag']}")
+    # 通用格式（CI回调）
+    if isinstance(payload.get('image'), str):
+        images.append(payload['image'])
+    images.extend(item for item in payload.get('images') or [] if isinstance(item, str))
+    return list(dict.fromkeys(image.strip() for image in images if image.strip()))
+
 # 初始化组件
 registry_config = RegistryConfig()
 image_syncer = ImageSyncer(registry_config)
+sync_scheduler = SyncScheduler()
+manifest_cache = ManifestCache()
+registry_client = RegistryClient()
+sync_metrics = SyncMetrics()
+throughput_tracker = ThroughputTracker()
+task_auth_files = TaskAuthFiles()
+task_journal = TaskJournal()
+atexit.register(task_journal.flush)
+mirror_jobs = MirrorJobManager()
+webhook_coalescer = WebhookCoalescer()
+task_events = TaskEventBatcher()
+skopeo_capabilities = SkopeoCapabilities()
 
 # 认证相关路由
 @app.route('/login')
@@ -1135,33 +4598,123 @@ def start_sync():
         replace_level = data.get('replace_level', '1')
         source_auth = data.get('source_auth')  # 源仓库认证信息
         proxy_config = data.get('proxy_config')  # 代理配置
+        concurrency = data.get('concurrency')  # 任务内镜像并发数
+        incremental = data.get('incremental')  # 增量同步（跳过摘要未变化的镜像）
+        repositories = data.get('repositories', [])  # 按仓库+标签过滤规则同步
+        batch_mode = data.get('batch_mode')  # 同一仓库的多个标签合并为一次 skopeo sync
+        platforms = data.get('platforms')  # 多架构同步：'all' 或平台列表，如 ["linux/amd64", "linux/arm64"]
         
-        if not images:
-            return jsonify({'error': '镜像列表不能为空'}), 400
-        if not target_registry:
-            return jsonify({'error': '目标私服不能为空'}), 400
+        error = validate_sync_request(data)
+        if error:
+            return jsonify({'error': error}), 400
         
         # 生成任务ID
-        task_id = f"sync_{int(time.time())}"
+        task_id = f"sync_{int(time.time())}_{uuid.uuid4().hex[:8]}"
         
         # 记录操作日志
         username = session.get('username')
         project_info = f" (项目: {target_project})" if target_project else " (使用默认项目)"
-        logger.info(f"用户 {username} 启动同步任务 {task_id}: {len(images)}个镜像 -> {target_registry}{project_info}")
+        repo_info = f" + {len(repositories)}个仓库" if repositories else ""
+        target_info = ', '.join(target_registry) if isinstance(target_registry, list) else target_registry
+        logger.info(f"用户 {username} 启动同步任务 {task_id}: {len(images)}个镜像{repo_info} -> {target_info}{project_info}")
         
         # 启动同步任务
         thread = threading.Thread(
             target=image_syncer.sync_images,
-            args=(task_id, images, target_registry, replace_level, source_auth, proxy_config, target_project)
+            args=(task_id, images, target_registry, replace_level, source_auth, proxy_config, target_project, concurrency, username, incremental, repositories, batch_mode, platforms)
         )
         thread.start()
         
-        return jsonify({'task_id': task_id, 'message': '同步任务已启动'})
+        return jsonify({'task_id': task_id, 'message': '同步任务已提交'})
     
     except Exception as e:
         logger.error(f"启动同步任务失败: {e}")
         return jsonify({'error': '启动同步任务失败'}), 500
 
+@app.route('/api/sync/plan', methods=['POST'])
+@login_required
+def plan_sync():
+    """同步计划（演练）：参数与 /api/sync 相同，只检查不复制"""
+    try:
+        data = request.get_json()
+        error = validate_sync_request(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        plan = image_syncer.plan_sync(
+            data.get('images', []),
+            data.get('target_registry'),
+            data.get('replace_level', '1'),
+            source_auth=data.get('source_auth'),
+            proxy_config=data.get('proxy_config'),
+            target_project=data.get('target_project', '').strip(),
+            repositories=data.get('repositories', []),
+            platforms=data.get('platforms')
+        )
+        logger.info(f"用户 {session.get('username')} 生成同步计划: {plan['total_images']}个镜像，需复制 {plan['to_copy']} 个，耗时 {plan['elapsed']}秒")
+        return jsonify(plan)
+    
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        logger.error(f"生成同步计划失败: {e}")
+        return jsonify({'error': '生成同步计划失败'}), 500
+
+def task_status_delta(task_id, task):
+    """增量任务状态：只返回进度字段和序号不小于since的日志
+
+    响应带ETag（由游标和进度字段计算），客户端以If-None-Match重复查询且没有变化时返回304，
+    不生成响应体。客户端落后超过内存中保留的日志时从日志库补齐，每次最多 TASK_LOG_BUFFER_SIZE 条。
+    """
+    try:
+        since = max(0, int(request.args.get('since', 0)))
+    except ValueError:
+        return jsonify({'error': 'since必须是整数'}), 400
+    log_total = task.get('log_total', len(task.get('logs') or []))
+    state = {
+        'task_id': task_id,
+        'status': task.get('status'),
+        'progress': task.get('progress', 0),
+        'total': task.get('total', 0),
+        'current_image': task.get('current_image', ''),
+        'current_images': list(task.get('current_images') or []),
+        'queue_position': task.get('queue_position'),
+        'error': task.get('error'),
+        'synced_count': len(task.get('synced') or []),
+        'skipped_count': len(task.get('skipped') or []),
+        'error_count': len(task.get('errors') or []),
+        'log_total': log_total
+    }
+    etag = hashlib.sha1(json.dumps([since, state], default=str, sort_keys=True).encode()).hexdigest()[:20]
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+    
+    logs = list(task.get('logs') or [])
+    if since >= log_total:
+        entries = []
+    elif logs and logs[0].seq <= since:
+        entries = [record.to_dict() for record in logs[since - logs[0].seq:]]
+    else:
+        # 游标早于内存中保留的日志：等待日志库写入完成后按序号读取，只返回从since开始
+        # 连续的条目，游标不会跳过或重复日志
+        task_journal.flush()
+        entries = []
+        for entry in task_journal.load_logs(task_id, since, TASK_LOG_BUFFER_SIZE):
+            if entry['seq'] != since + len(entries):
+                break
+            entries.append(entry)
+    state.update({
+        'start_time': task.get('start_time'),
+        'end_time': task.get('end_time'),
+        'logs': entries,
+        'log_next': entries[-1]['seq'] + 1 if entries else since
+    })
+    response = jsonify(state)
+    response.set_etag(etag)
+    return response
+
 @app.route('/api/task/<task_id>')
 @login_required
 def get_task_status(task_id):
@@ -1169,20 +4722,21 @@ def get_task_status(task_id):
     try:
         task = sync_tasks.get(task_id)
         if task:
-            # 检查任务是否真的还在运行
-            if task.get('status') == 'running':
-                # 检查任务运行时间，如果超过合理时间范围，标记为异常
-                start_time = task.get('start_time')
-                if start_time:
-                    elapsed = datetime.now() - start_time
-                    max_runtime = timedelta(hours=2)  # 最大运行时间2小时
-                    if elapsed > max_runtime:
-                        logger.warning(f"任务 {task_id} 运行时间超过 {max_runtime}，标记为超时失败")
-                        task['status'] = 'failed'
-                        task['end_time'] = datetime.now()
-                        task['error'] = f'任务运行超时 ({elapsed})'
-                        
-            return jsonify(task)
+            # 运行中的任务不按总时长判定超时：每次复制都有按大小计算的超时（不超过SYNC_TIMEOUT_MAX），
+            # 在这里把任务改为失败并不会停止仍在执行的复制
+            if task.get('status') == 'queued':
+                # 排队中的任务返回当前排队位置
+                task = dict(task, queue_position=sync_scheduler.queue_position(task_id))
+            
+            if 'since' in request.args:
+                return task_status_delta(task_id, task)
+            return jsonify(dict(task, logs=[record.to_dict() for record in list(task.get('logs') or [])]))
+        task = task_journal.load_task(task_id)
+        if task:
+            # 内存中已清理或服务重启前结束的任务，从日志库读取
+            if 'since' in request.args:
+                return task_status_delta(task_id, task)
+            return jsonify(dict(task, logs=[record.to_dict() for record in task['logs']]))
         else:
             # 任务不存在，可能的原因：
             # 1. 任务已完成并被清理
@@ -1221,6 +4775,46 @@ def get_task_status(task_id):
             }]
         }), 500
 
+@app.route('/api/task/<task_id>/logs')
+@login_required
+def get_task_logs(task_id):
+    """分页读取任务的完整日志（offset为从0开始的日志序号，limit最大1000）"""
+    if task_id not in sync_tasks and task_journal.load_params(task_id) is None:
+        return jsonify({'error': '任务不存在'}), 404
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(max(1, int(request.args.get('limit', 200))), 1000)
+    except ValueError:
+        return jsonify({'error': 'offset和limit必须是整数'}), 400
+    # 先提交队列中的日志，保证读到最新写入的条目
+    task_journal.flush()
+    return jsonify({
+        'task_id': task_id,
+        'offset': offset,
+        'total': task_journal.count_logs(task_id),
+        'logs': task_journal.load_logs(task_id, offset, limit)
+    })
+
+@app.route('/api/task/<task_id>/logs/download')
+@login_required
+def download_task_logs(task_id):
+    """以文本文件下载任务的完整日志"""
+    if task_id not in sync_tasks and task_journal.load_params(task_id) is None:
+        return jsonify({'error': '任务不存在'}), 404
+    task_journal.flush()
+    logger.info(f"用户 {session.get('username')} 下载任务日志: {task_id}")
+    
+    def generate():
+        for entry in task_journal.iter_logs(task_id):
+            yield f"[{entry['timestamp']}] [{entry['level'].upper()}] {entry['message']}\n"
+    
+    filename = re.sub(r'[^\w.-]', '_', task_id) + '.log'
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/plain; charset=utf-8',
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
 @app.route('/api/task/<task_id>/cancel', methods=['POST'])
 @login_required
 def cancel_task(task_id):
@@ -1228,8 +4822,13 @@ def cancel_task(task_id):
     task = sync_tasks.get(task_id)
     if task:
         task['status'] = 'cancelled'
+        # 丢弃调度队列中尚未开始的工作项，释放的并发额度立即交给其他任务
+        sync_scheduler.cancel_task(task_id)
+        # 终止正在运行的skopeo进程，工作项随之结束并归还并发额度
+        terminated = image_syncer.terminate_task_processes(task_id)
+        image_syncer.save_task(task_id)
         username = session.get('username')
-        logger.info(f"用户 {username} 取消了同步任务 {task_id}")
+        logger.info(f"用户 {username} 取消了同步任务 {task_id}，终止 {terminated} 个skopeo进程")
         return jsonify({'message': '任务已取消'})
     else:
         return jsonify({'error': '任务不存在'}), 404
@@ -1971,6 +5570,45 @@ def handle_ping():
     """处理心跳ping，返回pong"""
     emit('pong', {'timestamp': time.time()})
 
+@socketio.on('subscribe_task')
+def handle_subscribe_task(data):
+    """订阅任务的日志和进度，并补发内存中序号不小于since的日志（订阅前已产生的日志）"""
+    if not user_manager.is_session_valid(session):
+        return
+    task_id = (data or {}).get('task_id')
+    if not task_id:
+        return
+    join_room(task_room(task_id))
+    task = sync_tasks.get(task_id)
+    if task:
+        try:
+            since = int((data or {}).get('since') or 0)
+        except (TypeError, ValueError):
+            since = 0
+        logs = [record.to_dict() for record in list(task.get('logs') or []) if record.seq >= since]
+        if logs:
+            emit('sync_batch', {'task_id': task_id, 'logs': logs})
+    emit('subscribed', {'task_id': task_id})
+
+@socketio.on('unsubscribe_task')
+def handle_unsubscribe_task(data):
+    """取消订阅任务"""
+    task_id = (data or {}).get('task_id')
+    if task_id:
+        leave_room(task_room(task_id))
+
+@socketio.on('subscribe_admin')
+def handle_subscribe_admin():
+    """管理员订阅所有任务的进度摘要"""
+    if not user_manager.is_session_valid(session):
+        return
+    user = user_manager.get_user(session.get('username'))
+    if not user or user.get('role') != 'admin':
+        emit('subscribe_error', {'error': '需要管理员权限'})
+        return
+    join_room(ADMIN_TASKS_ROOM)
+    emit('subscribed', {'room': 'admin'})
+
 # 添加自动清理功能
 def auto_cleanup_downloads():
     """自动清理下载目录中的旧文件"""
@@ -2395,6 +6033,121 @@ def delete_registry(registry_index):
         logger.error(f"删除仓库配置失败: {e}")
         return jsonify({'error': '删除仓库配置失败'}), 500
 
+@app.route('/api/admin/mirror-jobs', methods=['GET'])
+@admin_required
+def get_mirror_jobs():
+    """获取所有定时镜像任务及其运行状态"""
+    return jsonify([mirror_jobs.describe(job) for job in mirror_jobs.jobs])
+
+@app.route('/api/admin/mirror-jobs', methods=['POST'])
+@admin_required
+def create_mirror_job():
+    """创建定时镜像任务"""
+    try:
+        data = request.get_json() or {}
+        error = mirror_jobs.validate(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        current_user = session.get('username')
+        job = mirror_jobs.create(data, current_user)
+        logger.info(f"管理员 {current_user} 创建了定时镜像任务: {job['name']} ({job['schedule']})")
+        return jsonify({'success': True, 'message': '定时镜像任务创建成功', 'job': mirror_jobs.describe(job)})
+    
+    except Exception as e:
+        logger.error(f"创建定时镜像任务失败: {e}")
+        return jsonify({'error': '创建定时镜像任务失败'}), 500
+
+@app.route('/api/admin/mirror-jobs/<job_id>', methods=['PUT'])
+@admin_required
+def update_mirror_job(job_id):
+    """更新定时镜像任务"""
+    try:
+        data = request.get_json() or {}
+        error = mirror_jobs.validate(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        job = mirror_jobs.update(job_id, data)
+        if not job:
+            return jsonify({'error': '定时镜像任务不存在'}), 404
+        
+        current_user = session.get('username')
+        logger.info(f"管理员 {current_user} 更新了定时镜像任务: {job['name']}")
+        return jsonify({'success': True, 'message': '定时镜像任务更新成功', 'job': mirror_jobs.describe(job)})
+    
+    except Exception as e:
+        logger.error(f"更新定时镜像任务失败: {e}")
+        return jsonify({'error': '更新定时镜像任务失败'}), 500
+
+@app.route('/api/admin/mirror-jobs/<job_id>', methods=['DELETE'])
+@admin_required
+def delete_mirror_job(job_id):
+    """删除定时镜像任务及其摘要快照"""
+    try:
+        job = mirror_jobs.delete(job_id)
+        if not job:
+            return jsonify({'error': '定时镜像任务不存在'}), 404
+        
+        current_user = session.get('username')
+        logger.info(f"管理员 {current_user} 删除了定时镜像任务: {job['name']}")
+        return jsonify({'success': True, 'message': '定时镜像任务删除成功'})
+    
+    except Exception as e:
+        logger.error(f"删除定时镜像任务失败: {e}")
+        return jsonify({'error': '删除定时镜像任务失败'}), 500
+
+@app.route('/api/admin/mirror-jobs/<job_id>/run', methods=['POST'])
+@admin_required
+def run_mirror_job(job_id):
+    """立即运行一次定时镜像任务"""
+    if not mirror_jobs.get(job_id):
+        return jsonify({'error': '定时镜像任务不存在'}), 404
+    if not mirror_jobs.trigger(job_id, 'manual'):
+        return jsonify({'error': '该任务上一次运行尚未结束'}), 409
+    logger.info(f"管理员 {session.get('username')} 手动运行了定时镜像任务 {job_id}")
+    return jsonify({'success': True, 'message': '定时镜像任务已开始运行'})
+
+@app.route('/api/webhook', methods=['POST'])
+def webhook():
+    """接收镜像推送事件，匹配定时镜像任务后合并提交同步
+
+    令牌通过 Authorization 头（Bearer <令牌> 或直接填写令牌，Harbor的“认证头”即此形式）
+    或 X-Webhook-Token 头传递。事件不会立即触发同步，而是在合并窗口结束后按任务批量提交。
+    """
+    if not WEBHOOK_TOKEN:
+        return jsonify({'error': 'webhook未启用'}), 404
+    token = request.headers.get('X-Webhook-Token') or request.headers.get('Authorization', '')
+    if token.lower().startswith('bearer '):
+        token = token[7:]
+    if not secrets.compare_digest(token.strip().encode(), WEBHOOK_TOKEN.encode()):
+        logger.warning(f"webhook认证失败，来源: {request.remote_addr}")
+        return jsonify({'error': '认证失败'}), 401
+    
+    payload = request.get_json(silent=True)
+    if payload is None:
+        return jsonify({'error': '请求体不是有效的JSON'}), 400
+    
+    matched = {}
+    ignored = []
+    for image in parse_webhook_events(payload):
+        targets = mirror_jobs.match(image)
+        if not targets:
+            ignored.append(image)
+            continue
+        for job_id, job_image in targets:
+            webhook_coalescer.add(job_id, job_image)
+            matched.setdefault(job_id, []).append(job_image)
+    
+    if matched:
+        logger.info(f"webhook收到推送事件: {sum(len(v) for v in matched.values())} 个镜像匹配 {len(matched)} 个定时镜像任务")
+    return jsonify({
+        'success': True,
+        'matched': matched,
+        'ignored': ignored,
+        'coalesce_window': WEBHOOK_COALESCE_WINDOW
+    }), 202
+
 @app.route('/health')
 def health_check():
     """健康检查端点 - 增强版"""
@@ -2403,7 +6156,7 @@ def health_check():
         cleaned_count = cleanup_completed_tasks()
         
         # 获取任务统计
-        running_count, total_count = get_active_tasks_count()
+        running_count, queued_count, total_count = get_active_tasks_count()
         
         # 检查系统状态
         health_status = {
@@ -2411,19 +6164,27 @@ def health_check():
             'timestamp': datetime.now().isoformat(),
             'tasks': {
                 'running': running_count,
+                'queued': queued_count,
                 'total': total_count,
                 'cleaned_this_check': cleaned_count
             },
+            'scheduler': sync_scheduler.stats(),
+            'manifest_cache': manifest_cache.stats(),
+            'registry_client': dict(registry_client.stats(), enabled=REGISTRY_CLIENT_ENABLED),
+            'throughput': throughput_tracker.snapshot(),
+            'webhook': dict(webhook_coalescer.stats(), enabled=bool(WEBHOOK_TOKEN)),
+            'socket_events': task_events.stats(),
+            'skopeo': dict(skopeo_capabilities.summary(), running_processes=image_syncer.active_process_count()),
             'system': {
                 'memory_tasks': len(sync_tasks),
                 'cleanup_enabled': True
             }
         }
         
-        # 如果有太多运行中的任务，标记为警告
-        if running_count > 5:
+        # 如果有太多运行中或排队中的任务，标记为警告
+        if running_count + queued_count > 5:
             health_status['status'] = 'warning'
-            health_status['message'] = f'有 {running_count} 个任务正在运行，可能需要检查'
+            health_status['message'] = f'有 {running_count} 个任务正在运行、{queued_count} 个任务排队中，可能需要检查'
         
         return jsonify(health_status)
         
@@ -2451,6 +6212,53 @@ def metrics():
         metrics_data.append('# TYPE docker_sync_active_tasks gauge')
         metrics_data.append(f'docker_sync_active_tasks {len(sync_tasks)}')
         
+        # 调度器状态
+        scheduler_stats = sync_scheduler.stats()
+        metrics_data.append('# HELP docker_sync_scheduler_running Number of sync work items currently running')
+        metrics_data.append('# TYPE docker_sync_scheduler_running gauge')
+        metrics_data.append(f'docker_sync_scheduler_running {scheduler_stats["running"]}')
+        metrics_data.append('# HELP docker_sync_scheduler_queued_items Number of sync work items waiting in the queue')
+        metrics_data.append('# TYPE docker_sync_scheduler_queued_items gauge')
+        metrics_data.append(f'docker_sync_scheduler_queued_items {scheduler_stats["queued_items"]}')
+        
+        # 清单缓存命中情况
+        cache_stats = manifest_cache.stats()
+        metrics_data.append('# HELP docker_sync_manifest_cache_entries Number of cached manifest entries')
+        metrics_data.append('# TYPE docker_sync_manifest_cache_entries gauge')
+        metrics_data.append(f'docker_sync_manifest_cache_entries {cache_stats["size"]}')
+        metrics_data.append('# HELP docker_sync_manifest_cache_requests_total Manifest cache lookups by result')
+        metrics_data.append('# TYPE docker_sync_manifest_cache_requests_total counter')
+        metrics_data.append(f'docker_sync_manifest_cache_requests_total{{result="hit"}} {cache_stats["hits"]}')
+        metrics_data.append(f'docker_sync_manifest_cache_requests_total{{result="miss"}} {cache_stats["misses"]}')
+        
+        # 内置仓库客户端的请求数和新建连接数（两者之差反映连接复用情况）
+        client_stats = registry_client.stats()
+        metrics_data.append('# HELP docker_sync_registry_requests_total Registry API requests sent by the built-in client')
+        metrics_data.append('# TYPE docker_sync_registry_requests_total counter')
+        metrics_data.append(f'docker_sync_registry_requests_total {client_stats["requests"]}')
+        metrics_data.append('# HELP docker_sync_registry_connections_total Registry connections opened by the built-in client')
+        metrics_data.append('# TYPE docker_sync_registry_connections_total counter')
+        metrics_data.append(f'docker_sync_registry_connections_total {client_stats["connections"]}')
+        
+        # 各私服实测吞吐量（用于计算复制超时）
+        metrics_data.append('# HELP docker_sync_registry_throughput_bytes Smoothed observed copy throughput per registry in bytes per second')
+        metrics_data.append('# TYPE docker_sync_registry_throughput_bytes gauge')
+        for name, entry in sorted(throughput_tracker.snapshot().items()):
+            metrics_data.append(f'docker_sync_registry_throughput_bytes{{registry="{name}"}} {entry["throughput"]}')
+        
+        # 重试和失败次数（按错误类型）
+        metrics_data.append('# HELP docker_sync_retries_total Number of skopeo retries by error class')
+        metrics_data.append('# TYPE docker_sync_retries_total counter')
+        for error_class, count in sorted(sync_metrics.snapshot('retries').items()):
+            metrics_data.append(f'docker_sync_retries_total{{reason="{error_class}"}} {count}')
+        metrics_data.append('# HELP docker_sync_retry_successes_total Number of copies that succeeded after at least one retry')
+        metrics_data.append('# TYPE docker_sync_retry_successes_total counter')
+        metrics_data.append(f'docker_sync_retry_successes_total {sync_metrics.snapshot("retry_successes").get("", 0)}')
+        metrics_data.append('# HELP docker_sync_copy_failures_total Number of failed skopeo copies by error class')
+        metrics_data.append('# TYPE docker_sync_copy_failures_total counter')
+        for error_class, count in sorted(sync_metrics.snapshot('copy_failures').items()):
+            metrics_data.append(f'docker_sync_copy_failures_total{{reason="{error_class}"}} {count}')
+        
         # 用户数量
         user_count = len(user_manager.config.get('users', {}))
         metrics_data.append('# HELP docker_sync_users_total Total number of users')
@@ -2471,17 +6279,17 @@ def metrics():
             metrics_data.append('# TYPE docker_sync_download_files_total gauge')
             metrics_data.append(f'docker_sync_download_files_total {file_count}')
         
-        # Skopeo状态
-        try:
-            result = subprocess.run(['skopeo', '--version'], 
-                                  capture_output=True, text=True, timeout=5)
-            skopeo_status = 1 if result.returncode == 0 else 0
-        except Exception:
-            skopeo_status = 0
+        # Skopeo状态（读取缓存的探测结果，不在抓取时fork进程）
+        skopeo_status = 1 if skopeo_capabilities.get(refresh=False)['available'] else 0
         
         metrics_data.append('# HELP docker_sync_skopeo_available Skopeo tool availability')
         metrics_data.append('# TYPE docker_sync_skopeo_available gauge')
         metrics_data.append(f'docker_sync_skopeo_available {skopeo_status}')
+        skopeo_version = skopeo_capabilities.summary()['version']
+        if skopeo_version:
+            metrics_data.append('# HELP docker_sync_skopeo_info Detected skopeo version')
+            metrics_data.append('# TYPE docker_sync_skopeo_info gauge')
+            metrics_data.append(f'docker_sync_skopeo_info{{version="{skopeo_version}"}} 1')
         
         return '\n'.join(metrics_data), 200, {'Content-Type': 'text/plain; charset=utf-8'}
         
@@ -2504,18 +6312,27 @@ def cleanup_completed_tasks():
                 if age.total_seconds() > task_retention_hours * 3600:
                     tasks_to_remove.append(task_id)
     
-    # 移除过期的已完成任务
+    # 移除过期的已完成任务（日志库中保留 TASK_JOURNAL_RETENTION_DAYS 天，仍可查询）
     for task_id in tasks_to_remove:
         logger.info(f"清理过期任务: {task_id}")
         del sync_tasks[task_id]
+        image_syncer.saved_at.pop(task_id, None)
+    
+    try:
+        purged = task_journal.purge()
+        if purged:
+            logger.info(f"从任务日志库删除 {purged} 个过期任务")
+    except sqlite3.Error as e:
+        logger.error(f"清理任务日志库失败: {e}")
     
     return len(tasks_to_remove)
 
 def get_active_tasks_count():
-    """获取活跃任务数量"""
+    """获取活跃任务数量，返回 (运行中, 排队中, 全部)"""
     running_count = sum(1 for task in sync_tasks.values() if task.get('status') == 'running')
+    queued_count = sum(1 for task in sync_tasks.values() if task.get('status') == 'queued')
     total_count = len(sync_tasks)
-    return running_count, total_count
+    return running_count, queued_count, total_count
 
 @app.route('/api/admin/tasks/cleanup', methods=['POST'])
 @admin_required  
@@ -2540,7 +6357,7 @@ def manual_cleanup_tasks():
 def get_all_tasks_status():
     """获取所有任务状态（管理员）"""
     try:
-        running_count, total_count = get_active_tasks_count()
+        running_count, queued_count, total_count = get_active_tasks_count()
         
         # 统计各状态的任务数量
         status_counts = {}
@@ -2551,6 +6368,8 @@ def get_all_tasks_status():
         return jsonify({
             'total_tasks': total_count,
             'running_tasks': running_count,
+            'queued_tasks': queued_count,
+            'active_tasks': running_count + queued_count,
             'status_breakdown': status_counts,
             'memory_usage': len(sync_tasks),
             'tasks': list(sync_tasks.keys())  # 返回任务ID列表
@@ -2559,6 +6378,28 @@ def get_all_tasks_status():
         logger.error(f"获取任务状态失败: {e}")
         return jsonify({'error': '获取任务状态失败'}), 500
 
+background_services_started = False
+
+def start_background_services():
+    """启动后台服务：恢复中断的同步任务、自动清理调度器和定时镜像任务
+
+    gunicorn在worker初始化后通过post_worker_init钩子调用（预加载模式下不能在主进程中启动线程），
+    直接运行时在 __main__ 中调用。
+    """
+    global background_services_started
+    if background_services_started:
+        return
+    background_services_started = True
+    try:
+        image_syncer.resume_interrupted_tasks()
+    except Exception as e:
+        logger.error(f"恢复中断的任务失败: {e}")
+    start_cleanup_scheduler()
+    try:
+        mirror_jobs.start()
+    except Exception as e:
+        logger.error(f"启动定时镜像任务调度失败: {e}")
+
 if __name__ == '__main__':
     # 确保配置目录存在
     os.makedirs('config', exist_ok=True)
@@ -2574,8 +6415,9 @@ if __name__ == '__main__':
                 'registries': registry_config.get_default_config()
             }, f, default_flow_style=False, allow_unicode=True)
     
-    # 启动自动清理调度器
-    start_cleanup_scheduler()
+    # 恢复中断的任务并启动自动清理调度器（debug模式的重载监视进程不执行，只在实际服务的子进程中启动）
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     
     print("Docker镜像同步服务器启动中...")
     print("访问地址: http://localhost:5000")
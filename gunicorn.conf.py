@@ -63,4 +63,10 @@ limit_request_field_size = 8192
 # certfile = None
 
 # 重启配置
-max_worker_life_time = 3600  # 1小时后重启worker 
\ No newline at end of file
+max_worker_life_time = 3600  # 1小时后重启worker 
+
+# worker初始化后启动后台服务（恢复中断的同步任务、自动清理调度器）
+# preload_app 模式下应用在主进程中加载，后台线程必须在worker进程中启动
+def post_worker_init(worker):
+    from app import start_background_services
+    start_background_services()
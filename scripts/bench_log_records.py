@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""任务日志条目内存表示的基准测试
+
+对比原来的字典表示（每条日志调用 datetime.now().strftime 生成时间文本）和 app.LogRecord
+（__slots__ + epoch时间戳，序列化时才格式化），统计生成N条日志的CPU耗时、内存占用，
+以及全部序列化为API字典的耗时。
+
+用法：
+    python scripts/bench_log_records.py [条数，默认100000]
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 导入app会按相对路径创建 config/users.yaml（默认管理员）、任务日志库等文件，
+# 在临时目录中导入，基准测试不改动工作目录
+_cwd = os.getcwd()
+with tempfile.TemporaryDirectory(prefix='bench-log-records-') as _scratch:
+    os.chdir(_scratch)
+    try:
+        from app import LogRecord  # noqa: E402
+    finally:
+        os.chdir(_cwd)
+
+LEVELS = ('info', 'info', 'info', 'success', 'warning', 'error')
+
+
+def make_dict_entries(count):
+    return [{
+        'seq': seq,
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'level': LEVELS[seq % len(LEVELS)],
+        'message': f"Copying blob sha256:{seq:064x}"
+    } for seq in range(count)]
+
+
+def make_records(count):
+    return [LogRecord(seq, time.time(), LEVELS[seq % len(LEVELS)], f"Copying blob sha256:{seq:064x}")
+            for seq in range(count)]
+
+
+def serialize_dicts(entries):
+    return [dict(entry) for entry in entries]
+
+
+def serialize_records(records):
+    return [record.to_dict() for record in records]
+
+
+def measure(build, serialize, count):
+    """返回 (生成耗时秒, 内存占用字节, 序列化耗时秒)"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.process_time()
+    entries = build(count)
+    build_time = time.process_time() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    started = time.process_time()
+    serialize(entries)
+    serialize_time = time.process_time() - started
+    return build_time, memory, serialize_time
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    results = {
+        'dict': measure(make_dict_entries, serialize_dicts, count),
+        'LogRecord': measure(make_records, serialize_records, count),
+    }
+    print(f"{count} 条日志")
+    print(f"{'表示':<10} {'生成CPU(秒)':>12} {'内存(MB)':>10} {'每条(字节)':>10} {'序列化CPU(秒)':>14}")
+    for name, (build_time, memory, serialize_time) in results.items():
+        print(f"{name:<10} {build_time:>12.3f} {memory / 1024 / 1024:>10.1f} {memory / count:>10.0f} {serialize_time:>14.3f}")
+    old, new = results['dict'], results['LogRecord']
+    print(f"生成耗时减少 {(1 - new[0] / old[0]) * 100:.0f}%，内存减少 {(1 - new[1] / old[1]) * 100:.0f}%")
+
+
+if __name__ == '__main__':
+    main()
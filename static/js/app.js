@@ -213,6 +213,9 @@ class DockerSyncApp {
     constructor() {
         this.socket = null;
         this.currentTaskId = null;
+        // 已订阅推送的任务和下一条要显示的日志序号（用于订阅时补发和去重）
+        this.subscribedTaskId = null;
+        this.nextLogSeq = 0;
         this.pollingInterval = null;
         this.heartbeatInterval = null;
         this.hasReceivedWebSocketMessage = false;
@@ -282,6 +285,10 @@ class DockerSyncApp {
                 clearTimeout(connectionTimeout);
                 this.updateConnectionStatus('connected');
                 this.reconnectAttempts = 0;
+                // 服务端只向订阅了任务的连接推送，(重新)连接后需要重新订阅
+                if (this.currentTaskId) {
+                    this.subscribeTask(this.currentTaskId);
+                }
             });
 
             this.socket.on('disconnect', () => {
@@ -302,14 +309,22 @@ class DockerSyncApp {
                 console.log('服务器响应:', data.message);
             });
 
-            this.socket.on('sync_log', (data) => {
-                this.hasReceivedWebSocketMessage = true;
-                this.addLogEntry(data.log);
-            });
-
-            this.socket.on('sync_progress', (data) => {
+            // 服务端按固定间隔合并推送：一批日志 + 最新的任务进度 + 各镜像最新的传输进度
+            this.socket.on('sync_batch', (data) => {
                 this.hasReceivedWebSocketMessage = true;
-                this.updateProgress(data);
+                if (data.task_id !== this.currentTaskId) return;
+                (data.logs || []).forEach(log => {
+                    // 订阅时补发的日志可能与实时推送或轮询结果重复，按序号去重
+                    if (typeof log.seq === 'number') {
+                        if (log.seq < this.nextLogSeq) return;
+                        this.nextLogSeq = log.seq + 1;
+                    }
+                    this.addLogEntry(log);
+                });
+                if (data.progress) {
+                    this.updateProgress(data.progress);
+                }
+                (data.image_progress || []).forEach(item => this.updateImageProgress(item));
             });
 
             // 添加断线重连处理
@@ -353,6 +368,16 @@ class DockerSyncApp {
         }
     }
 
+    // 订阅任务的日志和进度推送，since之前的日志已显示，服务端只补发之后的日志
+    subscribeTask(taskId) {
+        if (!this.socket || !this.socket.connected) return;
+        if (this.subscribedTaskId && this.subscribedTaskId !== taskId) {
+            this.socket.emit('unsubscribe_task', { task_id: this.subscribedTaskId });
+        }
+        this.socket.emit('subscribe_task', { task_id: taskId, since: this.nextLogSeq });
+        this.subscribedTaskId = taskId;
+    }
+
     // 设置心跳检测
     setupHeartbeat() {
         if (this.heartbeatInterval) {
@@ -545,10 +570,12 @@ class DockerSyncApp {
 
             const result = await response.json();
             this.currentTaskId = result.task_id;
+            this.nextLogSeq = 0;
 
             // 更新UI状态
             this.updateSyncUI(true);
             this.clearLogs();
+            this.subscribeTask(this.currentTaskId);
             this.addLogEntry({
                 timestamp: new Date().toLocaleString(),
                 level: 'info',
@@ -693,7 +720,11 @@ class DockerSyncApp {
         
         progressText.textContent = `${data.progress} / ${data.total} (${percentage.toFixed(1)}%)`;
         
-        if (data.current_image) {
+        if (data.status === 'queued') {
+            currentImage.textContent = data.queue_position
+                ? `排队中，当前排队位置: ${data.queue_position}`
+                : '排队中...';
+        } else if (data.current_image) {
             currentImage.textContent = `当前: ${data.current_image}`;
         }
 
@@ -738,6 +769,22 @@ class DockerSyncApp {
         }
     }
 
+    // 更新单个镜像的传输进度
+    updateImageProgress(data) {
+        if (data.task_id !== this.currentTaskId) return;
+        const currentImage = document.getElementById('current-image');
+        const formatBytes = (bytes) => {
+            if (bytes >= 1024 * 1024 * 1024) return `${(bytes / 1024 / 1024 / 1024).toFixed(2)} GB`;
+            if (bytes >= 1024 * 1024) return `${(bytes / 1024 / 1024).toFixed(1)} MB`;
+            return `${(bytes / 1024).toFixed(0)} KB`;
+        };
+        const sizeText = data.bytes_total > 0
+            ? `${formatBytes(data.bytes_done)} / ${formatBytes(data.bytes_total)} (${data.percent}%)`
+            : `${data.blobs_done} / ${data.blobs_total} 层`;
+        const platformText = data.platform ? ` [${data.platform}]` : '';
+        currentImage.textContent = `当前: ${data.image}${platformText} - ${sizeText}，速率 ${formatBytes(data.throughput)}/s`;
+    }
+
     // 添加日志条目
     addLogEntry(log) {
         const logContainer = document.getElementById('log-container');
@@ -803,13 +850,22 @@ class DockerSyncApp {
     }
 
     // 获取任务状态
-    async getTaskStatus(taskId) {
+    // since为日志游标时只返回进度字段和新增日志；etag为上次响应的ETag，状态未变化时返回 {notModified: true}
+    async getTaskStatus(taskId, since = null, etag = null) {
         try {
-            const response = await fetch(`/api/task/${taskId}`);
+            const url = since === null ? `/api/task/${taskId}` : `/api/task/${taskId}?since=${since}`;
+            const headers = etag ? { 'If-None-Match': etag } : {};
+            // 不使用浏览器缓存，由ETag自行判断状态是否变化
+            const response = await fetch(url, { headers, cache: 'no-store' });
+            if (response.status === 304) {
+                return { notModified: true };
+            }
             if (!response.ok) {
                 throw new Error('获取任务状态失败');
             }
-            return await response.json();
+            const status = await response.json();
+            status.etag = response.headers.get('ETag');
+            return status;
         } catch (error) {
             console.error('获取任务状态失败:', error);
             return null;
@@ -830,6 +886,8 @@ class DockerSyncApp {
         // 轮询计数器，用于显示轮询时长
         let pollCount = 0;
         const startTime = Date.now();
+        // 上次响应的ETag，日志游标与WebSocket推送共用this.nextLogSeq，避免重复显示
+        let lastEtag = null;
         
         const pollTask = async () => {
             pollCount++;
@@ -837,26 +895,30 @@ class DockerSyncApp {
             console.log(`轮询第${pollCount}次，已运行${elapsed}秒`);
             
             try {
-                const status = await this.getTaskStatus(this.currentTaskId);
-                if (status) {
+                const status = await this.getTaskStatus(this.currentTaskId, this.nextLogSeq, lastEtag);
+                if (status && status.notModified) {
+                    // 任务状态和日志都没有变化，等待下一次轮询
+                } else if (status) {
+                    lastEtag = status.etag;
                     // 显示进度
                     this.updateProgress({
                         task_id: this.currentTaskId,
                         progress: status.progress,
                         total: status.total,
                         current_image: status.current_image,
-                        status: status.status
+                        status: status.status,
+                        queue_position: status.queue_position
                     });
 
                     // 显示新的日志条目
                     if (status.logs && status.logs.length > 0) {
-                        // 只显示新的日志（简单判断：比当前显示的多）
-                        const currentLogs = document.querySelectorAll('.log-entry').length;
-                        const startIndex = Math.max(0, currentLogs - 1); // 减1因为可能有启动消息
-                        
-                        for (let i = startIndex; i < status.logs.length; i++) {
-                            this.addLogEntry(status.logs[i]);
-                        }
+                        // 服务端只返回游标之后的日志，WebSocket可能已推送其中一部分
+                        status.logs
+                            .filter(log => typeof log.seq !== 'number' || log.seq >= this.nextLogSeq)
+                            .forEach(log => this.addLogEntry(log));
+                    }
+                    if (typeof status.log_next === 'number') {
+                        this.nextLogSeq = Math.max(this.nextLogSeq, status.log_next);
                     }
 
                     // 如果任务完成、失败、取消或不存在，停止轮询